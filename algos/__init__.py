@@ -1,7 +1,19 @@
 from .utils import (
+    set_in_memory,
+    ProjectEntries,
+    transform_coords,
+    get_rotated_crs,
+    get_normalized_bearing,
+    get_layer_extent,
+    get_min_area_bearing,
     get_pixel_aligned_extent,
     get_extent_layer,
     get_reprojected_vector_layer,
 )
 from .interpolate import clip_and_interpolate_dem
-from .sampling import get_utm_fire_layers, get_sampling_point_grid_layer
+from .mosaic import get_tile_filepaths, get_mosaic_layer
+from .sampling import (
+    get_utm_fire_layers,
+    get_sampling_point_grid_layer,
+    reload_fire_layer_bc,
+)
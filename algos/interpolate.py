@@ -1,11 +1,35 @@
-import processing
-from qgis.core import QgsProcessing
+import processing, uuid, math
+import numpy as np
+from osgeo import gdal
+from qgis.core import (
+    Qgis,
+    QgsProcessing,
+    QgsProcessingException,
+    QgsCoordinateTransform,
+    QgsProject,
+    QgsVectorLayer,
+    QgsFeature,
+    QgsGeometry,
+    QgsPoint,
+)
 from .utils import (
-    get_pixel_center_aligned_grid_layer,
-    set_grid_layer_z,
-    get_reprojected_vector_layer,
+    get_pixel_aligned_extent,
+    transform_coords,
+    release_layer,
 )
 
+_dtypes = {
+    Qgis.Byte: np.uint8,
+    Qgis.UInt16: np.uint16,
+    Qgis.Int16: np.int16,
+    Qgis.UInt32: np.uint32,
+    Qgis.Int32: np.int32,
+    Qgis.Float32: np.float32,
+    Qgis.Float64: np.float64,
+}
+
+OVERSAMPLING = 2  # min DEM samples per interpolated pixel side
+
 
 def clip_and_interpolate_dem(
     context,
@@ -19,46 +43,156 @@ def clip_and_interpolate_dem(
     text = f"\nInterpolate <{dem_layer}> layer at <{pixel_size}> pixel size..."
     feedback.setProgressText(text)
 
-    tmp = get_pixel_center_aligned_grid_layer(
+    xs, ys, zs = get_dem_points(
         context,
         feedback,
-        raster_layer=dem_layer,
+        dem_layer=dem_layer,
         extent=extent,
         extent_crs=extent_crs,
-        larger=2.0,  # FIXME what if downsampling as in CERN?
+        pixel_size=pixel_size,
+        larger=2.0,
     )
 
     if feedback.isCanceled():
         return {}
 
-    tmp = set_grid_layer_z(
-        context,
-        feedback,
-        grid_layer=tmp["OUTPUT"],
-        raster_layer=dem_layer,
-    )
+    # Transform all points at once, no reprojected grid layer needed
+    xs, ys = transform_coords(xs, ys, dem_layer.crs(), extent_crs)
 
     if feedback.isCanceled():
         return {}
 
-    tmp = get_reprojected_vector_layer(
-        context,
-        feedback,
-        vector_layer=tmp["OUTPUT"],
-        destination_crs=extent_crs,
-    )
+    grid_layer = _get_point_layer(context, feedback, xs, ys, zs, crs=extent_crs)
 
     if feedback.isCanceled():
         return {}
 
-    return _create_raster_from_grid(
+    tmp = _create_raster_from_grid(
         context,
         feedback,
-        grid_layer=tmp["OUTPUT"],
+        grid_layer=grid_layer,
         extent=extent,
         pixel_size=pixel_size,
         output=output,
     )
+    release_layer(context, grid_layer)
+    return tmp
+
+
+def get_dem_points(context, feedback, dem_layer, extent, extent_crs, pixel_size, larger):
+    """!
+    Read the DEM pixels covering the extent, decimated to the pixel_size.
+    @return (xs, ys, zs) np.arrays of the valid pixel centers, in the DEM crs.
+    """
+    text = f"Read DEM pixels..."
+    feedback.pushInfo(text)
+
+    aligned_extent = get_pixel_aligned_extent(
+        context,
+        feedback,
+        raster_layer=dem_layer,
+        extent=extent,
+        extent_crs=extent_crs,
+        to_centers=False,
+        larger=larger,
+    )
+    aligned_extent = aligned_extent.intersect(dem_layer.extent())
+    xres = dem_layer.rasterUnitsPerPixelX()
+    yres = dem_layer.rasterUnitsPerPixelY()
+    ncols = round(aligned_extent.width() / xres)
+    nrows = round(aligned_extent.height() / yres)
+    if ncols < 1 or nrows < 1:
+        raise QgsProcessingException(
+            f"DEM layer <{dem_layer.name()}> does not cover the extent, cannot proceed."
+        )
+
+    # Decimate when the DEM is much finer than pixel_size
+    tr = QgsCoordinateTransform(dem_layer.crs(), extent_crs, QgsProject.instance())
+    utm_extent = tr.transformBoundingBox(aligned_extent)
+    res = min(utm_extent.width() / ncols, utm_extent.height() / nrows)  # in m
+    factor = max(1, int(pixel_size / (OVERSAMPLING * res)))
+    buf_ncols, buf_nrows = math.ceil(ncols / factor), math.ceil(nrows / factor)
+    if factor > 1:
+        feedback.pushInfo(
+            f"DEM resolution {res:.2f}m, decimated by {factor} to {buf_ncols}·{buf_nrows} pixels."
+        )
+
+    zs, nodata = _read_window(
+        dem_layer, aligned_extent, ncols, nrows, buf_ncols, buf_nrows
+    )
+
+    # Pixel centers, rows from north
+    bxres, byres = aligned_extent.width() / buf_ncols, aligned_extent.height() / buf_nrows
+    xs = aligned_extent.xMinimum() + (np.arange(buf_ncols) + 0.5) * bxres
+    ys = aligned_extent.yMaximum() - (np.arange(buf_nrows) + 0.5) * byres
+    xs, ys = np.meshgrid(xs, ys)
+
+    valid = np.isfinite(zs)
+    if nodata is not None:
+        valid &= zs != nodata
+    return xs[valid], ys[valid], zs[valid]
+
+
+def _read_window(raster_layer, extent, ncols, nrows, buf_ncols, buf_nrows):
+    """!
+    Read a pixel aligned window of band 1, averaged to the buffer size.
+    GDAL picks the most suitable overview.
+    @return (np.array((buf_nrows, buf_ncols)), nodata value or None).
+    """
+    if raster_layer.providerType() == "gdal":
+        ds = gdal.Open(raster_layer.source().split("|")[0])
+        if ds:
+            band = ds.GetRasterBand(1)
+            layer_extent = raster_layer.extent()
+            xoff = round(
+                (extent.xMinimum() - layer_extent.xMinimum())
+                / raster_layer.rasterUnitsPerPixelX()
+            )
+            yoff = round(
+                (layer_extent.yMaximum() - extent.yMaximum())
+                / raster_layer.rasterUnitsPerPixelY()
+            )
+            zs = band.ReadAsArray(
+                xoff,
+                yoff,
+                ncols,
+                nrows,
+                buf_xsize=buf_ncols,
+                buf_ysize=buf_nrows,
+                buf_type=gdal.GDT_Float64,
+                resample_alg=gdal.GRIORA_Average,
+            )
+            if zs is not None:
+                return zs, band.GetNoDataValue()
+    # Other providers, eg. WCS
+    provider = raster_layer.dataProvider()
+    block = provider.block(1, extent, buf_ncols, buf_nrows)
+    if not block.isValid() or block.dataType() not in _dtypes:
+        raise QgsProcessingException(
+            f"Cannot read DEM layer <{raster_layer.name()}> pixels, cannot proceed."
+        )
+    zs = np.frombuffer(bytes(block.data()), dtype=_dtypes[block.dataType()])
+    zs = zs.reshape(buf_nrows, buf_ncols).astype(float)
+    return zs, block.noDataValue() if block.hasNoDataValue() else None
+
+
+def _get_point_layer(context, feedback, xs, ys, zs, crs):
+    """Get a memory PointZ layer from coordinate arrays, return its id."""
+    text = f"Create DEM point layer..."
+    feedback.pushInfo(text)
+
+    crs_def = crs.authid() or crs.toWkt()  # eg. the rotated domain crs
+    layer = QgsVectorLayer(
+        f"PointZ?crs={crs_def}&uid={{{uuid.uuid4()}}}", "dem_points", "memory"
+    )
+    features = list()
+    for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist()):
+        f = QgsFeature()
+        f.setGeometry(QgsGeometry(QgsPoint(x, y, z)))
+        features.append(f)
+    layer.dataProvider().addFeatures(features)
+    context.temporaryLayerStore().addMapLayer(layer)
+    return layer.id()
 
 
 def _create_raster_from_grid(
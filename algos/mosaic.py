@@ -0,0 +1,111 @@
+import os, glob
+from concurrent import futures
+from osgeo import gdal
+from qgis.core import (
+    QgsProcessingException,
+    QgsProcessingUtils,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsProject,
+    QgsRasterLayer,
+    QgsRectangle,
+)
+
+RASTER_SUFFIXES = (".tif", ".tiff", ".asc", ".img", ".vrt", ".bil", ".dem", ".hgt")
+
+
+def get_tile_filepaths(sources):
+    """!
+    Expand the tile sources.
+    @param sources: list of raster filepaths, directories, or glob patterns.
+    @return sorted list of raster filepaths.
+    """
+    filepaths = set()
+    for source in sources:
+        if os.path.isdir(source):
+            filepaths.update(
+                os.path.join(source, f)
+                for f in os.listdir(source)
+                if f.lower().endswith(RASTER_SUFFIXES)
+            )
+        elif glob.has_magic(source):
+            filepaths.update(glob.glob(source, recursive=True))
+        else:
+            filepaths.add(source)
+    return sorted(filepaths)
+
+
+def _get_tile_info(filepath):
+    """Read the tile header, return its (filepath, extent, crs wkt), or None."""
+    ds = gdal.Open(filepath)
+    if not ds:
+        return None
+    x0, dx, _, y1, _, dy = ds.GetGeoTransform()
+    x1, y0 = x0 + dx * ds.RasterXSize, y1 + dy * ds.RasterYSize
+    return filepath, QgsRectangle(x0, min(y0, y1), x1, max(y0, y1)), ds.GetProjection()
+
+
+def get_mosaic_layer(
+    context,
+    feedback,
+    sources,
+    extent,
+    extent_crs,
+    name,
+    max_workers=8,
+):
+    """!
+    Get a virtual mosaic (GDAL VRT) of the tiles intersecting the extent.
+    Tile headers are read in parallel, then GDAL reads only
+    the windows of the tiles that are requested.
+    @return QgsRasterLayer.
+    """
+    text = f"\nBuild <{name}> virtual mosaic..."
+    feedback.setProgressText(text)
+
+    filepaths = get_tile_filepaths(sources)
+    if not filepaths:
+        raise QgsProcessingException(
+            f"No raster tiles found in <{';'.join(sources)}>, cannot proceed."
+        )
+
+    # Read the tile headers in parallel, as on network file systems
+    # their latency dominates
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        infos = [i for i in executor.map(_get_tile_info, filepaths) if i]
+    if len(infos) < len(filepaths):
+        feedback.reportError(f"{len(filepaths) - len(infos)} unreadable tiles skipped.")
+
+    # Keep the tiles intersecting the extent, all tiles should share the crs
+    wkts = set(wkt for _, _, wkt in infos)
+    if len(wkts) != 1:
+        raise QgsProcessingException(
+            f"Raster tiles of <{name}> should share the same CRS, cannot proceed."
+        )
+    tile_crs = QgsCoordinateReferenceSystem.fromWkt(wkts.pop())
+    tr = QgsCoordinateTransform(extent_crs, tile_crs, QgsProject.instance())
+    tile_extent = tr.transformBoundingBox(extent)
+    filepaths = [f for f, e, _ in infos if e.intersects(tile_extent)]
+    feedback.pushInfo(
+        f"{len(filepaths)} of {len(infos)} tiles intersect the domain extent."
+    )
+    if not filepaths:
+        raise QgsProcessingException(
+            f"No raster tiles of <{name}> intersect the domain extent, cannot proceed."
+        )
+
+    # Build the virtual mosaic
+    vrt_filepath = QgsProcessingUtils.generateTempFilename(f"{name}.vrt")
+    vrt = gdal.BuildVRT(vrt_filepath, filepaths)
+    if not vrt:
+        raise QgsProcessingException(
+            f"Cannot build <{name}> virtual mosaic:\n{gdal.GetLastErrorMsg()}"
+        )
+    vrt = None  # write
+    layer = QgsRasterLayer(vrt_filepath, name, "gdal")
+    if not layer.isValid():
+        raise QgsProcessingException(
+            f"Invalid <{name}> virtual mosaic, cannot proceed."
+        )
+    context.temporaryLayerStore().addMapLayer(layer)
+    return layer
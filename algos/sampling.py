@@ -1,19 +1,23 @@
-import processing
+import processing, math
+from osgeo import gdal
 from qgis.PyQt.QtCore import QVariant
 from qgis.core import (
-    QgsProcessing,
     QgsProcessingException,
     QgsField,
     NULL,
     edit,
     QgsFeatureRequest,
+    QgsCoordinateTransform,
+    QgsProject,
 )
+from ..core import landuse
 from .utils import (
     get_pixel_center_aligned_grid_layer,
     set_grid_layer_z,
     set_grid_layer_value,
     get_reprojected_vector_layer,
     get_buffered_vector_layer,
+    release_layer,
 )
 
 
@@ -60,7 +64,9 @@ def get_sampling_point_grid_layer(
     landuse_type,
     utm_fire_layer,
     utm_b_fire_layer,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    landuse_mode=False,
+    landuse_priority=(),
+    output=None,
 ):
     text = f"\nCreate sampling grid layer for FDS geometry..."
     feedback.setProgressText(text)
@@ -77,27 +83,43 @@ def get_sampling_point_grid_layer(
     if feedback.isCanceled():
         return {}
 
+    grid_layer = tmp["OUTPUT"]
     tmp = set_grid_layer_z(
         context,
         feedback,
-        grid_layer=tmp["OUTPUT"],
+        grid_layer=grid_layer,
         raster_layer=utm_dem_layer,
         output=output,
     )
+    release_layer(context, grid_layer)
 
     if feedback.isCanceled():
         return {}
 
-    if landuse_layer:
-        # Set landuse
+    if landuse_layer and landuse_mode:
+        # Set landuse, by majority over each cell
+        _load_landuse_mode(
+            context,
+            feedback,
+            sampling_layer=tmp["OUTPUT"],
+            utm_dem_layer=utm_dem_layer,
+            landuse_layer=landuse_layer,
+            priority=landuse_priority,
+        )
+    elif landuse_layer:
+        # Set landuse, at cell centers
+        grid_layer = tmp["OUTPUT"]
         tmp = set_grid_layer_value(
             context,
             feedback,
-            grid_layer=tmp["OUTPUT"],
+            grid_layer=grid_layer,
             raster_layer=landuse_layer,
             column_prefix="landuse",
             output=output,
         )
+        release_layer(context, grid_layer)
+
+    if landuse_layer:
         if utm_fire_layer:
             # Set fire
             _load_fire_layer_bc(
@@ -140,6 +162,54 @@ def get_sampling_point_grid_layer(
     return tmp
 
 
+def reload_fire_layer_bc(
+    context,
+    feedback,
+    sampling_layer,
+    landuse_type,
+    utm_fire_layer,
+    utm_b_fire_layer,
+):
+    text = f"\nReload fire layer bc in sampling grid layer..."
+    feedback.setProgressText(text)
+
+    # Reset previous bcs
+    layer = context.getMapLayer(sampling_layer)
+    bc_idx = layer.dataProvider().fieldNameIndex("bc")
+    if bc_idx != -1:
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setNoAttributes()
+        layer.dataProvider().changeAttributeValues(
+            {f.id(): {bc_idx: NULL} for f in layer.getFeatures(request)}
+        )
+
+    if feedback.isCanceled():
+        return
+
+    # Set fire
+    _load_fire_layer_bc(
+        context,
+        feedback,
+        sampling_layer=sampling_layer,
+        fire_layer=utm_b_fire_layer,
+        bc_field="bc_out",
+        bc_default=landuse_type.bc_out_default,
+    )
+
+    if feedback.isCanceled():
+        return
+
+    _load_fire_layer_bc(
+        context,
+        feedback,
+        sampling_layer=sampling_layer,
+        fire_layer=utm_fire_layer,
+        bc_field="bc_in",
+        bc_default=landuse_type.bc_in_default,
+    )
+
+
 def _load_fire_layer_bc(
     context,
     feedback,
@@ -187,3 +257,83 @@ def _load_fire_layer_bc(
                 feedback.pushInfo(
                     f"<bc={bc}> applyed from fire layer <{fire_feat.id()}> feature"
                 )
+
+
+def _load_landuse_mode(
+    context,
+    feedback,
+    sampling_layer,
+    utm_dem_layer,
+    landuse_layer,
+    priority,
+):
+    text = f"Load landuse majority..."
+    feedback.pushInfo(text)
+
+    # Warp the landuse to a finer grid aligned to the dem cells,
+    # with at least one landuse pixel per fine pixel
+    extent = utm_dem_layer.extent()
+    res = utm_dem_layer.rasterUnitsPerPixelX()
+    tr = QgsCoordinateTransform(
+        landuse_layer.crs(), utm_dem_layer.crs(), QgsProject.instance()
+    )
+    landuse_extent = tr.transformBoundingBox(landuse_layer.extent())
+    landuse_res = min(
+        landuse_extent.width() / landuse_layer.width(),
+        landuse_extent.height() / landuse_layer.height(),
+    )
+    factor = max(1, math.ceil(res / landuse_res - 1e-6))
+    ncols = round(extent.width() / res)
+    nrows = round(extent.height() / res)
+    nodata = -2147483648
+    ds = gdal.Warp(
+        "",
+        landuse_layer.source(),
+        format="MEM",
+        dstSRS=utm_dem_layer.crs().toWkt(),
+        outputBounds=(
+            extent.xMinimum(),
+            extent.yMaximum() - nrows * res,
+            extent.xMinimum() + ncols * res,
+            extent.yMaximum(),
+        ),
+        width=ncols * factor,
+        height=nrows * factor,
+        resampleAlg="near",
+        outputType=gdal.GDT_Int32,
+        dstNodata=nodata,
+    )
+    if not ds:
+        raise QgsProcessingException(
+            f"Cannot warp landuse layer <{landuse_layer.name()}>:\n{gdal.GetLastErrorMsg()}"
+        )
+    feedback.pushInfo(f"Landuse majority of {factor}·{factor} pixels per cell.")
+    modes = landuse.get_block_mode(
+        ds.GetRasterBand(1).ReadAsArray(),
+        factor=factor,
+        nodata=nodata,
+        priority=priority,
+    )
+    ds = None
+
+    if feedback.isCanceled():
+        return
+
+    # Set the landuse of each sampling point, at the dem pixel centers
+    sampling_layer = context.getMapLayer(sampling_layer)
+    provider = sampling_layer.dataProvider()
+    if provider.fieldNameIndex("landuse1") == -1:
+        provider.addAttributes((QgsField("landuse1", QVariant.Int),))
+        sampling_layer.updateFields()
+    landuse_idx = provider.fieldNameIndex("landuse1")
+    x0, y1 = extent.xMinimum(), extent.yMaximum()
+    request = QgsFeatureRequest()
+    request.setNoAttributes()
+    changes = dict()
+    for f in sampling_layer.getFeatures(request):
+        p = f.geometry().asPoint()
+        col = min(max(int((p.x() - x0) / res), 0), ncols - 1)
+        row = min(max(int((y1 - p.y()) / res), 0), nrows - 1)
+        value = int(modes[row, col])
+        changes[f.id()] = {landuse_idx: value if value != nodata else NULL}
+    provider.changeAttributeValues(changes)
@@ -1,11 +1,158 @@
-import processing
+import processing, os, threading
+import numpy as np
+from osgeo import osr
 from qgis.core import (
     QgsProcessing,
+    QgsProcessingUtils,
     QgsRectangle,
+    QgsGeometry,
+    QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
     QgsProject,
 )
 
+try:
+    from pyproj import Transformer
+except ImportError:  # not always bundled with QGIS
+    Transformer = None
+
+
+# Intermediate outputs
+
+_local = threading.local()  # per export, as exports can run concurrently
+
+
+def set_in_memory(in_memory):
+    """Set if intermediate vector layers are kept in memory, instead of temp files."""
+    _local.in_memory = bool(in_memory)
+
+
+def get_output():
+    """Get the output for intermediate vector layers."""
+    in_memory = getattr(_local, "in_memory", True)
+    return in_memory and "memory:" or QgsProcessing.TEMPORARY_OUTPUT
+
+
+def release_layer(context, layer):
+    """Remove a consumed intermediate layer from the context, and its temp file."""
+    layer = context.getMapLayer(layer)
+    if not layer:
+        return
+    filepath = layer.source().split("|")[0]
+    context.temporaryLayerStore().removeMapLayer(layer.id())  # deleted
+    if filepath.startswith(QgsProcessingUtils.tempFolder()):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+
+
+# Project entries
+
+
+class ProjectEntries:
+    """
+    Buffer of project entry writes, as the project should be written
+    in the main thread only, while the algorithm runs in a background task.
+    """
+
+    def __init__(self) -> None:
+        self._entries = list()
+
+    def writeEntry(self, scope, key, value):
+        self._entries.append(("writeEntry", scope, key, value))
+
+    def writeEntryDouble(self, scope, key, value):
+        self._entries.append(("writeEntryDouble", scope, key, value))
+
+    def writeEntryBool(self, scope, key, value):
+        self._entries.append(("writeEntryBool", scope, key, value))
+
+    def apply(self, project):
+        """Write the buffered entries to the project, in the main thread."""
+        for method, scope, key, value in self._entries:
+            getattr(project, method)(scope, key, value)
+        self._entries.clear()
+
+
+# Coordinate transformation
+
+
+def transform_coords(xs, ys, source_crs, destination_crs):
+    """!
+    Transform coordinate arrays in one call.
+    @param xs, ys: coordinate arrays, in source_crs (x is easting or longitude).
+    @param source_crs, destination_crs: QgsCoordinateReferenceSystem.
+    @return (xs, ys) np.arrays, in destination_crs.
+    """
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    src_wkt, dst_wkt = source_crs.toWkt(), destination_crs.toWkt()
+    if Transformer:
+        tr = Transformer.from_crs(src_wkt, dst_wkt, always_xy=True)
+        return tuple(np.asarray(c).reshape(xs.shape) for c in tr.transform(xs, ys))
+    # Use GDAL, always available in QGIS
+    src_srs, dst_srs = osr.SpatialReference(), osr.SpatialReference()
+    for srs, wkt in ((src_srs, src_wkt), (dst_srs, dst_wkt)):
+        srs.ImportFromWkt(wkt)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)  # x, y
+    tr = osr.CoordinateTransformation(src_srs, dst_srs)
+    points = np.array(
+        tr.TransformPoints(np.column_stack((xs.ravel(), ys.ravel())).tolist())
+    ).reshape(-1, 3)
+    return points[:, 0].reshape(xs.shape), points[:, 1].reshape(ys.shape)
+
+
+# Domain frame
+
+
+def get_rotated_crs(wgs84_origin, bearing):
+    """!
+    Get a local conformal crs centered at the origin, with its y axis to the bearing.
+    @param wgs84_origin: QgsPoint in WGS 84.
+    @param bearing: azimuth of the y axis, clockwise from true north, in degrees.
+    @return QgsCoordinateReferenceSystem.
+    """
+    # Hotine oblique Mercator, its grid is rotated from true north by gamma - alpha
+    alpha = 45.0  # centerline azimuth, far from the 0° and 90° special cases
+    return QgsCoordinateReferenceSystem.fromProj(
+        f"+proj=omerc +lat_0={wgs84_origin.y():.9f} +lonc={wgs84_origin.x():.9f} "
+        f"+alpha={alpha} +gamma={alpha - bearing:.6f} +k_0=1 +x_0=0 +y_0=0 "
+        "+ellps=WGS84 +units=m +no_defs"
+    )
+
+
+def get_normalized_bearing(bearing):
+    """Get the equivalent domain bearing, as a rectangle is symmetric, in [-45, 45)."""
+    return (bearing + 45.0) % 90.0 - 45.0
+
+
+def get_layer_extent(layer, crs):
+    """Get the extent of the layer features, transformed to crs one by one."""
+    tr = QgsCoordinateTransform(layer.crs(), crs, QgsProject.instance())
+    extent = QgsRectangle()
+    extent.setMinimal()
+    for f in layer.getFeatures():
+        g = f.geometry()
+        g.transform(tr)
+        extent.combineExtentWith(g.boundingBox())
+    return extent
+
+
+def get_min_area_bearing(layer, crs):
+    """!
+    Get the bearing of the minimum area rectangle enclosing the layer features.
+    @param crs: local crs, with its y axis to true north.
+    @return bearing in degrees, clockwise from north.
+    """
+    tr = QgsCoordinateTransform(layer.crs(), crs, QgsProject.instance())
+    geoms = list()
+    for f in layer.getFeatures():
+        g = f.geometry()
+        g.transform(tr)
+        geoms.append(g)
+    _, _, angle, _, _ = QgsGeometry.collectGeometry(geoms).orientedMinimumBoundingBox()
+    return angle
+
 
 def get_pixel_center_aligned_grid_layer(
     context,
@@ -14,7 +161,7 @@ def get_pixel_center_aligned_grid_layer(
     extent,
     extent_crs,
     larger,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     text = f"Get center aligned sampling grid..."
     feedback.pushInfo(text)
@@ -116,7 +263,7 @@ def get_grid_layer(
     extent_crs,
     xres,
     yres,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     text = f"Get grid..."
     feedback.pushInfo(text)
@@ -129,7 +276,7 @@ def get_grid_layer(
         "TYPE": 0,  # Points
         "VOVERLAY": 0,
         "VSPACING": yres,
-        "OUTPUT": output,
+        "OUTPUT": output or get_output(),
     }
     return processing.run(
         "native:creategrid",
@@ -145,7 +292,7 @@ def set_grid_layer_z(
     feedback,
     grid_layer,
     raster_layer,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     # It works when grid and raster share the same crs
     text = f"Set grid elevation..."
@@ -157,7 +304,7 @@ def set_grid_layer_z(
         "NODATA": -999.0,
         "RASTER": raster_layer,
         "SCALE": 1,
-        "OUTPUT": output,
+        "OUTPUT": output or get_output(),
     }
     return processing.run(
         "native:setzfromraster",
@@ -174,7 +321,7 @@ def set_grid_layer_value(
     grid_layer,
     raster_layer,
     column_prefix,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     text = f"Set grid value ({column_prefix})..."
     feedback.pushInfo(text)
@@ -183,7 +330,7 @@ def set_grid_layer_value(
         "COLUMN_PREFIX": column_prefix,
         "INPUT": grid_layer,
         "RASTERCOPY": raster_layer,
-        "OUTPUT": output,
+        "OUTPUT": output or get_output(),
     }
     return processing.run(
         "qgis:rastersampling",
@@ -232,7 +379,7 @@ def get_reprojected_vector_layer(
     feedback,
     vector_layer,
     destination_crs,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     text = f"Reproject <{vector_layer}> vector layer to <{destination_crs}> crs..."
     feedback.pushInfo(text)
@@ -240,7 +387,7 @@ def get_reprojected_vector_layer(
     alg_params = {
         "INPUT": vector_layer,
         "TARGET_CRS": destination_crs,
-        "OUTPUT": output,
+        "OUTPUT": output or get_output(),
     }
     return processing.run(
         "native:reprojectlayer",
@@ -257,7 +404,7 @@ def get_buffered_vector_layer(
     vector_layer,
     distance,
     dissolve=False,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     text = f"Buffer <{vector_layer}> vector layer..."
     feedback.pushInfo(text)
@@ -270,7 +417,7 @@ def get_buffered_vector_layer(
         "JOIN_STYLE": 0,
         "MITER_LIMIT": 2,
         "DISSOLVE": dissolve,
-        "OUTPUT": output,
+        "OUTPUT": output or get_output(),
     }
     return processing.run(
         "native:buffer",
@@ -286,7 +433,7 @@ def get_extent_layer(
     feedback,
     extent,
     extent_crs,
-    output=QgsProcessing.TEMPORARY_OUTPUT,
+    output=None,
 ):
     text = f"Get extent layer..."
     feedback.pushInfo(text)
@@ -299,7 +446,7 @@ def get_extent_layer(
     )
     alg_params = {
         "INPUT": f"{x0}, {x1}, {y0}, {y1} [{extent_crs.authid()}]",
-        "OUTPUT": output,
+        "OUTPUT": output or get_output(),
     }
     return processing.run(
         "native:extenttolayer",
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+qgis2fds plugin import benchmark.
+
+Time the import of the plugin provider, as done by QGIS at startup,
+in fresh interpreters, and list the heavy modules it loads.
+Run it with the QGIS Python interpreter, on two commits to compare.
+
+Usage:
+    python benchmarks/bench_import.py --repeat 10
+"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import argparse, json, os, statistics, subprocess, sys
+
+PLUGIN_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("numpy", "processing", "osgeo.gdal", "multiprocessing")
+
+# Run in a fresh interpreter: QGIS is imported first, as it is already
+# loaded at plugin load, then the provider module is timed
+SCRIPT = """
+import importlib, json, sys, time
+import qgis.core
+before = set(sys.modules)
+t0 = time.perf_counter()
+importlib.import_module("{package}.qgis2fds_provider")
+dt = time.perf_counter() - t0
+print(json.dumps({{
+    "time": dt,
+    "modules": len(set(sys.modules) - before),
+    "heavy": [m for m in {heavy!r} if m in sys.modules and m not in before],
+}}))
+"""
+
+
+def measure(repeat):
+    """!
+    Measure the plugin provider import.
+    @param repeat: number of fresh interpreters.
+    @return list of dict, one per run.
+    """
+    script = SCRIPT.format(package=os.path.basename(PLUGIN_PATH), heavy=HEAVY_MODULES)
+    runs = list()
+    for _ in range(repeat):
+        out = subprocess.run(
+            (sys.executable, "-c", script),
+            cwd=os.path.dirname(PLUGIN_PATH),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        runs.append(json.loads(out.splitlines()[-1]))
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = measure(args.repeat)
+    times = [r["time"] * 1000.0 for r in runs]
+    print(
+        f"Provider import: {statistics.median(times):.1f} ms median, "
+        f"{min(times):.1f} ms min, over {len(times)} runs"
+    )
+    print(f"Modules loaded: {runs[0]['modules']}")
+    print(f"Heavy modules loaded: {', '.join(runs[0]['heavy']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
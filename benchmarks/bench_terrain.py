@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+qgis2fds terrain benchmarks.
+
+Time each terrain stage on synthetic fixtures and record its peak memory,
+without QGIS. Results are saved as JSON, for comparison across commits.
+
+Usage:
+    python benchmarks/bench_terrain.py --sizes 1e4 1e5 1e6 1e7 --output bench.json
+    python benchmarks/bench_terrain.py --compare old.json new.json
+"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import argparse, importlib.util, json, os, platform, subprocess, sys
+import tempfile, time, tracemalloc
+import numpy as np
+import fixtures
+
+PLUGIN_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_core():
+    """Import the plugin core package alone, without QGIS."""
+    core_path = os.path.join(PLUGIN_PATH, "core")
+    spec = importlib.util.spec_from_file_location(
+        "qgis2fds_core",
+        os.path.join(core_path, "__init__.py"),
+        submodule_search_locations=[core_path],
+    )
+    core = importlib.util.module_from_spec(spec)
+    sys.modules["qgis2fds_core"] = core
+    spec.loader.exec_module(core)
+    return core
+
+
+core = import_core()
+from qgis2fds_core import terrain
+from qgis2fds_core.terrainindex import TerrainIndex
+from qgis2fds_core.feedback import Feedback
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "--short", "HEAD"),
+            cwd=PLUGIN_PATH,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+# Stages, each one gets the state dict and updates it
+
+
+def stage_init_matrix(s):
+    # Flat list of points ordered by column, as from the sampling layer
+    s["m"] = terrain.get_matrix(s["points"])
+
+
+def stage_faces(s):
+    nrows, ncols = s["m"].shape[:2]
+    s["faces"] = terrain.get_faces(nrows, ncols)
+    s["landuses"] = terrain.get_face_landuses(s["m"][:, :, 3])
+
+
+def stage_verts(s):
+    s["gm"] = terrain.inject_ghost_centers(s["m"])
+    s["verts"] = terrain.get_verts(s["gm"])
+
+
+def stage_save_bingeom(s):
+    surf_idxs, _ = terrain.get_surf_indexes(s["landuses"], s["keys"])
+    terrain.write_bingeom(
+        filepath=os.path.join(s["path"], "bench_terrain.bingeom"),
+        geom_type=2,
+        n_surf_id=len(s["keys"]),
+        fds_verts=s["verts"],
+        fds_faces=s["faces"],
+        fds_surfs=surf_idxs + 1,
+        fds_volus=list(),
+    )
+
+
+def stage_init_obsts(s):
+    xbs, landuses = terrain.get_obsts(s["gm"], min_z=s["m"][:, :, 2].min())
+    surf_idxs, _ = terrain.get_surf_indexes(landuses, s["keys"])
+    surf_ids = [f"S{s['keys'][i]}" for i in surf_idxs]
+    s["xbs"], s["surf_ids"] = xbs, surf_ids
+    s["obsts"] = terrain.format_obsts(xbs, surf_ids)
+
+
+def stage_save_obsts(s):
+    # The OBST writer of OBSTTerrain, as FDSCase.save needs QGIS.
+    # The OBST terrain dominates the FDS case size
+    terrain.write_obsts(
+        filepath=os.path.join(s["path"], "bench_obst_001.fds"),
+        xbs=s["xbs"],
+        surf_ids=s["surf_ids"],
+        comment="! OBST terrain of <bench>, part 1/1",
+    )
+
+
+def stage_index(s):
+    s["index"] = TerrainIndex(s["m"])
+
+
+def stage_mesh_stats(s):
+    # The statistics of 1000 mesh sized rectangles
+    m, index = s["m"], s["index"]
+    x0, x1 = m[0, 0, 0], m[0, -1, 0]
+    y0, y1 = m[-1, 0, 1], m[0, 0, 1]
+    rng = np.random.default_rng(0)
+    for _ in range(1000):
+        xa, xb = np.sort(rng.uniform(x0, x1, 2))
+        ya, yb = np.sort(rng.uniform(y0, y1, 2))
+        index.get_stats((xa, xb, ya, yb))
+
+
+STAGES = (
+    ("init_matrix", stage_init_matrix),
+    ("faces", stage_faces),
+    ("verts", stage_verts),
+    ("save_bingeom", stage_save_bingeom),
+    ("init_obsts", stage_init_obsts),
+    ("index", stage_index),
+    ("mesh_stats", stage_mesh_stats),
+    ("save_obsts", stage_save_obsts),
+)
+
+
+def run_stage(func, state, repeat, memory):
+    """Run a stage, return its best time and its peak memory."""
+    times = list()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(state)
+        times.append(time.perf_counter() - t0)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run(sizes, repeat, memory, seed, feedback):
+    results = list()
+    for size in sizes:
+        feedback.setProgressText(f"\nSynthetic case of {size:.0e} cells...")
+        case = fixtures.get_case(int(size), seed=seed)
+        nrows, ncols = case["shape"]
+        m = terrain.get_matrix_from_grid(
+            elevation=case["elevation"],
+            landuse=case["landuse"],
+            origin=(-ncols * 5.0, nrows * 5.0),  # centered
+            pixel_size=10.0,
+        )
+        with tempfile.TemporaryDirectory() as path:
+            state = {
+                "points": np.ascontiguousarray(m.transpose(1, 0, 2)).reshape(-1, 4),
+                "keys": fixtures.LANDUSE_KEYS + (fixtures.BC_OUT, fixtures.BC_IN),
+                "path": path,
+            }
+            stages = dict()
+            for name, func in STAGES:
+                if feedback.isCanceled():
+                    return results
+                t, peak = run_stage(func, state, repeat=repeat, memory=memory)
+                stages[name] = {"time": t, "peak_memory": peak}
+                feedback.pushInfo(
+                    f"{name:>14}: {t:8.3f} s"
+                    + (peak is not None and f" {peak / 2**20:10.1f} MiB" or "")
+                )
+        results.append(
+            {"size": nrows * ncols, "shape": (nrows, ncols), "stages": stages}
+        )
+    return results
+
+
+def compare(old_filepath, new_filepath, feedback):
+    with open(old_filepath) as f:
+        old = json.load(f)
+    with open(new_filepath) as f:
+        new = json.load(f)
+    feedback.pushInfo(f"Compare <{old['commit']}> to <{new['commit']}>:")
+    old_results = {r["size"]: r for r in old["results"]}
+    for r in new["results"]:
+        o = old_results.get(r["size"])
+        if not o:
+            continue
+        feedback.pushInfo(f"\n{r['size']} cells:")
+        for name, stage in r["stages"].items():
+            if name not in o["stages"]:
+                continue
+            ratio = stage["time"] / (o["stages"][name]["time"] or 1e-9)
+            feedback.pushInfo(
+                f"{name:>14}: {o['stages'][name]['time']:8.3f} s -> {stage['time']:8.3f} s ({ratio:.2f}x)"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="qgis2fds terrain benchmarks")
+    parser.add_argument("--sizes", nargs="+", type=float, default=(1e4, 1e5, 1e6))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+    feedback = Feedback()
+
+    if args.compare:
+        compare(*args.compare, feedback=feedback)
+        return
+
+    commit = get_commit()
+    results = run(
+        sizes=args.sizes,
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        seed=args.seed,
+        feedback=feedback,
+    )
+    output = args.output or f"bench_{commit}.json"
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "seed": args.seed,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    feedback.pushInfo(f"\nResults saved to <{output}>")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds synthetic benchmark fixtures"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import numpy as np
+
+# Landfire F13 landuse types, see landuse_types/Landfire.gov_F13.csv
+LANDUSE_KEYS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 91, 92, 93, 98, 99)
+BC_OUT, BC_IN = 1000, 1001  # Ignition, Burned
+
+
+def get_shape(ncells):
+    """!
+    Get a grid shape with about ncells cells.
+    @param ncells: number of cells.
+    @return (nrows, ncols), with ncols about 1.5 nrows.
+    """
+    nrows = max(3, int(round((ncells / 1.5) ** 0.5)))
+    ncols = max(3, int(round(ncells / nrows)))
+    return nrows, ncols
+
+
+def get_fractal_field(shape, beta, rng):
+    """!
+    Get a fractal field by spectral synthesis, scaled to [0, 1].
+    @param shape: (nrows, ncols).
+    @param beta: spectral exponent, higher is smoother.
+    @param rng: np.random.Generator.
+    @return np.array(shape).
+    """
+    fy = np.fft.fftfreq(shape[0])[:, np.newaxis]
+    fx = np.fft.rfftfreq(shape[1])[np.newaxis, :]
+    f = np.hypot(fx, fy)
+    f[0, 0] = 1.0  # avoid division by zero
+    amplitude = f ** (-beta / 2.0)
+    amplitude[0, 0] = 0.0  # no mean
+    phase = rng.uniform(0.0, 2.0 * np.pi, amplitude.shape)
+    field = np.fft.irfft2(amplitude * np.exp(1j * phase), s=shape)
+    field -= field.min()
+    return field / (field.max() or 1.0)
+
+
+def get_dem(shape, rng, relief=800.0, base=200.0):
+    """!
+    Get a fractal DEM.
+    @return np.array(shape) of elevations in meters.
+    """
+    return base + relief * get_fractal_field(shape, beta=3.0, rng=rng)
+
+
+def get_landuse(shape, rng, keys=LANDUSE_KEYS):
+    """!
+    Get random landuse class patches.
+    @return np.array(shape) of landuse keys.
+    """
+    field = get_fractal_field(shape, beta=2.0, rng=rng)
+    classes = np.asarray(rng.permutation(keys))
+    idxs = np.minimum((field * len(classes)).astype(int), len(classes) - 1)
+    return classes[idxs]
+
+
+def get_fire_perimeter(shape, rng, nverts=32, radius=0.1):
+    """!
+    Get a random star shaped fire perimeter polygon, in grid coordinates.
+    @return np.array((nverts, 2)) of (col, row) polygon vertices.
+    """
+    nrows, ncols = shape
+    angles = np.sort(rng.uniform(0.0, 2.0 * np.pi, nverts))
+    radii = radius * min(shape) * rng.uniform(0.5, 1.0, nverts)
+    cx, cy = ncols * rng.uniform(0.3, 0.7), nrows * rng.uniform(0.3, 0.7)
+    return np.column_stack((cx + radii * np.cos(angles), cy + radii * np.sin(angles)))
+
+
+def get_polygon_mask(shape, polygon, scale=1.0):
+    """!
+    Get the cells whose center is inside the polygon (even-odd rule).
+    @param polygon: np.array((n, 2)) of (col, row) vertices.
+    @param scale: polygon scale factor around its centroid, for buffering.
+    @return np.array(shape, dtype=bool).
+    """
+    c = polygon.mean(axis=0)
+    polygon = c + (polygon - c) * scale
+    mask = np.zeros(shape, dtype=bool)
+    x = np.arange(shape[1]) + 0.5
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    rows = np.arange(int(max(0, y0.min())), int(min(shape[0], y0.max() + 1)))
+    for i in rows:  # only rows crossing the polygon
+        y = i + 0.5
+        crosses = (y0 > y) != (y1 > y)
+        xc = x0[crosses] + (y - y0[crosses]) * (x1 - x0)[crosses] / (y1 - y0)[crosses]
+        mask[i] = (x[:, np.newaxis] < xc[np.newaxis, :]).sum(axis=1) % 2 == 1
+    return mask
+
+
+def get_case(ncells, seed=0):
+    """!
+    Get a synthetic case.
+    @param ncells: approximate number of cells.
+    @param seed: random seed, for repeatable fixtures.
+    @return dict with elevation, landuse (fire bcs included), and fire polygon.
+    """
+    rng = np.random.default_rng(seed)
+    shape = get_shape(ncells)
+    elevation = get_dem(shape, rng)
+    landuse = get_landuse(shape, rng)
+    fire = get_fire_perimeter(shape, rng)
+    landuse[get_polygon_mask(shape, fire, scale=1.1)] = BC_OUT  # buffered
+    landuse[get_polygon_mask(shape, fire)] = BC_IN
+    return {
+        "shape": shape,
+        "elevation": elevation,
+        "landuse": landuse,
+        "fire": fire,
+    }
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core, numerical routines that do not depend on QGIS"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import sys
+
+
+class Feedback:
+    """
+    Lightweight QgsProcessingFeedback stand-in, for headless runs.
+    """
+
+    def __init__(self, verbose=True) -> None:
+        self.verbose = verbose
+        self.progress = 0.0
+        self._is_canceled = False
+
+    def pushInfo(self, info):
+        if self.verbose:
+            print(info)
+
+    def pushDebugInfo(self, info):
+        pass
+
+    def reportError(self, error, fatalError=False):
+        print(error, file=sys.stderr)
+
+    def setProgressText(self, text):
+        self.pushInfo(text)
+
+    def setProgress(self, progress):
+        self.progress = progress
+
+    def cancel(self):
+        self._is_canceled = True
+
+    def isCanceled(self):
+        return self._is_canceled
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import numpy as np
+
+
+def get_blocks(landuse, factor):
+    """!
+    Split a landuse raster in square blocks.
+    @param landuse: np.array((nrows * factor, ncols * factor)).
+    @param factor: block side in pixels.
+    @return np.array((nrows, ncols, factor * factor)).
+    """
+    nrows, ncols = landuse.shape[0] // factor, landuse.shape[1] // factor
+    return (
+        landuse[: nrows * factor, : ncols * factor]
+        .reshape(nrows, factor, ncols, factor)
+        .transpose(0, 2, 1, 3)
+        .reshape(nrows, ncols, factor * factor)
+    )
+
+
+def get_block_mode(landuse, factor, nodata=None, priority=()):
+    """!
+    Aggregate the landuse by blocks, choosing the majority class of each block.
+    @param landuse: np.array((nrows * factor, ncols * factor)) of landuse classes.
+    @param factor: block side in pixels.
+    @param nodata: nodata value, ignored in the majority.
+    @param priority: classes that win when present in a block, in order.
+    @return np.array((nrows, ncols)), nodata where the block has no data.
+    Ties are won by the lower class.
+    """
+    blocks = get_blocks(np.asarray(landuse), factor)
+    classes = np.unique(blocks)
+    if nodata is not None:
+        classes = classes[classes != nodata]
+    result = np.full(blocks.shape[:2], nodata if nodata is not None else 0)
+    result = result.astype(blocks.dtype)
+    best = np.zeros(blocks.shape[:2], dtype=np.int64)
+    for c in classes:  # few classes, vectorized over the blocks
+        counts = np.count_nonzero(blocks == c, axis=2)
+        better = counts > best
+        result[better], best[better] = c, counts[better]
+    for c in reversed(tuple(priority)):  # first priority applied last
+        result[np.any(blocks == c, axis=2)] = c
+    return result
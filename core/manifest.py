@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import glob, hashlib, json, os, time, uuid
+
+VERSION = 1  # bump when the artifacts change for the same inputs
+
+
+def write_atomic(filepath, write):
+    """!
+    Write a file atomically, so that readers never see it partially written.
+    @param filepath: destination filepath.
+    @param write: function writing the file to the filepath it receives.
+    """
+    dirpath, filename = os.path.split(filepath)
+    os.makedirs(dirpath, exist_ok=True)
+    # Same dir for an atomic replace, created by write with the usual permissions
+    tmp_filepath = os.path.join(dirpath, f".{filename}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        write(tmp_filepath)
+        os.replace(tmp_filepath, filepath)  # atomic
+    finally:
+        if os.path.isfile(tmp_filepath):
+            os.remove(tmp_filepath)
+
+
+def get_file_signature(filepath):
+    """!
+    Get the signature of an input file and its side cars, for fingerprints.
+    The side cars share its name, eg. the shapefile .dbf attributes,
+    except the .aux.xml statistics, rewritten by QGIS when the layer is opened.
+    @param filepath: filepath, or another data source string.
+    @return (filepath, (filename, size, mtime), ...), None if not set, or a unique
+    value if not a file, as its changes cannot be detected (eg. memory layers).
+    """
+    if not filepath:
+        return None
+    try:
+        if not os.path.isfile(filepath):
+            return filepath, time.time_ns()
+    except ValueError:
+        return filepath, time.time_ns()
+    root = os.path.splitext(filepath)[0]
+    filepaths = {
+        f for f in glob.glob(f"{glob.escape(root)}.*") if not f.endswith(".aux.xml")
+    } | {filepath}
+    signature = [filepath]
+    for f in sorted(filepaths):
+        try:
+            stat = os.stat(f)
+        except OSError:
+            continue
+        signature.append((os.path.basename(f), stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def _get_output_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest:
+    """
+    Manifest of the exported artifacts, with the fingerprints
+    of the inputs that produced them, to skip their regeneration.
+    Each entry is: {"fingerprint": str, "files": {filename: [size, mtime]}, "meta": dict}
+    """
+
+    def __init__(self, path, name) -> None:
+        self.path = path
+        self.filename = f"{name}_manifest.json"
+        self.filepath = os.path.join(path, self.filename)
+        try:
+            with open(self.filepath) as f:
+                self._entries = json.load(f)
+            if self._entries.pop("version", None) != VERSION:
+                self._entries = dict()
+        except (OSError, ValueError, AttributeError):
+            self._entries = dict()
+
+    @staticmethod
+    def get_fingerprint(*items):
+        """Get the fingerprint of the inputs, eg. file signatures, crs, and extent."""
+        return hashlib.sha1(repr(items).encode("utf-8")).hexdigest()
+
+    def is_current(self, key, fingerprint):
+        """Check if the artifact files exist unchanged, from the same inputs."""
+        entry = self._entries.get(key)
+        if not entry or entry["fingerprint"] != fingerprint:
+            return False
+        return all(
+            signature is not None  # missing when recorded
+            and _get_output_signature(os.path.join(self.path, filename)) == signature
+            for filename, signature in entry["files"].items()
+        )
+
+    def get_meta(self, key):
+        """Get the metadata of the artifact, eg. its filenames."""
+        return self._entries[key]["meta"]
+
+    def set(self, key, fingerprint, filenames, **meta):
+        """Record the artifact files, just written from the fingerprinted inputs."""
+        self._entries[key] = {
+            "fingerprint": fingerprint,
+            "files": {
+                f: _get_output_signature(os.path.join(self.path, f)) for f in filenames
+            },
+            "meta": meta,
+        }
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def save(self):
+        """Save the manifest, atomically."""
+
+        def write(filepath):
+            with open(filepath, "w") as f:
+                json.dump(dict(version=VERSION, **self._entries), f, indent=1)
+
+        write_atomic(self.filepath, write)
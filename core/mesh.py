@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+from math import ceil, floor, sqrt
+import numpy as np
+
+# FDS MESH vertical stretching with &TRNZ.
+# FDS maps the uniform computational z (CC) of each mesh to the physical z (PC),
+# piecewise linearly through the given nodes, the mesh z bounds are fixed.
+# Cells are fine (dz) in the terrain band of each mesh, and coarser
+# (up to dz · ratio) below and above it. All meshes of a MULT share KBAR.
+
+FINE_CELLS_AGL = 5  # fine cells over the local terrain max
+
+
+def get_stretched_kbar(z0, z1, dz, bands, ratio):
+    """!
+    Get the KBAR shared by the stretched meshes.
+    @param z0: mesh bottom.
+    @param z1: mesh top.
+    @param dz: fine cell size.
+    @param bands: list of (zb0, zb1) fine bands, one per mesh.
+    @param ratio: max coarse to fine cell size ratio.
+    @return KBAR, never more than the uniform one.
+    """
+    kbar = 0
+    for zb0, zb1 in bands:
+        n_fine = ceil((zb1 - zb0) / dz - 1e-6)
+        n_below = ceil((zb0 - z0) / (dz * ratio) - 1e-6)
+        n_above = ceil((z1 - zb1) / (dz * ratio) - 1e-6)
+        kbar = max(kbar, n_fine + n_below + n_above)
+    return min(kbar, int((z1 - z0) / dz))
+
+
+def get_trnz(z0, z1, kbar, band, dz):
+    """!
+    Get the &TRNZ nodes of a mesh, with the fine band and the coarse cells around it.
+    @param z0: mesh bottom.
+    @param z1: mesh top.
+    @param kbar: mesh KBAR.
+    @param band: (zb0, zb1) fine band, inside the mesh z bounds.
+    @param dz: fine cell size.
+    @return list of (cc, pc) nodes, empty for a uniform mesh.
+    """
+    zb0, zb1 = band
+    hb, ha = zb0 - z0, z1 - zb1  # coarse heights, below and above
+    n_fine = min(ceil((zb1 - zb0) / dz - 1e-6), kbar)
+    n_rest = kbar - n_fine
+    if n_rest < (hb > 0.0) + (ha > 0.0) or hb + ha <= 0.0:
+        return list()  # no room for stretching
+    n_below = round(n_rest * hb / (hb + ha))
+    if hb > 0.0:
+        n_below = max(n_below, 1)
+    if ha > 0.0:
+        n_below = min(n_below, n_rest - 1)
+    dcc = (z1 - z0) / kbar
+    return [
+        (z0 + k * dcc, z)
+        for k, z in ((n_below, zb0), (n_below + n_fine, zb1))
+        if 0 < k < kbar
+    ]
+
+
+def get_stretched_z(zs, z0, z1, nodes):
+    """!
+    Map the computational z to the physical z, as FDS does with &TRNZ.
+    @param zs: np.array of computational z, ghost cells included.
+    @param z0: mesh bottom.
+    @param z1: mesh top.
+    @param nodes: list of (cc, pc) nodes.
+    @return np.array of physical z, linearly extrapolated out of the mesh.
+    """
+    if not nodes:
+        return zs
+    cc = np.array((z0, *(n[0] for n in nodes), z1))
+    pc = np.array((z0, *(n[1] for n in nodes), z1))
+    s0 = (pc[1] - pc[0]) / (cc[1] - cc[0])
+    s1 = (pc[-1] - pc[-2]) / (cc[-1] - cc[-2])
+    return np.where(
+        zs < z0,
+        z0 + (zs - z0) * s0,
+        np.where(zs > z1, z1 + (zs - z1) * s1, np.interp(zs, cc, pc)),
+    )
+
+
+# Nested fine meshes.
+# Fine meshes cover a refinement rectangle, snapped to the coarse cell faces,
+# with an integer coarse to fine cell size ratio, as required by FDS.
+# Listed before the coarse meshes, they take precedence where they overlap.
+
+
+def get_fine_meshes(xb, dom_xb, dxyz, ratio, top, ncell):
+    """!
+    Get the fine meshes covering a rectangle, aligned to the coarse cells.
+    @param xb: (x0, x1, y0, y1) refinement rectangle.
+    @param dom_xb: (x0, x1, y0, y1, z0, z1) coarse domain, its origin on coarse faces.
+    @param dxyz: (dx, dy, dz) coarse cell sizes.
+    @param ratio: integer coarse to fine cell size ratio.
+    @param top: fine meshes top, snapped up to a coarse face.
+    @param ncell: target number of cells per fine mesh, for load balance.
+    @return list of (xb, ijk) of the fine meshes, empty if outside the domain.
+    """
+    dx, dy, dz = dxyz
+    ni = round((dom_xb[1] - dom_xb[0]) / dx)
+    nj = round((dom_xb[3] - dom_xb[2]) / dy)
+    nk = round((dom_xb[5] - dom_xb[4]) / dz)
+
+    # Coarse cell index ranges, snapped outward and clipped to the domain
+    i0 = max(floor((xb[0] - dom_xb[0]) / dx + 1e-6), 0)
+    i1 = min(ceil((xb[1] - dom_xb[0]) / dx - 1e-6), ni)
+    j0 = max(floor((xb[2] - dom_xb[2]) / dy + 1e-6), 0)
+    j1 = min(ceil((xb[3] - dom_xb[2]) / dy - 1e-6), nj)
+    k1 = min(max(ceil((top - dom_xb[4]) / dz - 1e-6), 1), nk)
+    if i1 <= i0 or j1 <= j0:
+        return list()
+
+    # Split into about equal meshes, along the coarse faces
+    nfine = (i1 - i0) * (j1 - j0) * k1 * ratio**3
+    nmesh = max(ceil(nfine / ncell), 1)
+    nmesh_y = max(round(sqrt(nmesh * (j1 - j0) / (i1 - i0))), 1)
+    nmesh_x = max(ceil(nmesh / nmesh_y), 1)
+    ibs = np.linspace(i0, i1, min(nmesh_x, i1 - i0) + 1).round().astype(int)
+    jbs = np.linspace(j0, j1, min(nmesh_y, j1 - j0) + 1).round().astype(int)
+    ibs, jbs = np.unique(ibs).tolist(), np.unique(jbs).tolist()
+    return [
+        (
+            (
+                dom_xb[0] + ia * dx,
+                dom_xb[0] + ib * dx,
+                dom_xb[2] + ja * dy,
+                dom_xb[2] + jb * dy,
+                dom_xb[4],
+                dom_xb[4] + k1 * dz,
+            ),
+            ((ib - ia) * ratio, (jb - ja) * ratio, k1 * ratio),
+        )
+        for ja, jb in zip(jbs[:-1], jbs[1:])
+        for ia, ib in zip(ibs[:-1], ibs[1:])
+    ]
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import os, sys, multiprocessing
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+
+# Stage kinds:
+# MAIN stages run in the calling thread, in declaration order,
+#   use them for QGIS processing algorithms sharing the same context.
+# THREAD stages run in a thread pool,
+#   use them for QGIS rendering and for I/O.
+# PROCESS stages run in a process pool,
+#   use them for CPU-bound NumPy work. Their func and kwargs must be picklable.
+MAIN, THREAD, PROCESS = "main", "thread", "process"
+
+
+class BufferedFeedback:
+    """
+    Feedback proxy that buffers the messages of a stage,
+    so that they can be replayed in a deterministic order.
+    """
+
+    def __init__(self, feedback=None) -> None:
+        self._feedback = feedback
+        self._records = list()
+        self._is_flushed = False
+
+    def _record(self, method, *args):
+        if self._is_flushed:
+            getattr(self._feedback, method)(*args)
+        else:
+            self._records.append((method, args))
+
+    def pushInfo(self, info):
+        self._record("pushInfo", info)
+
+    def pushDebugInfo(self, info):
+        self._record("pushDebugInfo", info)
+
+    def reportError(self, error, fatalError=False):
+        self._record("reportError", error, fatalError)
+
+    def setProgressText(self, text):
+        self._record("setProgressText", text)
+
+    def setProgress(self, progress):
+        pass  # the progress of concurrent stages is meaningless
+
+    def isCanceled(self):
+        return bool(self._feedback and self._feedback.isCanceled())
+
+    def extend(self, records):
+        """Add the messages buffered elsewhere, eg. in a worker process."""
+        self._records.extend(records)
+
+    def flush(self, feedback=None):
+        """Replay the buffered messages, then pass them through."""
+        self._feedback = self._feedback or feedback
+        for method, args in self._records:
+            getattr(self._feedback, method)(*args)
+        self._records.clear()
+        self._is_flushed = True
+
+
+class _ProgressFeedback:
+    """
+    Feedback proxy of a main stage, that scales its progress
+    to its share of the whole pipeline.
+    """
+
+    def __init__(self, feedback, offset, scale) -> None:
+        self._feedback = feedback
+        self._offset = offset
+        self._scale = scale
+
+    def setProgress(self, progress):
+        self._feedback.setProgress(self._offset + progress * self._scale)
+
+    def __getattr__(self, name):
+        return getattr(self._feedback, name)
+
+
+def _run_in_process(func, kwargs):
+    """Run func in a worker process, return its result and its messages."""
+    feedback = BufferedFeedback()
+    return func(feedback=feedback, **kwargs), feedback._records
+
+
+def get_python_executable():
+    """Get the Python interpreter for worker processes, or None."""
+    # Embedded interpreters (eg. QGIS) set sys.executable to the application
+    executable = sys.executable or ""
+    if os.path.basename(executable).lower().startswith("python"):
+        return executable
+    for name in ("python3", "python", "python3.exe", "python.exe"):
+        for path in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+            candidate = os.path.join(path, name)
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def get_process_pool(max_workers=None):
+    """Get a process pool, or None if worker processes are not available."""
+    executable = get_python_executable()
+    if not executable:
+        return None
+    try:
+        mp_context = multiprocessing.get_context("spawn")
+        mp_context.set_executable(executable)
+        return futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=mp_context
+        )
+    except (OSError, ValueError, NotImplementedError):
+        return None
+
+
+class _Stage:
+    def __init__(self, name, func, deps, kind, kwargs) -> None:
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.kind = kind
+        self.kwargs = kwargs or dict()
+        self.feedback = None
+        self.future = None
+        self.in_process = False
+
+    def get_kwargs(self):
+        """Get the kwargs, evaluated once the deps are done if given as a function."""
+        if callable(self.kwargs):
+            self.kwargs = self.kwargs()
+        return self.kwargs
+
+
+class Scheduler:
+    """
+    Run the stages of a pipeline following their dependency graph.
+    Each stage func is called as func(feedback=feedback, **kwargs),
+    and its result is available in results[name] to the dependent stages.
+    The kwargs can be a function returning them, called when the deps are done,
+    eg. to pass their results to a process stage.
+    """
+
+    poll_interval = 0.1  # s, cancellation check interval
+
+    def __init__(self, feedback, max_workers=None, processes=True) -> None:
+        self.feedback = feedback
+        self.max_workers = max_workers
+        self.processes = processes
+        self.results = dict()
+        self._stages = dict()  # ordered by declaration
+
+    def add(self, name, func, deps=(), kind=MAIN, kwargs=None):
+        """Add a stage, its deps must be already added."""
+        if name in self._stages:
+            raise ValueError(f"Duplicated stage <{name}>")
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Unknown dependency <{dep}> of stage <{name}>")
+        if kind not in (MAIN, THREAD, PROCESS):
+            raise ValueError(f"Unknown kind <{kind}> of stage <{name}>")
+        self._stages[name] = _Stage(name, func, deps, kind, kwargs)
+
+    def _submit(self, stage, thread_pool, process_pool):
+        stage.feedback = BufferedFeedback(self.feedback)
+        stage.in_process = bool(stage.kind == PROCESS and process_pool)
+        if stage.in_process:
+            stage.future = process_pool.submit(
+                _run_in_process, stage.func, stage.get_kwargs()
+            )
+        else:  # thread, or process fallback
+            stage.future = thread_pool.submit(
+                stage.func, feedback=stage.feedback, **stage.get_kwargs()
+            )
+
+    def _collect(self, stage, thread_pool):
+        """Get the result of a finished pool stage."""
+        try:
+            result = stage.future.result()
+        except BrokenProcessPool:
+            self.feedback.pushInfo(
+                f"Worker process unavailable, stage <{stage.name}> run in a thread."
+            )
+            stage.in_process = False
+            result = thread_pool.submit(
+                stage.func, feedback=stage.feedback, **stage.kwargs
+            ).result()
+        if stage.in_process:
+            result, records = result
+            stage.feedback.extend(records)
+        return result
+
+    def _set_progress(self, done):
+        """Stream the pipeline progress, as the share of done stages."""
+        self.feedback.setProgress(100.0 * len(done) / len(self._stages))
+
+    def run(self):
+        """!
+        Run all stages.
+        @return the results dict, incomplete if canceled.
+        """
+        stages = self._stages
+        done, failed = set(), dict()
+        pending = list(stages)  # by declaration
+        replayed = 0  # pool stage messages are replayed in declaration order
+        pool_names = [n for n, s in stages.items() if s.kind != MAIN]
+
+        thread_pool = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        process_pool = None
+        if self.processes and any(s.kind == PROCESS for s in stages.values()):
+            process_pool = get_process_pool(max_workers=self.max_workers)
+            if not process_pool:
+                self.feedback.pushInfo("Worker processes unavailable, using threads.")
+
+        try:
+            while pending and not failed:
+                if self.feedback.isCanceled():
+                    break
+
+                # Submit ready pool stages
+                for name in list(pending):
+                    stage = stages[name]
+                    if stage.kind != MAIN and set(stage.deps) <= done:
+                        self._submit(stage, thread_pool, process_pool)
+                        pending.remove(name)
+
+                # Run the first ready main stage, or wait for the pool stages
+                ready = [
+                    n
+                    for n in pending
+                    if stages[n].kind == MAIN and set(stages[n].deps) <= done
+                ]
+                if ready:
+                    name = ready[0]
+                    pending.remove(name)
+                    feedback = _ProgressFeedback(
+                        self.feedback,
+                        offset=100.0 * len(done) / len(stages),
+                        scale=1.0 / len(stages),
+                    )
+                    try:
+                        self.results[name] = stages[name].func(
+                            feedback=feedback, **stages[name].get_kwargs()
+                        )
+                        done.add(name)
+                        self._set_progress(done)
+                    except Exception as err:
+                        failed[name] = err
+                else:
+                    running = [
+                        stages[n].future
+                        for n in pool_names
+                        if stages[n].future and n not in done and n not in failed
+                    ]
+                    if not running:
+                        break  # nothing left that can run
+                    futures.wait(
+                        running,
+                        timeout=self.poll_interval,
+                        return_when=futures.FIRST_COMPLETED,
+                    )
+
+                # Collect finished pool stages
+                for name in pool_names:
+                    stage = stages[name]
+                    if name in done or name in failed or not stage.future:
+                        continue
+                    if not stage.future.done():
+                        continue
+                    try:
+                        self.results[name] = self._collect(stage, thread_pool)
+                        done.add(name)
+                        self._set_progress(done)
+                    except Exception as err:
+                        failed[name] = err
+
+                # Replay the messages of the finished pool stages, in order
+                while replayed < len(pool_names):
+                    name = pool_names[replayed]
+                    if name not in done and name not in failed:
+                        break
+                    stages[name].feedback.flush()
+                    replayed += 1
+
+            # Wait for the running pool stages, then replay their messages
+            for name in pool_names:
+                stage = stages[name]
+                if not stage.future or name in done or name in failed:
+                    continue
+                if self.feedback.isCanceled() or failed:
+                    stage.future.cancel()
+                try:
+                    self.results[name] = self._collect(stage, thread_pool)
+                    done.add(name)
+                except futures.CancelledError:
+                    pass
+                except Exception as err:
+                    failed[name] = err
+            for name in pool_names[replayed:]:
+                if stages[name].feedback:
+                    stages[name].feedback.flush()
+        finally:
+            thread_pool.shutdown(wait=True)
+            if process_pool:
+                process_pool.shutdown(wait=True)
+
+        # Raise the error of the first failed stage, by declaration
+        for name in stages:
+            if name in failed:
+                raise failed[name]
+        return self.results
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import os, struct
+import numpy as np
+from .manifest import write_atomic
+
+# The terrain matrix is a topological 2D representation
+# of the quad faces center points (x, y, z, landuse) by row.
+# x and y are relative to the origin, z is absolute.
+
+# matrix:    j
+#      o   o   o   o   o
+#        ·   ·   ·   ·
+#      o   *---*   o   o
+# row    · | · | ·   ·   i
+#      o   *---*   o   o
+#        ·   ·   ·   ·
+#      o   o   o   o   o
+#
+# · center points of quad faces
+# o verts
+
+
+def get_matrix(points):
+    """!
+    Get the terrain matrix from a flat array of points.
+    @param points: np.array((n, 4)) of (x, y, z, landuse) ordered by column.
+    @return np.array((nrows, ncols, 4)) terrain matrix.
+    """
+    # The original flat list is cut in columns, when three consecutive points
+    # form an angle < 180°.
+
+    # Same column:  following column:
+    #      first ·            first · · current
+    #            |                  | ^
+    #            |                  | |
+    #       prev ·                  | |
+    #            |                  |/
+    #    current ·             prev ·
+
+    npoints = len(points)
+    if npoints < 9:
+        raise ValueError(f"Too few sampling points: {npoints}")
+
+    # Get point column length
+    xy = points[:, :2]
+    v0 = xy[1] - xy[0]
+    v1 = xy[2:] - xy[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos = np.abs(v1 @ v0) / np.linalg.norm(v0) / np.linalg.norm(v1, axis=1)
+    turns = np.flatnonzero(cos < 0.9)  # end of point column
+    column_len = turns.size and int(turns[0]) + 2 or npoints
+
+    # Split matrix into columns, and transpose
+    # Now points are by row
+    if npoints % column_len:
+        raise ValueError(f"Sampling points are not a grid: {npoints}/{column_len}")
+    m = points.reshape(npoints // column_len, column_len, 4).transpose(1, 0, 2)
+
+    # Check
+    if m.shape[0] < 3 or m.shape[1] < 3:
+        raise ValueError(f"Sampling matrix is too small: {m.shape[0]}x{m.shape[1]}")
+    return np.ascontiguousarray(m)
+
+
+def save_matrix(filepath, m):
+    """!
+    Save the terrain matrix, eg. to skip the sampling on the next export.
+    @param filepath: destination .npy filepath.
+    @param m: np.array((nrows, ncols, 4)) terrain matrix.
+    """
+
+    def write(tmp_filepath):
+        with open(tmp_filepath, "wb") as f:
+            np.save(f, m)
+
+    write_atomic(filepath, write)
+
+
+def load_matrix(filepath):
+    """!
+    Load a saved terrain matrix.
+    @param filepath: .npy filepath.
+    @return np.array((nrows, ncols, 4)) terrain matrix.
+    """
+    m = np.load(filepath)
+    if m.ndim != 3 or m.shape[2] != 4 or m.shape[0] < 3 or m.shape[1] < 3:
+        raise ValueError(f"Not a terrain matrix: {m.shape}")
+    return m
+
+
+def get_matrix_from_grid(elevation, landuse, origin, pixel_size):
+    """!
+    Get the terrain matrix from elevation and landuse grids.
+    @param elevation: np.array((nrows, ncols)) of elevations, first row is north.
+    @param landuse: np.array((nrows, ncols)) of landuses, or None.
+    @param origin: (x, y) of the grid top left corner, relative to the domain origin.
+    @param pixel_size: grid pixel size, or (xres, yres).
+    @return np.array((nrows, ncols, 4)) terrain matrix.
+    """
+    xres, yres = np.broadcast_to(pixel_size, (2,))
+    nrows, ncols = elevation.shape
+    m = np.empty((nrows, ncols, 4))
+    m[:, :, 0] = origin[0] + (np.arange(ncols) + 0.5) * xres
+    m[:, :, 1] = (origin[1] - (np.arange(nrows) + 0.5) * yres)[:, np.newaxis]
+    m[:, :, 2] = elevation
+    m[:, :, 3] = 0 if landuse is None else landuse
+    return m
+
+
+def get_terrain_z(m, xs, ys, nearest=False):
+    """!
+    Get the terrain elevation at points, by bilinear interpolation
+    of the terrain matrix centers.
+    @param m: terrain matrix.
+    @param xs: np.array((n,)) of x, relative to the origin.
+    @param ys: np.array((n,)) of y, relative to the origin.
+    @param nearest: use the nearest center instead, eg. for the flat OBST cells.
+    @return (np.array((n,)) of z, np.array((n,)) of bool, True if inside the terrain).
+    """
+    nrows, ncols = m.shape[:2]
+    x0, y0 = m[0, 0, 0], m[0, 0, 1]
+    dx, dy = m[0, 1, 0] - x0, m[1, 0, 1] - y0  # dy < 0 when first row is north
+
+    # Fractional column and row indexes
+    fj = (np.asarray(xs, dtype=float) - x0) / dx
+    fi = (np.asarray(ys, dtype=float) - y0) / dy
+    inside = (fj >= -0.5) & (fj <= ncols - 0.5) & (fi >= -0.5) & (fi <= nrows - 0.5)
+
+    # Beyond the border centers, the elevation is extended
+    fj = np.clip(fj, 0.0, ncols - 1)
+    fi = np.clip(fi, 0.0, nrows - 1)
+    if nearest:  # the containing cell
+        return m[:, :, 2][np.rint(fi).astype(int), np.rint(fj).astype(int)], inside
+    j0 = np.minimum(fj.astype(int), ncols - 2)
+    i0 = np.minimum(fi.astype(int), nrows - 2)
+    tj, ti = fj - j0, fi - i0
+
+    z = m[:, :, 2]
+    zs = (
+        z[i0, j0] * (1.0 - ti) * (1.0 - tj)
+        + z[i0, j0 + 1] * (1.0 - ti) * tj
+        + z[i0 + 1, j0] * ti * (1.0 - tj)
+        + z[i0 + 1, j0 + 1] * ti * tj
+    )
+    return zs, inside
+
+
+def get_landuse_matrix(landuses, nrows):
+    """!
+    Get the landuses by row from a flat array ordered by column.
+    @param landuses: np.array((n,)) of landuses.
+    @param nrows: number of terrain matrix rows.
+    @return np.array((nrows, ncols)).
+    """
+    return landuses.reshape(-1, nrows).T
+
+
+def inject_ghost_centers(m):
+    """!
+    Inject ghost centers all around the terrain matrix.
+    @param m: terrain matrix.
+    @return the larger terrain matrix.
+    """
+    # Init displacements, no z displacement, no landuse change
+    dx, dy = m[0, 1] - m[0, 0], m[1, 0] - m[0, 0]
+    dx[2:], dy[2:] = 0.0, 0.0
+
+    # Copy the border rows and cols, then displace them
+    m = np.pad(m, ((1, 1), (1, 1), (0, 0)), mode="edge")
+    m[0] -= dy
+    m[-1] += dy
+    m[:, 0] -= dx
+    m[:, -1] += dx
+    return m
+
+
+# Verts are extracted by averaging the neighbour centers coordinates,
+# after injecting ghost centers all around
+
+# · centers of quad faces  + ghost centers
+# o verts  * cs  x vert
+#
+#           dx       j
+#          + > +   +   +   +   +  first ghost row
+#       dy v o---o---o---o---o
+#          + | · | · | · | · | +  i center
+#            o---o---x---o---o    i vert
+#          + | · | · | · | · | +  i+1 center
+#            o---o---o---o---o
+#          +   +   +   +   +   +  last ghost row
+
+
+def get_verts(m):
+    """!
+    Get the verts as average of surrounding centers.
+    @param m: terrain matrix with ghost centers.
+    @return np.array((nverts, 3)) of vert coordinates, by row.
+    """
+    m = m[:, :, :3]
+    verts = (m[:-1, :-1] + m[1:, :-1] + m[:-1, 1:] + m[1:, 1:]) / 4.0
+    return verts.reshape(-1, 3)
+
+
+#        j   j  j+1
+#        *<------* i
+#        | f1 // |
+# faces  |  /·/  | i
+#        | // f2 |
+#        *------>* i+1
+
+
+def get_faces(nrows, ncols):
+    """!
+    Get the faces connectivity, two triangles for each center.
+    @param nrows: number of terrain matrix rows.
+    @param ncols: number of terrain matrix cols.
+    @return np.array((2 * nrows * ncols, 3)) of vert indexes in F90 notation.
+    """
+    len_vcol = ncols + 1  # vert matrix is larger
+    i, j = np.meshgrid(
+        np.arange(nrows, dtype="int32"), np.arange(ncols, dtype="int32"), indexing="ij"
+    )
+    v00 = (i * len_vcol + j + 1).ravel()  # F90 indexes start from 1
+    v10, v01, v11 = v00 + len_vcol, v00 + 1, v00 + len_vcol + 1
+    faces = np.empty((nrows * ncols, 2, 3), dtype="int32")
+    faces[:, 0] = np.column_stack((v00, v10, v01))  # 1st face
+    faces[:, 1] = np.column_stack((v11, v01, v10))  # 2nd face
+    return faces.reshape(-1, 3)
+
+
+def get_face_landuses(landuses):
+    """!
+    Get the faces landuses, two triangles for each center.
+    @param landuses: np.array((nrows, ncols)) of landuses.
+    @return np.array((2 * nrows * ncols,)) of landuses.
+    """
+    return np.repeat(landuses.astype(int).ravel(), 2)
+
+
+def get_surf_indexes(landuses, keys):
+    """!
+    Translate landuses into indexes of the list of known landuses.
+    @param landuses: np.array of landuses.
+    @param keys: list of known landuses.
+    @return np.array of indexes, unknown landuses set to 0, and the unknown landuses.
+    """
+    landuses = np.asarray(landuses).astype(int)
+    keys = np.asarray(keys, dtype=int)
+    if not keys.size:
+        return np.zeros(landuses.shape, dtype="int32"), np.unique(landuses)
+    sorter = np.argsort(keys)
+    pos = np.searchsorted(keys, landuses, sorter=sorter).clip(0, keys.size - 1)
+    idxs = sorter[pos]
+    is_known = keys[idxs] == landuses
+    return (
+        np.where(is_known, idxs, 0).astype("int32"),
+        np.unique(landuses[~is_known]),
+    )
+
+
+def get_obsts(m, min_z):
+    """!
+    Get the OBSTs, one for each center.
+    @param m: terrain matrix with ghost centers.
+    @param min_z: OBSTs bottom.
+    @return np.array((n, 6)) of OBST XBs, and np.array((n,)) of their landuses.
+    """
+    c = m[1:-1, 1:-1]  # centers
+    p0 = (m[2:, :-2, :2] + c[:, :, :2]) / 2.0
+    p1 = (c[:, :, :2] + m[:-2, 2:, :2]) / 2.0
+    xbs = np.empty(c.shape[:2] + (6,))
+    xbs[:, :, 0], xbs[:, :, 1] = p0[:, :, 0], p1[:, :, 0]
+    xbs[:, :, 2], xbs[:, :, 3] = p0[:, :, 1], p1[:, :, 1]
+    xbs[:, :, 4], xbs[:, :, 5] = min_z, c[:, :, 2]
+    return xbs.reshape(-1, 6), c[:, :, 3].ravel()
+
+
+def get_geometry(feedback, m, is_obst=False):
+    """!
+    Get the terrain geometry from the terrain matrix, eg. in a worker process.
+    @param feedback: feedback, eg. buffered in the worker process.
+    @param m: terrain matrix.
+    @param is_obst: get the OBSTs instead of the GEOM faces.
+    @return dict of the gm terrain matrix with ghost centers, and
+    verts, faces, landuses of the GEOM, or xbs, landuses of the OBSTs.
+    """
+    gm = inject_ghost_centers(m)
+    if is_obst:
+        feedback.pushInfo("Prepare OBSTs...")
+        xbs, landuses = get_obsts(gm, min_z=m[:, :, 2].min())
+        return {"gm": gm, "xbs": xbs, "landuses": landuses}
+    feedback.pushInfo("Init GEOM faces, their landuses, and verts...")
+    return {
+        "gm": gm,
+        "verts": get_verts(gm),
+        "faces": get_faces(*m.shape[:2]),
+        "landuses": get_face_landuses(m[:, :, 3]),
+    }
+
+
+def format_obsts(xbs, surf_ids):
+    """!
+    Format the OBSTs in FDS notation.
+    @param xbs: np.array((n, 6)) of OBST XBs.
+    @param surf_ids: list of n SURF IDs.
+    @return list of FDS OBST lines.
+    """
+    fmt = "&OBST XB=%.2f,%.2f,%.2f,%.2f,%.2f,%.2f SURF_ID='%s' /"
+    return [fmt % (*xb, s) for xb, s in zip(xbs.tolist(), surf_ids)]
+
+
+def write_obsts(filepath, xbs, surf_ids, comment):
+    """!
+    Write the OBSTs to an FDS include file, eg. in a worker process.
+    @param filepath: destination filepath.
+    @param xbs: np.array((n, 6)) of OBST XBs.
+    @param surf_ids: list of n SURF IDs.
+    @param comment: header line.
+    @return filepath.
+    """
+
+    def write(tmp_filepath):
+        with open(tmp_filepath, "w") as f:
+            f.write(f"{comment}\n")
+            f.write("\n".join(format_obsts(xbs, surf_ids)))
+            f.write("\n")
+
+    write_atomic(filepath, write)
+    return filepath
+
+
+# The FDS bingeom file is written from Fortran90 like this:
+#      WRITE(731) INTEGER_ONE
+#      WRITE(731) N_VERTS,N_FACES,N_SURF_ID,N_VOLUS
+#      WRITE(731) VERTS(1:3*N_VERTS)
+#      WRITE(731) FACES(1:3*N_FACES)
+#      WRITE(731) SURFS(1:N_FACES)
+#      WRITE(731) VOLUS(1:4*N_VOLUS)
+
+
+def _write_record(f, data):
+    """!
+    Write a record to a binary unformatted sequential Fortran90 file.
+    @param f: open Python file object in 'wb' mode.
+    @param data: np.array() of data.
+    """
+    # Calc start and end record tag
+    tag = len(data) * data.dtype.itemsize
+    # Write start tag, data, and end tag
+    f.write(struct.pack("i", tag))
+    data.tofile(f)
+    f.write(struct.pack("i", tag))
+
+
+def write_bingeom(
+    filepath,
+    geom_type,
+    n_surf_id,
+    fds_verts,
+    fds_faces,
+    fds_surfs,
+    fds_volus,
+):
+    """!
+    Write FDS bingeom file.
+    @param filepath: destination filepath
+    @param geom_type: GEOM type (eg. 1 is manifold, 2 is terrain)
+    @param n_surf_id: number of referred boundary conditions
+    @param fds_verts: vertices coordinates in FDS flat format, eg. (x0, y0, z0, x1, y1, ...)
+    @param fds_faces: faces connectivity in FDS flat format, eg. (i0, j0, k0, i1, ...)
+    @param fds_surfs: boundary condition indexes, eg. (i0, i1, ...)
+    @param fds_volus: volumes connectivity in FDS flat format, eg. (i0, j0, k0, w0, i1, ...)
+    """
+    fds_verts = np.ravel(np.asarray(fds_verts, dtype="float64"))
+    fds_faces = np.ravel(np.asarray(fds_faces, dtype="int32"))
+    fds_surfs = np.ravel(np.asarray(fds_surfs, dtype="int32"))
+    fds_volus = np.ravel(np.asarray(fds_volus, dtype="int32"))
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "wb") as f:
+        _write_record(f, np.array((geom_type,), dtype="int32"))  # was 1 only
+        _write_record(
+            f,
+            np.array(
+                (
+                    len(fds_verts) // 3,
+                    len(fds_faces) // 3,
+                    n_surf_id,
+                    len(fds_volus) // 4,
+                ),
+                dtype="int32",
+            ),
+        )
+        _write_record(f, fds_verts)
+        _write_record(f, fds_faces)
+        _write_record(f, fds_surfs)
+        _write_record(f, fds_volus)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+from math import ceil, floor
+import numpy as np
+
+# Range query index of the terrain matrix elevation, for per region statistics.
+# Sums are read from a summed-area table, four lookups per query.
+# Min and max are read from a 2D sparse table over blocks of BLOCK · BLOCK centers,
+# four lookups for the inner blocks, then the thin border strips are reduced.
+# A sparse table over single centers would need log²(n) copies of the matrix.
+
+BLOCK = 16  # centers per block side
+
+
+class TerrainIndex:
+    def __init__(self, m, block=BLOCK) -> None:
+        """!
+        Build the index.
+        @param m: terrain matrix.
+        @param block: centers per block side.
+        """
+        z = np.ascontiguousarray(m[:, :, 2], dtype=float)
+        self._z = z
+        self._block = block
+        nrows, ncols = z.shape
+
+        # Grid geometry, as in terrain.get_terrain_z
+        self._x0, self._y0 = m[0, 0, 0], m[0, 0, 1]
+        self._dx, self._dy = m[0, 1, 0] - self._x0, m[1, 0, 1] - self._y0
+        self.cell_area = abs(self._dx * self._dy)
+        self.min_z, self.max_z = z.min(), z.max()
+
+        # Summed-area table, with a leading row and column of zeros
+        self._sat = np.zeros((nrows + 1, ncols + 1))
+        np.cumsum(np.cumsum(z, axis=0), axis=1, out=self._sat[1:, 1:])
+
+        # Block min and max, the partial blocks padded
+        nbrows, nbcols = ceil(nrows / block), ceil(ncols / block)
+        pz = np.full((nbrows * block, nbcols * block), np.nan)
+        pz[:nrows, :ncols] = z
+        pz = pz.reshape(nbrows, block, nbcols, block)
+        self._mins = self._get_sparse_table(np.nanmin(pz, axis=(1, 3)), np.minimum)
+        self._maxs = self._get_sparse_table(np.nanmax(pz, axis=(1, 3)), np.maximum)
+
+    @staticmethod
+    def _get_sparse_table(a, op):
+        """Get the 2D sparse table, t[ky][kx] reduces the 2^ky · 2^kx blocks from each one."""
+        rows = [a]  # ky = 0
+        while len(rows) < a.shape[1].bit_length():
+            t, h = rows[-1], 1 << (len(rows) - 1)
+            rows.append(op(t[:, :-h], t[:, h:]))
+        table = [rows]
+        while len(table) < a.shape[0].bit_length():
+            h = 1 << (len(table) - 1)
+            table.append([op(t[:-h], t[h:]) for t in table[-1]])
+        return table
+
+    @staticmethod
+    def _query_table(table, i0, i1, j0, j1, op):
+        """Reduce the blocks [i0, i1) · [j0, j1) with four lookups."""
+        ky, kx = (i1 - i0).bit_length() - 1, (j1 - j0).bit_length() - 1
+        t = table[ky][kx]
+        i2, j2 = i1 - (1 << ky), j1 - (1 << kx)
+        return op(op(t[i0, j0], t[i0, j2]), op(t[i2, j0], t[i2, j2]))
+
+    def get_slices(self, xb):
+        """!
+        Get the index ranges of the centers inside a rectangle.
+        @param xb: rectangle (x0, x1, y0, y1, ...), relative to the origin.
+        @return (i0, i1, j0, j1) end excluded, None if no center is inside.
+        """
+        nrows, ncols = self._z.shape
+        fjs = sorted(((xb[0] - self._x0) / self._dx, (xb[1] - self._x0) / self._dx))
+        fis = sorted(((xb[2] - self._y0) / self._dy, (xb[3] - self._y0) / self._dy))
+        j0, j1 = max(ceil(fjs[0] - 1e-9), 0), min(floor(fjs[1] + 1e-9) + 1, ncols)
+        i0, i1 = max(ceil(fis[0] - 1e-9), 0), min(floor(fis[1] + 1e-9) + 1, nrows)
+        if i1 <= i0 or j1 <= j0:
+            return None
+        return i0, i1, j0, j1
+
+    def get_sum(self, xb):
+        """Get the number of centers inside the rectangle, and the sum of their z."""
+        slices = self.get_slices(xb)
+        if not slices:
+            return 0, 0.0
+        i0, i1, j0, j1 = slices
+        s = self._sat
+        return (i1 - i0) * (j1 - j0), s[i1, j1] - s[i0, j1] - s[i1, j0] + s[i0, j0]
+
+    def get_z_range(self, xb):
+        """Get the min and max z of the centers inside the rectangle, nan if none."""
+        slices = self.get_slices(xb)
+        if not slices:
+            return np.nan, np.nan
+        i0, i1, j0, j1 = slices
+        b, z = self._block, self._z
+        bi0, bi1, bj0, bj1 = -(-i0 // b), i1 // b, -(-j0 // b), j1 // b
+        if bi1 <= bi0 or bj1 <= bj0:  # no inner block
+            zs = z[i0:i1, j0:j1]
+            return zs.min(), zs.max()
+        zmin = self._query_table(self._mins, bi0, bi1, bj0, bj1, min)
+        zmax = self._query_table(self._maxs, bi0, bi1, bj0, bj1, max)
+        for zs in (  # border strips
+            z[i0 : bi0 * b, j0:j1],
+            z[bi1 * b : i1, j0:j1],
+            z[bi0 * b : bi1 * b, j0 : bj0 * b],
+            z[bi0 * b : bi1 * b, bj1 * b : j1],
+        ):
+            if zs.size:
+                zmin, zmax = min(zmin, zs.min()), max(zmax, zs.max())
+        return zmin, zmax
+
+    def get_stats(self, xb, z0=None):
+        """!
+        Get the terrain statistics inside a rectangle.
+        @param xb: rectangle (x0, x1, y0, y1, ...), relative to the origin.
+        @param z0: bottom of the solid volume, if not set the terrain min.
+        @return dict of count, min, max, mean z, and solid volume over z0.
+        """
+        n, s = self.get_sum(xb)
+        zmin, zmax = self.get_z_range(xb)
+        z0 = self.min_z if z0 is None else z0
+        return {
+            "count": n,
+            "min": zmin,
+            "max": zmax,
+            "mean": s / n if n else np.nan,
+            "volume": (s - n * z0) * self.cell_area,
+        }
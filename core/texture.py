@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import re
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Texture generation without the map renderer, for headless runs.
+# Images are np.array((nrows, ncols, ...)), with rows from north to south.
+
+_scan_rgb = re.compile(  # search RGB value in SURF
+    r"RGB[,\s\t]*=[,\s\t]*(\d+)[,\s\t]+(\d+)[,\s\t]+(\d+)",
+    re.IGNORECASE,
+)
+
+
+def get_hillshade(elevation, pixel_size, azimuth=315.0, altitude=45.0, zfactor=1.0):
+    """!
+    Get the hillshade of a DEM, with Horn's gradient.
+    @param elevation: np.array((nrows, ncols)) of elevations.
+    @param pixel_size: (dx, dy) or d, pixel size in meters.
+    @param azimuth: light azimuth in degrees, clockwise from north.
+    @param altitude: light altitude in degrees above the horizon.
+    @param zfactor: vertical exaggeration.
+    @return np.array((nrows, ncols)) of illumination in [0, 1].
+    """
+    dx, dy = np.broadcast_to(np.asarray(pixel_size, dtype=float), (2,))
+    z = np.pad(np.asarray(elevation, dtype=float), 1, mode="edge")
+    # 3x3 window around each pixel:
+    # a b c
+    # d e f
+    # g h i
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, f = z[1:-1, :-2], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+    dzdx = zfactor * ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * dx)  # to east
+    dzdy = zfactor * ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * dy)  # to north
+    az, alt = np.radians(azimuth), np.radians(altitude)
+    shade = (
+        np.sin(alt)
+        - dzdx * np.sin(az) * np.cos(alt)
+        - dzdy * np.cos(az) * np.cos(alt)
+    ) / np.sqrt(1.0 + dzdx**2 + dzdy**2)
+    return np.clip(shade, 0.0, 1.0)
+
+
+def get_palette_from_qml(text):
+    """!
+    Get the palette of a paletted raster QML style.
+    @param text: QML style text.
+    @return dict {value: (r, g, b)}, empty if not paletted.
+    """
+    palette = dict()
+    try:
+        root = ET.fromstring(text)
+    except ET.ParseError:
+        return palette
+    for entry in root.iter("paletteEntry"):
+        try:
+            color = entry.get("color").lstrip("#")
+            palette[int(float(entry.get("value")))] = tuple(
+                int(color[j : j + 2], 16) for j in (0, 2, 4)
+            )
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return palette
+
+
+def get_palette_from_surfs(surf_dict):
+    """!
+    Get the palette from the RGB of FDS SURFs, as in the landuse type *.csv file.
+    @param surf_dict: dict {landuse: "&SURF ID='A04' RGB=... /"}.
+    @return dict {landuse: (r, g, b)}.
+    """
+    palette = dict()
+    for key, surf in surf_dict.items():
+        found = _scan_rgb.search(surf)
+        if found:
+            palette[key] = tuple(int(v) for v in found.groups())
+    return palette
+
+
+def get_landuse_rgb(landuse, palette, default=(255, 255, 255)):
+    """!
+    Color the landuse.
+    @param landuse: np.array((nrows, ncols)) of landuse keys.
+    @param palette: dict {landuse: (r, g, b)}.
+    @param default: color of landuses missing from the palette.
+    @return np.array((nrows, ncols, 3), dtype=np.uint8).
+    """
+    keys = np.array(sorted(palette), dtype=np.int64)
+    colors = np.array([palette[k] for k in keys] + [default], dtype=np.uint8)
+    landuse = np.asarray(landuse).astype(np.int64)
+    if not len(keys):
+        return np.broadcast_to(colors[-1], landuse.shape + (3,)).copy()
+    idxs = np.clip(np.searchsorted(keys, landuse), 0, len(keys) - 1)
+    idxs[keys[idxs] != landuse] = len(keys)  # missing
+    return colors[idxs]
+
+
+def get_texture(hillshade, rgb=None, blend=0.5):
+    """!
+    Blend the hillshade with a colored layer.
+    @param hillshade: np.array((nrows, ncols)) in [0, 1].
+    @param rgb: np.array((nrows, ncols, 3)), or None for a gray hillshade.
+    @param blend: hillshade strength in [0, 1] over the colored layer.
+    @return np.array((nrows, ncols, 3), dtype=np.uint8).
+    """
+    if rgb is None:
+        return np.repeat((hillshade * 255.0 + 0.5).astype(np.uint8)[..., None], 3, 2)
+    shade = (1.0 - blend) + blend * hillshade
+    return (rgb * shade[..., None] + 0.5).clip(0, 255).astype(np.uint8)
+
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import os, hashlib, tempfile
+
+
+class TileCache:
+    """
+    Persistent file cache of rendered tiles,
+    with least recently used eviction and a size limit.
+    """
+
+    def __init__(self, path, max_size=1024 * 2**20, suffix=".png") -> None:
+        """!
+        @param path: cache directory, created if needed.
+        @param max_size: cache size limit in bytes, 0 disables the cache.
+        @param suffix: tile file suffix.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.suffix = suffix
+
+    @staticmethod
+    def get_key(*items):
+        """Get the cache key of the items, eg. layer sources, crs, and extent."""
+        return hashlib.sha1(repr(items).encode("utf-8")).hexdigest()
+
+    def _get_filepath(self, key):
+        return os.path.join(self.path, key[:2], f"{key}{self.suffix}")
+
+    def get(self, key):
+        """Get the filepath of the cached tile, or None if missing."""
+        if not self.max_size:
+            return None
+        filepath = self._get_filepath(key)
+        try:
+            os.utime(filepath)  # mark as recently used
+        except OSError:
+            return None
+        return filepath
+
+    def put(self, key, write):
+        """!
+        Add a tile to the cache.
+        @param key: cache key.
+        @param write: function writing the tile to the filepath it receives.
+        @return the filepath of the cached tile, or None if not cached.
+        """
+        if not self.max_size:
+            return None
+        filepath = self._get_filepath(key)
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            fd, tmp_filepath = tempfile.mkstemp(
+                suffix=self.suffix, dir=os.path.dirname(filepath)
+            )
+            os.close(fd)
+            try:
+                write(tmp_filepath)
+                os.replace(tmp_filepath, filepath)  # atomic
+            finally:
+                if os.path.isfile(tmp_filepath):
+                    os.remove(tmp_filepath)
+        except OSError:
+            return None  # a cache failure is never fatal
+        return filepath
+
+    def _get_entries(self):
+        """Get the (mtime, size, filepath) of the cached tiles."""
+        entries = list()
+        for root, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith(self.suffix):
+                    continue
+                filepath = os.path.join(root, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filepath))
+        return entries
+
+    def get_size(self):
+        """Get the cache size in bytes."""
+        return sum(size for _, size, _ in self._get_entries())
+
+    def evict(self, max_size=None):
+        """!
+        Remove the least recently used tiles, until the cache fits max_size.
+        @return the number of removed tiles.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = sorted(self._get_entries())  # oldest first
+        size = sum(s for _, s, _ in entries)
+        count = 0
+        for _, s, filepath in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(filepath)
+            except OSError:
+                continue
+            size -= s
+            count += 1
+        return count
+
+    def clear(self):
+        """Remove all cached tiles."""
+        return self.evict(max_size=0)
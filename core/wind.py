@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import numpy as np
+
+# Wind time series: t in s, ws wind speed in m/s, wd direction in degrees.
+
+
+def read_csv(filepath):
+    """!
+    Read the wind *.csv file in bulk.
+    It has an header line and three columns:
+    time in seconds, wind speed in m/s, and direction in degrees.
+    @return (t, ws, wd) np.arrays, sorted by time.
+    """
+    data = np.loadtxt(
+        filepath, delimiter=",", skiprows=1, usecols=(0, 1, 2), ndmin=2
+    )
+    if not len(data):
+        raise ValueError("No wind data")
+    if not np.isfinite(data).all():
+        raise ValueError("Invalid wind data")
+    data = data[np.argsort(data[:, 0], kind="stable")]
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def get_mean_direction(ws, wd):
+    """!
+    Get the prevailing wind direction, as the speed weighted vector mean.
+    @return direction in degrees, 0 to 360.
+    """
+    wd = np.radians(wd)
+    u, v = np.sum(ws * np.sin(wd)), np.sum(ws * np.cos(wd))
+    return np.degrees(np.arctan2(u, v)) % 360.0
+
+
+def get_footprint_margins(ws, wd, bearing, fetch, downwind):
+    """!
+    Get the domain extension around the fire, for each wind direction
+    an upwind fetch and a downwind distance.
+    @param bearing: azimuth of the domain y axis, in degrees from north.
+    @param fetch: upwind distance in meters.
+    @param downwind: downwind distance in meters.
+    @return (x0, y0, x1, y1) outward extensions in the domain frame.
+    """
+    blowing = ws > 0.0
+    a = np.radians(wd[blowing] + 180.0 - bearing)  # the wind blows to
+    dxs = np.concatenate(((0.0,), np.sin(a) * downwind, -np.sin(a) * fetch))
+    dys = np.concatenate(((0.0,), np.cos(a) * downwind, -np.cos(a) * fetch))
+    return -dxs.min(), -dys.min(), dxs.max(), dys.max()
+
+
+def unwrap_direction(wd):
+    """!
+    Unwrap the wind direction, removing the 360° jumps,
+    so that it can be linearly interpolated, as FDS does with RAMPs.
+    """
+    return np.degrees(np.unwrap(np.radians(wd)))
+
+
+def resample(t, ws, wd, interval):
+    """!
+    Resample the wind time series, averaging the samples around each time step.
+    @param interval: target time step in s.
+    @return (t, ws, wd) np.arrays, wd unwrapped.
+    """
+    wd = unwrap_direction(wd)
+    k = np.rint((t - t[0]) / interval).astype(np.int64)  # nearest time step
+    counts = np.bincount(k)
+    steps = np.flatnonzero(counts)  # non empty time steps
+    counts = counts[steps]
+    return (
+        t[0] + steps * interval,
+        np.bincount(k, weights=ws)[steps] / counts,
+        np.bincount(k, weights=wd)[steps] / counts,
+    )
+
+
+def simplify(t, ws, wd, ws_tolerance, wd_tolerance):
+    """!
+    Simplify the wind time series by Douglas-Peucker,
+    keeping the linear interpolation of speed and unwrapped direction
+    within the tolerances.
+    @param ws_tolerance: wind speed tolerance in m/s, 0 to keep it exact.
+    @param wd_tolerance: wind direction tolerance in degrees, 0 to keep it exact.
+    @return (t, ws, wd) np.arrays, wd unwrapped.
+    """
+    wd = unwrap_direction(wd)
+    n = len(t)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Normalize by the tolerances, so that a single threshold applies
+    v = np.column_stack(
+        (ws / max(ws_tolerance, 1e-12), wd / max(wd_tolerance, 1e-12))
+    )
+    stack = [(0, n - 1)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 < 2:
+            continue
+        tt = t[i0 + 1 : i1]
+        dt = t[i1] - t[i0]
+        w = (tt - t[i0]) / dt if dt else np.zeros_like(tt)
+        interp = v[i0] + w[:, np.newaxis] * (v[i1] - v[i0])
+        err = np.abs(v[i0 + 1 : i1] - interp).max(axis=1)
+        j = int(np.argmax(err))
+        if err[j] > 1.0:
+            j += i0 + 1
+            keep[j] = True
+            stack.extend(((i0, j), (j, i1)))
+    return t[keep], ws[keep], wd[keep]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import numpy as np
+
+# Gridded wind field on FDS meshes.
+# Grids are np.array((nk, nj, ni)), with i along x (east),
+# j along y (north), and k along z (up). FDS staggered velocities:
+# U(i, j, k) on the x faces, at x = x0 + i·dx, y = y0 + (j-.5)·dy, z = z0 + (k-.5)·dz,
+# V(i, j, k) on the y faces, at x = x0 + (i-.5)·dx, y = y0 + j·dy, z = z0 + (k-.5)·dz,
+# W(i, j, k) on the z faces, at x = x0 + (i-.5)·dx, y = y0 + (j-.5)·dy, z = z0 + k·dz,
+# with i = 0…IBAR, j = 0…JBAR, k = 0…KBAR, index 0 on the ghost cells.
+
+
+def get_mesh_grid(xb, ijk):
+    """!
+    Get the cell center coordinates of a mesh, ghost cells included.
+    @param xb: mesh (x0, x1, y0, y1, z0, z1).
+    @param ijk: mesh (IBAR, JBAR, KBAR).
+    @return (xc, yc, zc) 1D np.arrays, of IBAR+2, JBAR+2, KBAR+2 elements.
+    """
+    return tuple(
+        xb[2 * a] + (np.arange(ijk[a] + 2) - 0.5) * (xb[2 * a + 1] - xb[2 * a]) / ijk[a]
+        for a in range(3)
+    )
+
+
+def interpolate_profile(z_agl, heights, values):
+    """!
+    Interpolate the wind levels to the heights above ground,
+    linearly between levels, and from zero at the ground to the first level.
+    @param z_agl: np.array((nk, nj, ni)) of heights above ground level.
+    @param heights: np.array((nlev,)) of increasing level heights above ground.
+    @param values: np.array((nlev, nj, ni)) of level values.
+    @return np.array((nk, nj, ni)), zero under the ground, constant over the top.
+    """
+    heights = np.concatenate(([0.0], np.asarray(heights, dtype=float)))
+    values = np.concatenate((np.zeros((1,) + values.shape[1:]), values))
+    z = np.clip(z_agl, 0.0, heights[-1])
+    idx = np.clip(np.searchsorted(heights, z, side="right") - 1, 0, len(heights) - 2)
+    h0, h1 = heights[idx], heights[idx + 1]
+    w = (z - h0) / (h1 - h0)
+    v0 = np.take_along_axis(values, idx, axis=0)
+    v1 = np.take_along_axis(values, idx + 1, axis=0)
+    return v0 + w * (v1 - v0)
+
+
+def rotate(uc, vc, bearing):
+    """!
+    Rotate the east and north wind components to a domain frame.
+    @param uc: np.array of east components.
+    @param vc: np.array of north components.
+    @param bearing: azimuth of the domain y axis, in degrees clockwise from north.
+    @return (uc, vc) along the domain x and y axes.
+    """
+    t = np.radians(bearing)
+    return uc * np.cos(t) - vc * np.sin(t), uc * np.sin(t) + vc * np.cos(t)
+
+
+def get_face_velocities(uc, vc, elevation, heights, zc):
+    """!
+    Get the FDS staggered velocities of a mesh from the cell centered wind levels.
+    @param uc: np.array((nlev, JBAR+2, IBAR+2)), east wind levels at cell centers.
+    @param vc: np.array((nlev, JBAR+2, IBAR+2)), north wind levels at cell centers.
+    @param elevation: np.array((JBAR+2, IBAR+2)), terrain at cell centers.
+    @param heights: np.array((nlev,)), level heights above ground.
+    @param zc: np.array((KBAR+2,)), cell center z, ghost cells included.
+    @return (u, v, w) np.arrays((KBAR+1, JBAR+1, IBAR+1)).
+    """
+    zc = zc[:-1, np.newaxis, np.newaxis]  # k = 0…KBAR
+    # Average to the faces, the terrain too
+    ue = 0.5 * (elevation[:-1, :-1] + elevation[:-1, 1:])
+    ve = 0.5 * (elevation[:-1, :-1] + elevation[1:, :-1])
+    uf = 0.5 * (uc[:, :-1, :-1] + uc[:, :-1, 1:])
+    vf = 0.5 * (vc[:, :-1, :-1] + vc[:, 1:, :-1])
+    u = interpolate_profile(zc - ue, heights, uf)
+    v = interpolate_profile(zc - ve, heights, vf)
+    return u, v, np.zeros_like(u)
+
+
+def write_uvw(filepath, u, v, w, slab=16):
+    """!
+    Write the initial velocity file of a mesh, read by FDS with &CSVF UVWFILE.
+    The first line contains the index ranges, then one U,V,W line per cell,
+    with i running fastest, as written by FDS &DUMP UVW_TIMER.
+    @param u, v, w: np.array((KBAR+1, JBAR+1, IBAR+1)).
+    @param slab: number of k layers written at once, to bound memory.
+    """
+    nk, nj, ni = u.shape
+    with open(filepath, "w") as f:
+        f.write(f"0,{ni - 1:d},0,{nj - 1:d},0,{nk - 1:d}\n")
+        for k0 in range(0, nk, slab):
+            s = slice(k0, k0 + slab)
+            np.savetxt(
+                f,
+                np.column_stack((u[s].ravel(), v[s].ravel(), w[s].ravel())),
+                fmt="%.3f",
+                delimiter=",",
+            )
@@ -13,7 +13,6 @@ from qgis.core import (
     QgsProject,
     QgsPoint,
     QgsCoordinateReferenceSystem,
-    QgsCoordinateTransform,
     QgsProcessingException,
     QgsProcessingAlgorithm,
     QgsProcessingParameterRasterLayer,
@@ -26,22 +25,31 @@ from qgis.core import (
     QgsProcessingParameterDefinition,
     QgsProcessingParameterFeatureSink,
     QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessing,
     QgsRasterLayer,
+    QgsRectangle,
 )
 
-import os
-from .types import (
-    utils,
-    FDSCase,
-    Domain,
-    OBSTTerrain,
-    GEOMTerrain,
-    LanduseType,
-    Texture,
-    Wind,
-)
-from . import algos
+from qgis.PyQt.QtXml import QDomDocument
+
+import os, itertools, time
+
+# The heavy modules (numpy, gdal, processing, and the plugin types and algos)
+# are imported when the algorithm runs, not at plugin load
+
 
+TEX_IMAGE_TYPES = ("png", "jpg", "webp")
+
+LANDUSE_AGGREGATIONS = ("Sample at cell center", "Majority over cell")
+
+DOMAIN_ROTATIONS = (
+    "North up",
+    "User bearing",
+    "Fire layer minimum area rectangle",
+    "Mean wind direction",
+)
 
 DEFAULTS = {
     "chid": "terrain",
@@ -50,15 +58,43 @@ DEFAULTS = {
     "pixel_size": 10.0,
     "origin": None,
     "dem_layer": None,
+    "dem_tiles": "",
     "landuse_layer": None,
     "landuse_type_filepath": "",
+    "landuse_aggregation": 0,
+    "landuse_priority": "",
+    "landuse_tiles": "",
     "fire_layer": None,
     "wind_filepath": "",
+    "wind_interval": 0.0,
+    "wind_ws_tolerance": 0.0,
+    "wind_wd_tolerance": 0.0,
+    "wind_field_filepath": "",
     "tex_layer": None,
     "tex_pixel_size": 5.0,
+    "tex_hillshade": False,
+    "tex_image_type": 0,
+    "tex_quality": 75,
+    "tex_zlevel": 6,
+    "tex_max_size": 0.0,
     "nmesh": 1,
     "cell_size": None,
+    "mesh_stretch": 1.0,
+    "fine_layer": None,
+    "fine_cell_size": None,
+    "fine_margin": 100.0,
+    "domain_rotation": 0,
+    "domain_bearing": 0.0,
+    "domain_margin": 500.0,
+    "domain_trim": False,
+    "domain_fetch": 200.0,
+    "domain_downwind": 1000.0,
     "export_obst": True,
+    "obst_files": 0,
+    "in_memory": True,
+    "sweep_wind_filepaths": "",
+    "sweep_fire_layers": [],
+    "sweep_level_set_modes": "",
 }
 
 
@@ -167,11 +203,27 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(
             QgsProcessingParameterRasterLayer(
                 "dem_layer",
-                "DEM layer",
+                "DEM layer (if not set, DEM tiles are used)",
+                optional=True,
                 defaultValue=defaultValue,
             )
         )
 
+        # Define parameter: dem_tiles [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "dem_tiles", DEFAULTS["dem_tiles"]
+        )
+        param = QgsProcessingParameterString(
+            "dem_tiles",
+            "DEM tiles: files, directories or glob patterns (separated by ;)",
+            multiLine=False,
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
         # Define parameter: landuse_layer [optional]
 
         defaultValue, _ = project.readEntry(
@@ -202,6 +254,50 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # Define parameter: landuse_tiles [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "landuse_tiles", DEFAULTS["landuse_tiles"]
+        )
+        param = QgsProcessingParameterString(
+            "landuse_tiles",
+            "Landuse tiles, used instead of the landuse layer: files, directories or glob patterns (separated by ;)",
+            multiLine=False,
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: landuse_aggregation
+
+        defaultValue, _ = project.readNumEntry(
+            "qgis2fds", "landuse_aggregation", DEFAULTS["landuse_aggregation"]
+        )
+        param = QgsProcessingParameterEnum(
+            "landuse_aggregation",
+            "Landuse aggregation",
+            options=LANDUSE_AGGREGATIONS,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: landuse_priority [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "landuse_priority", DEFAULTS["landuse_priority"]
+        )
+        param = QgsProcessingParameterString(
+            "landuse_priority",
+            "Landuse majority: priority landuses, winning when present (separated by ,)",
+            multiLine=False,
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
         # Define parameters: fire_layer [optional]
 
         defaultValue, _ = project.readEntry(
@@ -225,26 +321,42 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
-        # Define parameters: devc_layer  # FIXME implement
-        #
-        # defaultValue, _ = project.readEntry("qgis2fds", "devc_layer", None)
-        # if not defaultValue:
-        #     try:  # first layer name containing "devc"
-        #         defaultValue = [
-        #             layer.name()
-        #             for layer in QgsProject.instance().mapLayers().values()
-        #             if "DEVC" in layer.name() or "devc" in layer.name()
-        #         ][0]
-        #     except IndexError:
-        #         pass
-        # self.addParameter(
-        #     QgsProcessingParameterVectorLayer(
-        #         "devc_layer",
-        #         "FDS DEVCs layer",
-        #         optional=True,
-        #         defaultValue=defaultValue,
-        #     )
-        # )
+        # Define parameters: devc_layer [optional]
+
+        defaultValue, _ = project.readEntry("qgis2fds", "devc_layer", None)
+        if not defaultValue:
+            try:  # first layer name containing "devc"
+                defaultValue = [
+                    layer.name()
+                    for layer in QgsProject.instance().mapLayers().values()
+                    if "DEVC" in layer.name() or "devc" in layer.name()
+                ][0]
+            except IndexError:
+                pass
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "devc_layer",
+                "FDS DEVCs layer (point attributes: quantity, optional id and height above ground)",
+                types=[QgsProcessing.TypeVectorPoint],
+                optional=True,
+                defaultValue=defaultValue,
+            )
+        )
+
+        # Define parameter: fine_layer [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "fine_layer", DEFAULTS["fine_layer"]
+        )
+        param = QgsProcessingParameterVectorLayer(
+            "fine_layer",
+            "Refinement layer, for the fine meshes (if not set, use the fire layer)",
+            types=[QgsProcessing.TypeVectorPolygon],
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
 
         # Define parameters: wind_filepath [optional]
 
@@ -262,6 +374,44 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # Define parameters: wind_interval, wind_ws_tolerance, wind_wd_tolerance
+
+        for name, description in (
+            ("wind_interval", "Wind resampling interval (in s, 0 for none)"),
+            ("wind_ws_tolerance", "Wind speed simplify tolerance (in m/s, 0 for none)"),
+            ("wind_wd_tolerance", "Wind direction simplify tolerance (in °, 0 for none)"),
+        ):
+            defaultValue, _ = project.readDoubleEntry(
+                "qgis2fds", name, DEFAULTS[name]
+            )
+            param = QgsProcessingParameterNumber(
+                name,
+                description,
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=defaultValue,
+                minValue=0.0,
+            )
+            self.addParameter(param)
+            param.setFlags(
+                param.flags() | QgsProcessingParameterDefinition.FlagAdvanced
+            )
+
+        # Define parameters: wind_field_filepath [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "wind_field_filepath", DEFAULTS["wind_field_filepath"]
+        )
+        param = QgsProcessingParameterFile(
+            "wind_field_filepath",
+            "Wind field *.csv file (height, u and v raster files)",
+            behavior=QgsProcessingParameterFile.File,
+            fileFilter="CSV files (*.csv)",
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
         # Define parameter: tex_layer [optional]
 
         defaultValue, _ = project.readEntry(
@@ -291,6 +441,80 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(param)
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
 
+        # Define parameter: tex_hillshade
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "tex_hillshade", DEFAULTS["tex_hillshade"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "tex_hillshade",
+            "Export DEM hillshade and landuse colors as texture (no map rendering)",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: tex_image_type
+
+        defaultValue, _ = project.readNumEntry(
+            "qgis2fds", "tex_image_type", DEFAULTS["tex_image_type"]
+        )
+        param = QgsProcessingParameterEnum(
+            "tex_image_type",
+            "Texture image type",
+            options=TEX_IMAGE_TYPES,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: tex_quality
+
+        defaultValue, _ = project.readNumEntry(
+            "qgis2fds", "tex_quality", DEFAULTS["tex_quality"]
+        )
+        param = QgsProcessingParameterNumber(
+            "tex_quality",
+            "Texture quality, for JPEG and WebP (1 to 100)",
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=defaultValue,
+            minValue=1,
+            maxValue=100,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: tex_zlevel
+
+        defaultValue, _ = project.readNumEntry(
+            "qgis2fds", "tex_zlevel", DEFAULTS["tex_zlevel"]
+        )
+        param = QgsProcessingParameterNumber(
+            "tex_zlevel",
+            "Texture compression level, for PNG (1 fastest to 9 smallest)",
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=defaultValue,
+            minValue=1,
+            maxValue=9,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: tex_max_size
+
+        defaultValue, _ = project.readDoubleEntry(
+            "qgis2fds", "tex_max_size", DEFAULTS["tex_max_size"]
+        )
+        param = QgsProcessingParameterNumber(
+            "tex_max_size",
+            "Texture file size budget, downscale if over (in MB, 0 for unlimited)",
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=defaultValue,
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
         # Define parameter: nmesh
 
         defaultValue, _ = project.readNumEntry("qgis2fds", "nmesh", DEFAULTS["nmesh"])
@@ -318,6 +542,122 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(param)
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
 
+        # Define parameter: mesh_stretch
+
+        defaultValue, _ = project.readDoubleEntry(
+            "qgis2fds", "mesh_stretch", DEFAULTS["mesh_stretch"]
+        )
+        param = QgsProcessingParameterNumber(
+            "mesh_stretch",
+            "FDS MESH vertical stretching, max cell size ratio away from the terrain (1 for uniform)",
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=defaultValue,
+            minValue=1.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameters: fine_cell_size, fine_margin
+
+        defaultValue, _ = project.readDoubleEntry("qgis2fds", "fine_cell_size")
+        param = QgsProcessingParameterNumber(
+            "fine_cell_size",
+            "FDS fine MESH cell size, over the refinement layer (in meters; if not set, no fine meshes)",
+            type=QgsProcessingParameterNumber.Double,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=0.1,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        defaultValue, _ = project.readDoubleEntry(
+            "qgis2fds", "fine_margin", DEFAULTS["fine_margin"]
+        )
+        param = QgsProcessingParameterNumber(
+            "fine_margin",
+            "FDS fine MESH margin around the refinement layer (in meters)",
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=defaultValue,
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameters: domain_rotation, domain_bearing, domain_margin
+
+        defaultValue, _ = project.readNumEntry(
+            "qgis2fds", "domain_rotation", DEFAULTS["domain_rotation"]
+        )
+        param = QgsProcessingParameterEnum(
+            "domain_rotation",
+            "FDS domain rotation",
+            options=DOMAIN_ROTATIONS,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        defaultValue, _ = project.readDoubleEntry(
+            "qgis2fds", "domain_bearing", DEFAULTS["domain_bearing"]
+        )
+        param = QgsProcessingParameterNumber(
+            "domain_bearing",
+            "FDS domain bearing, for the user bearing rotation (in degrees from north)",
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=defaultValue,
+            minValue=-360.0,
+            maxValue=360.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        defaultValue, _ = project.readDoubleEntry(
+            "qgis2fds", "domain_margin", DEFAULTS["domain_margin"]
+        )
+        param = QgsProcessingParameterNumber(
+            "domain_margin",
+            "FDS domain margin around the fire layer, for its rectangle rotation and the trimming (in meters)",
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=defaultValue,
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameters: domain_trim, domain_fetch, domain_downwind
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "domain_trim", DEFAULTS["domain_trim"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "domain_trim",
+            "Trim the FDS domain extent to the fire layer and wind footprint",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        for name, description in (
+            ("domain_fetch", "FDS domain upwind fetch, for the trimming (in meters)"),
+            (
+                "domain_downwind",
+                "FDS domain downwind distance, for the trimming (in meters)",
+            ),
+        ):
+            defaultValue, _ = project.readDoubleEntry("qgis2fds", name, DEFAULTS[name])
+            param = QgsProcessingParameterNumber(
+                name,
+                description,
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=defaultValue,
+                minValue=0.0,
+            )
+            self.addParameter(param)
+            param.setFlags(
+                param.flags() | QgsProcessingParameterDefinition.FlagAdvanced
+            )
+
         # Define parameter: export_obst
 
         defaultValue, _ = project.readBoolEntry(
@@ -331,6 +671,79 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(param)
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
 
+        # Define parameter: obst_files
+
+        defaultValue, _ = project.readNumEntry(
+            "qgis2fds", "obst_files", DEFAULTS["obst_files"]
+        )
+        param = QgsProcessingParameterNumber(
+            "obst_files",
+            "FDS OBSTs include files, written in parallel (0 to write them in the case)",
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=defaultValue,
+            minValue=0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: in_memory
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "in_memory", DEFAULTS["in_memory"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "in_memory",
+            "Keep intermediate layers in memory (no temporary files)",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: sweep_wind_filepaths [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "sweep_wind_filepaths", DEFAULTS["sweep_wind_filepaths"]
+        )
+        param = QgsProcessingParameterString(
+            "sweep_wind_filepaths",
+            "Sweep: wind *.csv files (separated by ;)",
+            multiLine=False,
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: sweep_fire_layers [optional]
+
+        defaultValue, _ = project.readListEntry(
+            "qgis2fds", "sweep_fire_layers", DEFAULTS["sweep_fire_layers"]
+        )
+        param = QgsProcessingParameterMultipleLayers(
+            "sweep_fire_layers",
+            "Sweep: fire layers",
+            layerType=QgsProcessing.TypeVectorPolygon,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: sweep_level_set_modes [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "sweep_level_set_modes", DEFAULTS["sweep_level_set_modes"]
+        )
+        param = QgsProcessingParameterString(
+            "sweep_level_set_modes",
+            "Sweep: LEVEL_SET_MODE values (separated by ,)",
+            multiLine=False,
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
         # Output
 
         # param = QgsProcessingParameterFeatureSink(  # DEBUG FIXME
@@ -350,12 +763,76 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         # )
         # self.addParameter(param)
 
+    def flags(self):
+        """
+        Returns the algorithm flags.
+        The algorithm runs in a background task, so several exports
+        can run concurrently, and it can be canceled.
+        """
+        return (
+            super().flags() & ~QgsProcessingAlgorithm.FlagNoThreading
+        ) | QgsProcessingAlgorithm.FlagCanCancel
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """
+        Prepare algorithm, in the main thread.
+        Collect here what is not thread safe.
+        """
+        from .types import Texture, HillshadeTexture
+        from . import algos
+
+        self._entries = algos.ProjectEntries()
+        # Render clones of the texture layer or of the map canvas layers,
+        # owned by this run
+        tex_layer = None
+        if "tex_layer" in parameters:
+            tex_layer = self.parameterAsRasterLayer(parameters, "tex_layer", context)
+        self._tex_layers = [
+            layer.clone() for layer in Texture.get_layers(tex_layer=tex_layer)
+        ]
+        landuse_layer = None
+        if "landuse_layer" in parameters:
+            landuse_layer = self.parameterAsRasterLayer(
+                parameters, "landuse_layer", context
+            )
+        self._tex_palette = HillshadeTexture.get_palette(
+            landuse_layer=landuse_layer, landuse_type=None
+        )
+        self._tex_styles = list()  # for the texture fingerprint
+        for layer in self._tex_layers:
+            doc = QDomDocument()
+            layer.exportNamedStyle(doc)
+            self._tex_styles.append(doc.toString())
+        return True
+
     def processAlgorithm(self, parameters, context, feedback):
         """
-        Process algorithm.
+        Process algorithm, in a background task.
+        The project is only read, its entries are written by postProcessAlgorithm.
         """
 
+        from .types import (
+            utils,
+            FDSCase,
+            Domain,
+            OBSTTerrain,
+            GEOMTerrain,
+            get_sampled_matrix,
+            LanduseType,
+            Texture,
+            SavedTexture,
+            HillshadeTexture,
+            Wind,
+            WindField,
+            Devcs,
+        )
+        from .core.scheduler import Scheduler, THREAD, PROCESS
+        from .core.manifest import Manifest, get_file_signature
+        from .core import terrain as core_terrain
+        from . import algos
+
         results, outputs, project = {}, {}, QgsProject.instance()
+        entries = self._entries
 
         # Check project crs and save it
 
@@ -363,14 +840,14 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             raise QgsProcessingException(
                 f"Project CRS <{project.crs().description()}> is not valid, cannot proceed."
             )
-        project.writeEntry("qgis2fds", "project_crs", project.crs().description())
+        entries.writeEntry("qgis2fds", "project_crs", project.crs().description())
 
         # Get parameter: chid
 
         chid = self.parameterAsString(parameters, "chid", context)
         if not chid:
             raise QgsProcessingException(self.invalidSourceError(parameters, "chid"))
-        project.writeEntry("qgis2fds", "chid", chid)
+        entries.writeEntry("qgis2fds", "chid", chid)
 
         # Get parameter: fds_path
 
@@ -385,7 +862,7 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             raise QgsProcessingException(
                 self.invalidSourceError(parameters, "fds_path")
             )
-        project.writeEntry("qgis2fds", "fds_path", fds_path)
+        entries.writeEntry("qgis2fds", "fds_path", fds_path)
         fds_path = os.path.join(project_path, fds_path)  # make abs
 
         # Get parameter: pixel_size
@@ -395,34 +872,76 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             raise QgsProcessingException(
                 self.invalidSourceError(parameters, "pixel_size")
             )
-        project.writeEntryDouble("qgis2fds", "pixel_size", pixel_size)
+        entries.writeEntryDouble("qgis2fds", "pixel_size", pixel_size)
 
         # Get parameter: nmesh
 
         nmesh = self.parameterAsInt(parameters, "nmesh", context)
         if not nmesh or nmesh < 1:
             raise QgsProcessingException(self.invalidSourceError(parameters, "nmesh"))
-        project.writeEntry("qgis2fds", "nmesh", nmesh)
+        entries.writeEntry("qgis2fds", "nmesh", nmesh)
 
         # Get parameter: cell_size
 
         cell_size = self.parameterAsDouble(parameters, "cell_size", context)
         if not cell_size:
             cell_size = pixel_size
-            project.writeEntry("qgis2fds", "cell_size", "")
+            entries.writeEntry("qgis2fds", "cell_size", "")
         elif cell_size <= 0.0:
             raise QgsProcessingException(
                 self.invalidSourceError(parameters, "cell_size")
             )
         else:
-            project.writeEntryDouble("qgis2fds", "cell_size", cell_size)
+            entries.writeEntryDouble("qgis2fds", "cell_size", cell_size)
+
+        # Get parameter: mesh_stretch
+
+        mesh_stretch = self.parameterAsDouble(parameters, "mesh_stretch", context)
+        if mesh_stretch < 1.0:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, "mesh_stretch")
+            )
+        entries.writeEntryDouble("qgis2fds", "mesh_stretch", mesh_stretch)
+
+        # Get parameters: fine_cell_size, fine_margin
+
+        fine_cell_size = self.parameterAsDouble(parameters, "fine_cell_size", context)
+        if not fine_cell_size:
+            fine_cell_size = None
+            entries.writeEntry("qgis2fds", "fine_cell_size", "")
+        elif fine_cell_size <= 0.0:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, "fine_cell_size")
+            )
+        else:
+            entries.writeEntryDouble("qgis2fds", "fine_cell_size", fine_cell_size)
+        fine_margin = self.parameterAsDouble(parameters, "fine_margin", context)
+        entries.writeEntryDouble("qgis2fds", "fine_margin", fine_margin)
+
+        # Get parameters: domain_rotation, domain_bearing, domain_margin
+
+        domain_rotation = self.parameterAsEnum(parameters, "domain_rotation", context)
+        entries.writeEntry("qgis2fds", "domain_rotation", domain_rotation)
+        domain_bearing = self.parameterAsDouble(parameters, "domain_bearing", context)
+        entries.writeEntryDouble("qgis2fds", "domain_bearing", domain_bearing)
+        domain_margin = self.parameterAsDouble(parameters, "domain_margin", context)
+        entries.writeEntryDouble("qgis2fds", "domain_margin", domain_margin)
+
+        # Get parameters: domain_trim, domain_fetch, domain_downwind
+
+        domain_trim = self.parameterAsBool(parameters, "domain_trim", context)
+        entries.writeEntryBool("qgis2fds", "domain_trim", domain_trim)
+        domain_fetch = self.parameterAsDouble(parameters, "domain_fetch", context)
+        entries.writeEntryDouble("qgis2fds", "domain_fetch", domain_fetch)
+        domain_downwind = self.parameterAsDouble(parameters, "domain_downwind", context)
+        entries.writeEntryDouble("qgis2fds", "domain_downwind", domain_downwind)
 
         # Get parameter: extent (and wgs84_extent)
 
         extent = self.parameterAsExtent(parameters, "extent", context)
         if not extent:
             raise QgsProcessingException(self.invalidSourceError(parameters, "extent"))
-        project.writeEntry("qgis2fds", "extent", parameters["extent"])  # as str
+        entries.writeEntry("qgis2fds", "extent", parameters["extent"])  # as str
 
         wgs84_crs = QgsCoordinateReferenceSystem("EPSG:4326")
         wgs84_extent = self.parameterAsExtent(
@@ -433,35 +952,37 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
 
         wgs84_origin = QgsPoint(wgs84_extent.center())
         origin = parameters.get("origin") or ""
-        project.writeEntry("qgis2fds", "origin", origin)  # as str
+        entries.writeEntry("qgis2fds", "origin", origin)  # as str
         if origin:
             # prevent a QGIS bug when using parameterAsPoint with crs=wgs84_crs
             # the point is exported in project crs
             origin = self.parameterAsPoint(parameters, "origin", context)
-            wgs84_origin = QgsPoint(origin)
-            project_to_wgs84_tr = QgsCoordinateTransform(
-                project.crs(), wgs84_crs, project
+            x, y = algos.transform_coords(
+                origin.x(), origin.y(), project.crs(), wgs84_crs
             )
-            wgs84_origin.transform(project_to_wgs84_tr)
+            wgs84_origin = QgsPoint(float(x), float(y))
 
         # Get applicable UTM crs, then UTM origin and extent
 
         utm_epsg = utils.lonlat_to_epsg(lon=wgs84_origin.x(), lat=wgs84_origin.y())
         utm_crs = QgsCoordinateReferenceSystem(utm_epsg)
 
-        wgs84_to_utm_tr = QgsCoordinateTransform(wgs84_crs, utm_crs, project)
-        utm_origin = wgs84_origin.clone()
-        utm_origin.transform(wgs84_to_utm_tr)
-
-        utm_extent = self.parameterAsExtent(parameters, "extent", context, crs=utm_crs)
+        x, y = algos.transform_coords(
+            wgs84_origin.x(), wgs84_origin.y(), wgs84_crs, utm_crs
+        )
+        utm_origin = QgsPoint(float(x), float(y))
 
         # Get parameters: landuse_layer and landuse_type (optional)
 
         landuse_layer, landuse_type_filepath = None, None
-        if "landuse_layer" in parameters and "landuse_type_filepath" in parameters:
+        if "landuse_type_filepath" in parameters:
             landuse_type_filepath = self.parameterAsFile(
                 parameters, "landuse_type_filepath", context
             )
+            entries.writeEntry(
+                "qgis2fds", "landuse_type_filepath", landuse_type_filepath
+            )
+        if "landuse_layer" in parameters:
             landuse_layer = self.parameterAsRasterLayer(
                 parameters, "landuse_layer", context
             )
@@ -469,69 +990,107 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
                 raise QgsProcessingException(
                     f"Landuse layer CRS <{landuse_layer.crs().description()}> is not valid, cannot proceed."
                 )
-            project.writeEntry(
+            entries.writeEntry(
                 "qgis2fds", "landuse_layer", parameters.get("landuse_layer")
             )  # as str
-            project.writeEntry(
-                "qgis2fds", "landuse_type_filepath", landuse_type_filepath
-            )
 
-        landuse_type = LanduseType(
-            feedback=feedback,
-            project_path=project_path,
-            filepath=landuse_type_filepath,
+        # Get parameter: landuse_tiles (optional)
+
+        landuse_tiles = self.parameterAsString(parameters, "landuse_tiles", context)
+        entries.writeEntry("qgis2fds", "landuse_tiles", landuse_tiles)
+        landuse_tiles = [t.strip() for t in landuse_tiles.split(";") if t.strip()]
+
+        # Get parameters: landuse_aggregation and landuse_priority
+
+        landuse_mode = bool(
+            self.parameterAsEnum(parameters, "landuse_aggregation", context)
+        )
+        entries.writeEntry("qgis2fds", "landuse_aggregation", int(landuse_mode))
+        landuse_priority = self.parameterAsString(
+            parameters, "landuse_priority", context
         )
+        entries.writeEntry("qgis2fds", "landuse_priority", landuse_priority)
+        try:
+            landuse_priority = [
+                int(p) for p in landuse_priority.split(",") if p.strip()
+            ]
+        except ValueError:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, "landuse_priority")
+            )
 
         # Get parameter: fire_layer (optional)
 
-        fire_layer, utm_fire_layer, utm_b_fire_layer = None, None, None
+        fire_layer = None
         if "fire_layer" in parameters:
             fire_layer = self.parameterAsVectorLayer(parameters, "fire_layer", context)
-            if fire_layer:
-                if not fire_layer.crs().isValid():
-                    raise QgsProcessingException(
-                        f"Fire layer CRS <{fire_layer.crs().description()}> is not valid, cannot proceed."
-                    )
-                utm_fire_layer, utm_b_fire_layer = algos.get_utm_fire_layers(
-                    context,
-                    feedback,
-                    fire_layer=fire_layer,
-                    destination_crs=utm_crs,
-                    pixel_size=pixel_size,
+            if fire_layer and not fire_layer.crs().isValid():
+                raise QgsProcessingException(
+                    f"Fire layer CRS <{fire_layer.crs().description()}> is not valid, cannot proceed."
                 )
-            project.writeEntry(
+            entries.writeEntry(
                 "qgis2fds", "fire_layer", parameters.get("fire_layer")
             )  # as str
 
-        # Get devc_layer (optional)
-        # devc_layer = None
-        # if parameters["devc_layer"]:
-        #     devc_layer = self.parameterAsVectorLayer(parameters, "devc_layer", context)
-        #     if not devc_layer.crs().isValid():
-        #         raise QgsProcessingException(
-        #             f"DEVCs layer CRS <{devc_layer.crs().description()}> is not valid, cannot proceed."
-        #         )
-        # project.writeEntry("qgis2fds", "devc_layer", parameters["devc_layer"])
+        # Get parameter: devc_layer (optional)
+
+        devc_layer = None
+        if "devc_layer" in parameters:
+            devc_layer = self.parameterAsVectorLayer(parameters, "devc_layer", context)
+            if devc_layer and not devc_layer.crs().isValid():
+                raise QgsProcessingException(
+                    f"DEVCs layer CRS <{devc_layer.crs().description()}> is not valid, cannot proceed."
+                )
+            entries.writeEntry(
+                "qgis2fds", "devc_layer", parameters.get("devc_layer")
+            )  # as str
+
+        # Get parameter: fine_layer (optional)
+
+        fine_layer = None
+        if "fine_layer" in parameters:
+            fine_layer = self.parameterAsVectorLayer(parameters, "fine_layer", context)
+            if fine_layer and not fine_layer.crs().isValid():
+                raise QgsProcessingException(
+                    f"Refinement layer CRS <{fine_layer.crs().description()}> is not valid, cannot proceed."
+                )
+            entries.writeEntry(
+                "qgis2fds", "fine_layer", parameters.get("fine_layer")
+            )  # as str
 
         # Get parameter: wind_filepath (optional)
 
         wind_filepath = self.parameterAsFile(parameters, "wind_filepath", context)
-        project.writeEntry("qgis2fds", "wind_filepath", wind_filepath)
+        entries.writeEntry("qgis2fds", "wind_filepath", wind_filepath)
+
+        # Get parameters: wind_interval, wind_ws_tolerance, wind_wd_tolerance
 
-        wind = Wind(
-            feedback=feedback, project_path=project_path, filepath=wind_filepath
+        wind_reduction = dict()
+        for name, key in (
+            ("wind_interval", "interval"),
+            ("wind_ws_tolerance", "ws_tolerance"),
+            ("wind_wd_tolerance", "wd_tolerance"),
+        ):
+            wind_reduction[key] = self.parameterAsDouble(parameters, name, context)
+            entries.writeEntryDouble("qgis2fds", name, wind_reduction[key])
+
+        # Get parameter: wind_field_filepath (optional)
+
+        wind_field_filepath = self.parameterAsFile(
+            parameters, "wind_field_filepath", context
         )
+        entries.writeEntry("qgis2fds", "wind_field_filepath", wind_field_filepath)
 
         # Get parameter: tex_layer (optional)
 
-        tex_layer, texture = None, None
+        tex_layer = None
         if "tex_layer" in parameters:
             tex_layer = self.parameterAsRasterLayer(parameters, "tex_layer", context)
             if tex_layer and not tex_layer.crs().isValid():
                 raise QgsProcessingException(
                     f"Texture layer CRS <{tex_layer.crs().description()}> is not valid, cannot proceed."
                 )
-            project.writeEntry("qgis2fds", "tex_layer", parameters.get("tex_layer"))
+            entries.writeEntry("qgis2fds", "tex_layer", parameters.get("tex_layer"))
 
         # Get parameter: tex_pixel_size
 
@@ -542,35 +1101,247 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             raise QgsProcessingException(
                 self.invalidSourceError(parameters, "tex_pixel_size")
             )
-        project.writeEntryDouble("qgis2fds", "tex_pixel_size", tex_pixel_size)
+        entries.writeEntryDouble("qgis2fds", "tex_pixel_size", tex_pixel_size)
+
+        # Get parameter: tex_hillshade
+
+        tex_hillshade = self.parameterAsBool(parameters, "tex_hillshade", context)
+        entries.writeEntryBool("qgis2fds", "tex_hillshade", tex_hillshade)
+
+        # Get parameters: tex_image_type, tex_quality, tex_zlevel, tex_max_size
+
+        tex_image_type = self.parameterAsEnum(parameters, "tex_image_type", context)
+        entries.writeEntry("qgis2fds", "tex_image_type", tex_image_type)
+        tex_quality = self.parameterAsInt(parameters, "tex_quality", context)
+        entries.writeEntry("qgis2fds", "tex_quality", tex_quality)
+        tex_zlevel = self.parameterAsInt(parameters, "tex_zlevel", context)
+        entries.writeEntry("qgis2fds", "tex_zlevel", tex_zlevel)
+        tex_max_size = self.parameterAsDouble(parameters, "tex_max_size", context)
+        entries.writeEntryDouble("qgis2fds", "tex_max_size", tex_max_size)
+        tex_encoding = {
+            "image_type": TEX_IMAGE_TYPES[tex_image_type],
+            "zlevel": tex_zlevel,
+            "quality": tex_quality,
+            "max_filesize": int(tex_max_size * 1e6),
+        }
 
-        texture = Texture(
-            feedback=feedback,
-            path=fds_path,
-            name=chid,
-            image_type="png",
-            pixel_size=tex_pixel_size,
-            tex_layer=tex_layer,
-            utm_extent=utm_extent,
-            utm_crs=utm_crs,
+        # Get parameter: export_obst
+
+        export_obst = self.parameterAsBool(parameters, "export_obst", context)
+        entries.writeEntryBool("qgis2fds", "export_obst", export_obst)
+
+        # Get parameter: obst_files
+
+        obst_files = self.parameterAsInt(parameters, "obst_files", context)
+        entries.writeEntry("qgis2fds", "obst_files", obst_files)
+
+        # Get parameter: in_memory
+
+        in_memory = self.parameterAsBool(parameters, "in_memory", context)
+        entries.writeEntryBool("qgis2fds", "in_memory", in_memory)
+        algos.set_in_memory(in_memory)
+
+        # Get parameters: sweep_wind_filepaths, sweep_fire_layers,
+        # and sweep_level_set_modes (optional)
+
+        sweep_wind_filepaths = self.parameterAsString(
+            parameters, "sweep_wind_filepaths", context
+        )
+        entries.writeEntry("qgis2fds", "sweep_wind_filepaths", sweep_wind_filepaths)
+        sweep_wind_filepaths = [
+            f.strip() for f in sweep_wind_filepaths.split(";") if f.strip()
+        ]
+
+        sweep_fire_layers = self.parameterAsLayerList(
+            parameters, "sweep_fire_layers", context
+        )
+        for layer in sweep_fire_layers:
+            if not layer.crs().isValid():
+                raise QgsProcessingException(
+                    f"Sweep fire layer <{layer.name()}> CRS <{layer.crs().description()}> is not valid, cannot proceed."
+                )
+        entries.writeEntry(
+            "qgis2fds",
+            "sweep_fire_layers",
+            [layer.id() for layer in sweep_fire_layers],
         )
 
-        # Get DEVCs layer  # FIXME implement
-        # utm_devc_layer = None
-        # if devc_layer:
-        #     pass
+        sweep_level_set_modes = self.parameterAsString(
+            parameters, "sweep_level_set_modes", context
+        )
+        entries.writeEntry(
+            "qgis2fds", "sweep_level_set_modes", sweep_level_set_modes
+        )
+        try:
+            sweep_level_set_modes = [
+                int(m) for m in sweep_level_set_modes.split(",") if m.strip()
+            ]
+        except ValueError:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, "sweep_level_set_modes")
+            )
+        if any(m not in (1, 2, 3, 4) for m in sweep_level_set_modes):
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, "sweep_level_set_modes")
+            )
 
-        #     if feedback.isCanceled():
-        #         return {}
+        # Read the wind time series, for the domain rotation and trimming
 
-        # Get parameter: export_obst
+        ws, wd = None, None
+        if wind_filepath and (domain_rotation == 3 or domain_trim):
+            from .core import wind as core_wind
 
-        export_obst = self.parameterAsBool(parameters, "export_obst", context)
-        project.writeEntryBool("qgis2fds", "export_obst", export_obst)
+            try:
+                _, ws, wd = core_wind.read_csv(
+                    os.path.join(project_path, wind_filepath)
+                )
+            except Exception as err:
+                raise QgsProcessingException(
+                    f"Cannot import wind *.csv file: <{wind_filepath}>:\n{err}"
+                )
+
+        # Get the domain bearing
+
+        if domain_rotation == 2:  # fire layer minimum area rectangle
+            if not fire_layer:
+                raise QgsProcessingException(
+                    "No fire layer for the domain rotation, cannot proceed."
+                )
+            domain_bearing = algos.get_min_area_bearing(
+                fire_layer, crs=algos.get_rotated_crs(wgs84_origin, bearing=0.0)
+            )
+        elif domain_rotation == 3:  # mean wind direction
+            if ws is None:
+                raise QgsProcessingException(
+                    "No wind *.csv file for the domain rotation, cannot proceed."
+                )
+            domain_bearing = float(core_wind.get_mean_direction(ws, wd))
+        elif domain_rotation == 0:  # north up
+            domain_bearing = 0.0
+        domain_bearing = algos.get_normalized_bearing(domain_bearing)
+
+        # Get the domain extent in a frame, the requested extent,
+        # or the fire footprint: the fire layer buffered by the margin,
+        # and when trimming by the upwind fetch and downwind distance
+        # of each wind direction
+
+        if domain_trim and not fire_layer:
+            feedback.reportError("No fire layer for the domain trimming, skipped.")
+        is_footprint = bool(fire_layer) and (domain_rotation == 2 or domain_trim)
+
+        def get_domain_extent(crs, bearing):
+            extent = self.parameterAsExtent(parameters, "extent", context, crs=crs)
+            if not is_footprint:
+                return extent
+            e = algos.get_layer_extent(fire_layer, crs=crs).buffered(domain_margin)
+            if domain_trim and ws is not None:
+                x0, y0, x1, y1 = core_wind.get_footprint_margins(
+                    ws,
+                    wd,
+                    bearing=bearing,
+                    fetch=domain_fetch,
+                    downwind=domain_downwind,
+                )
+                e = QgsRectangle(
+                    e.xMinimum() - x0,
+                    e.yMinimum() - y0,
+                    e.xMaximum() + x1,
+                    e.yMaximum() + y1,
+                )
+            extent = e.intersect(extent)
+            if extent.isEmpty():
+                raise QgsProcessingException(
+                    "Fire layer outside of the extent, cannot proceed."
+                )
+            return extent
+
+        north_utm_area = self.parameterAsExtent(
+            parameters, "extent", context, crs=utm_crs
+        ).area()
+        utm_extent = get_domain_extent(utm_crs, bearing=0.0)
+
+        # Rotate the domain frame, so that the domain rectangle
+        # fits the footprint with fewer cells.
+        # The rotated requested extent is covered by a larger rectangle,
+        # so the rotation needs a footprint, and is kept only if smaller
+
+        if domain_bearing and not is_footprint:
+            feedback.reportError(
+                "No fire footprint for the domain rotation "
+                "(fire layer rectangle or trimming), domain kept north up."
+            )
+            domain_bearing = 0.0
+        if domain_bearing:
+            rotated_crs = algos.get_rotated_crs(wgs84_origin, bearing=domain_bearing)
+            rotated_extent = get_domain_extent(rotated_crs, bearing=domain_bearing)
+            if rotated_extent.area() < utm_extent.area():
+                feedback.pushInfo(
+                    f"Rotate the domain to <{domain_bearing:.1f}°> bearing."
+                )
+                utm_crs, utm_extent = rotated_crs, rotated_extent
+                x, y = algos.transform_coords(
+                    wgs84_origin.x(), wgs84_origin.y(), wgs84_crs, utm_crs
+                )
+                utm_origin = QgsPoint(float(x), float(y))
+            else:
+                feedback.reportError(
+                    f"Domain rotated to <{domain_bearing:.1f}°> bearing "
+                    "is not smaller, domain kept north up."
+                )
+                domain_bearing = 0.0
+        if domain_rotation or domain_trim:
+            a0, a1 = north_utm_area, utm_extent.area()
+            feedback.pushInfo(
+                f"Domain extent: {utm_extent.toString(1)}\n"
+                f"Domain area: {a1 / 1e6:.3f} km², "
+                f"instead of {a0 / 1e6:.3f} km² ({(1.0 - a1 / a0) * 100.0:.0f}% less)\n"
+                f"Sampling points: ~{a1 / pixel_size**2:.0f}, "
+                f"instead of ~{a0 / pixel_size**2:.0f}\n"
+                f"MESH cells per layer: ~{a1 / cell_size**2:.0f}, "
+                f"instead of ~{a0 / cell_size**2:.0f}"
+            )
+
+        # Get the fine meshes extent, in the domain frame
+
+        fine_extent = None
+        if fine_cell_size and not (fine_layer or fire_layer):
+            feedback.reportError("No refinement or fire layer, no fine meshes.")
+        elif fine_cell_size:
+            fine_extent = algos.get_layer_extent(fine_layer or fire_layer, crs=utm_crs)
+            fine_extent = fine_extent.buffered(fine_margin).intersect(utm_extent)
+            if pixel_size > fine_cell_size:
+                feedback.reportError(
+                    f"Terrain sampled at <{pixel_size}> m pixel size, "
+                    f"coarser than the <{fine_cell_size}> m fine cells."
+                )
 
-        # Get parameter: dem_layer
+        # Get the landuse tiles mosaic, in the domain frame
 
+        if landuse_tiles:
+            landuse_layer = algos.get_mosaic_layer(
+                context,
+                feedback,
+                sources=[os.path.join(project_path, t) for t in landuse_tiles],
+                extent=utm_extent,
+                extent_crs=utm_crs,
+                name="landuse_mosaic",
+            )
+
+        # Get parameters: dem_layer or dem_tiles
+
+        dem_tiles = self.parameterAsString(parameters, "dem_tiles", context)
+        entries.writeEntry("qgis2fds", "dem_tiles", dem_tiles)
+        dem_tiles = [t.strip() for t in dem_tiles.split(";") if t.strip()]
         dem_layer = self.parameterAsRasterLayer(parameters, "dem_layer", context)
+        if not dem_layer and dem_tiles:
+            dem_layer = algos.get_mosaic_layer(
+                context,
+                feedback,
+                sources=[os.path.join(project_path, t) for t in dem_tiles],
+                extent=utm_extent,
+                extent_crs=utm_crs,
+                name="dem_mosaic",
+            )
         if not dem_layer:
             raise QgsProcessingException(
                 self.invalidSourceError(parameters, "dem_layer")
@@ -579,83 +1350,325 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             raise QgsProcessingException(
                 f"DEM layer CRS <{dem_layer.crs().description()}> is not valid, cannot proceed."
             )
-        project.writeEntry("qgis2fds", "dem_layer", parameters.get("dem_layer"))
+        entries.writeEntry("qgis2fds", "dem_layer", parameters.get("dem_layer"))
 
-        # Calc the interpolated DEM layer
+        # Without texture layers (eg. headless runs), use the hillshade texture
 
-        outputs["utm_dem_layer"] = algos.clip_and_interpolate_dem(
-            context,
-            feedback,
-            dem_layer=dem_layer,
-            extent=utm_extent,
-            extent_crs=utm_crs,
-            pixel_size=pixel_size,
-            # output=parameters["utm_dem_layer"],  # DEBUG
+        tex_layers = self._tex_layers  # the tex_layer, or the canvas layers
+        tex_hillshade = tex_hillshade or not tex_layers
+
+        # Fingerprint the inputs of the terrain and texture files,
+        # the pipeline skips them when unchanged since the previous export
+
+        manifest = Manifest(path=fds_path, name=chid)
+
+        def get_signature(layer, tiles=()):
+            if tiles:
+                sources = [os.path.join(project_path, t) for t in tiles]
+                return [
+                    get_file_signature(f) for f in algos.get_tile_filepaths(sources)
+                ]
+            if layer and layer.isModified():  # unsaved edits
+                return time.time_ns()
+            return layer and get_file_signature(layer.source().split("|")[0])
+
+        landuse_signature = (
+            get_signature(landuse_layer, landuse_tiles),
+            landuse_type_filepath
+            and get_file_signature(os.path.join(project_path, landuse_type_filepath)),
+        )
+        matrix_fingerprint = manifest.get_fingerprint(
+            chid,
+            utm_crs.toWkt(),
+            utm_extent.toString(),
+            utm_origin.asWkt(),
+            pixel_size,
+            get_signature(dem_layer, dem_tiles),
+            landuse_signature,
+            landuse_mode,
+            landuse_priority,
+            get_signature(fire_layer),
+        )
+        terrain_fingerprint = manifest.get_fingerprint(
+            matrix_fingerprint, export_obst, obst_files
+        )
+        tex_fingerprint = manifest.get_fingerprint(
+            chid,
+            utm_crs.toWkt(),
+            utm_extent.toString(),
+            tex_pixel_size,
+            tex_encoding,
+            tex_hillshade,
+            tex_hillshade
+            and (
+                get_signature(dem_layer, dem_tiles),
+                landuse_signature,
+                self._tex_palette,
+            )
+            or [
+                (get_signature(layer), style)
+                for layer, style in zip(tex_layers, self._tex_styles)
+            ],
         )
 
-        if feedback.isCanceled():
-            return {}
+        # Prepare the pipeline stages:
+        # texture rendering, landuse type and wind parsing run in threads,
+        # while QGIS processing algorithms run here, as they share the context
 
-        # results["utm_dem_layer"] = outputs["utm_dem_layer"]["OUTPUT"] # DEBUG
-        utm_dem_layer = QgsRasterLayer(outputs["utm_dem_layer"]["OUTPUT"])
+        scheduler = Scheduler(feedback=feedback)
 
-        # Get the sampling grid
-        outputs["sampling_layer"] = algos.get_sampling_point_grid_layer(
-            context,
-            feedback,
-            utm_dem_layer=utm_dem_layer,
-            landuse_layer=landuse_layer,
-            landuse_type=landuse_type,
-            utm_fire_layer=utm_fire_layer,  # utm
-            utm_b_fire_layer=utm_b_fire_layer,  # utm buffered
-            # output=parameters["sampling_layer"],  # DEBUG
+        scheduler.add(
+            "landuse_type",
+            lambda feedback: LanduseType(
+                feedback=feedback,
+                project_path=project_path,
+                filepath=landuse_type_filepath,
+            ),
+            kind=THREAD,
         )
 
-        if feedback.isCanceled():
-            return {}
+        scheduler.add(
+            "wind",
+            lambda feedback: Wind(
+                feedback=feedback,
+                project_path=project_path,
+                filepath=wind_filepath,
+                **wind_reduction,
+            ),
+            kind=THREAD,
+        )
 
-        # if DEBUG:
-        #     results["sampling_layer"] = outputs["sampling_layer"]["OUTPUT"]  # DEBUG FIXME
-        sampling_layer = context.getMapLayer(outputs["sampling_layer"]["OUTPUT"])
+        # Render the texture, if changed
 
-        if sampling_layer.featureCount() < 9:
-            raise QgsProcessingException(
-                f"[QGIS bug] Too few features in sampling layer, cannot proceed.\n{sampling_layer.featureCount()}"
+        tex_is_saved = manifest.is_current("texture", tex_fingerprint)
+        if tex_is_saved:
+            scheduler.add(
+                "texture",
+                lambda feedback: SavedTexture(
+                    feedback=feedback, **manifest.get_meta("texture")
+                ),
+            )
+        elif not tex_hillshade:
+            scheduler.add(
+                "texture",
+                lambda feedback: Texture(
+                    feedback=feedback,
+                    path=fds_path,
+                    name=chid,
+                    pixel_size=tex_pixel_size,
+                    layers=tex_layers,
+                    utm_extent=utm_extent,
+                    utm_crs=utm_crs,
+                    **tex_encoding,
+                ),
+                kind=THREAD,
+            )
+
+        # Reuse the terrain matrix, if unchanged, skipping the DEM interpolation
+        # and the sampling, unless the hillshade texture, the wind field,
+        # or the sweep fire layers need the DEM or the sampling layer
+
+        matrix_filename = f"{chid}_terrain.npy"
+        is_sampled = (
+            manifest.is_current("matrix", matrix_fingerprint)
+            and (tex_is_saved or not tex_hillshade)
+            and not wind_field_filepath
+            and not sweep_fire_layers
+        )
+
+        def get_utm_fire_layers(feedback):
+            if not fire_layer:
+                return None, None
+            return algos.get_utm_fire_layers(
+                context,
+                feedback,
+                fire_layer=fire_layer,
+                destination_crs=utm_crs,
+                pixel_size=pixel_size,
+            )
+
+        if not is_sampled:
+            scheduler.add("utm_fire_layers", get_utm_fire_layers)
+
+        # Calc the interpolated DEM layer
+
+        if not is_sampled:
+            scheduler.add(
+                "utm_dem_layer",
+                lambda feedback: algos.clip_and_interpolate_dem(
+                    context,
+                    feedback,
+                    dem_layer=dem_layer,
+                    extent=utm_extent,
+                    extent_crs=utm_crs,
+                    pixel_size=pixel_size,
+                    # output=parameters["utm_dem_layer"],  # DEBUG
+                ),
+            )
+
+        if tex_hillshade and not tex_is_saved:
+            tex_palette = not landuse_tiles and self._tex_palette or None
+            landuse_filepath = landuse_layer and landuse_layer.source()
+            scheduler.add(
+                "texture",
+                lambda feedback: HillshadeTexture(
+                    feedback=feedback,
+                    path=fds_path,
+                    name=chid,
+                    pixel_size=tex_pixel_size,
+                    utm_extent=utm_extent,
+                    utm_crs=utm_crs,
+                    dem_filepath=scheduler.results["utm_dem_layer"]["OUTPUT"],
+                    landuse_filepath=landuse_filepath,
+                    palette=tex_palette
+                    or HillshadeTexture.get_palette(
+                        landuse_layer=None,
+                        landuse_type=scheduler.results["landuse_type"],
+                    ),
+                    **tex_encoding,
+                ),
+                deps=("landuse_type", "utm_dem_layer"),
+                kind=THREAD,
+            )
+
+        # Get the sampling grid
+
+        def get_sampling_layer(feedback):
+            utm_fire_layer, utm_b_fire_layer = scheduler.results["utm_fire_layers"]
+            # results["utm_dem_layer"] = outputs["utm_dem_layer"]["OUTPUT"] # DEBUG
+            utm_dem_layer = QgsRasterLayer(
+                scheduler.results["utm_dem_layer"]["OUTPUT"]
+            )
+            return algos.get_sampling_point_grid_layer(
+                context,
+                feedback,
+                utm_dem_layer=utm_dem_layer,
+                landuse_layer=landuse_layer,
+                landuse_type=scheduler.results["landuse_type"],
+                utm_fire_layer=utm_fire_layer,  # utm
+                utm_b_fire_layer=utm_b_fire_layer,  # utm buffered
+                landuse_mode=landuse_mode,
+                landuse_priority=landuse_priority,
+                # output=parameters["sampling_layer"],  # DEBUG
+            )
+
+        if not is_sampled:
+            scheduler.add(
+                "sampling_layer",
+                get_sampling_layer,
+                deps=("landuse_type", "utm_fire_layers", "utm_dem_layer"),
+            )
+
+        # Prepare terrain: its matrix from the sampling layer or the previous
+        # export, then its geometry, pure NumPy, in a worker process
+
+        def get_terrain_matrix(feedback):
+            if is_sampled:
+                feedback.pushInfo("Terrain matrix already sampled.")
+                try:
+                    return core_terrain.load_matrix(
+                        os.path.join(fds_path, matrix_filename)
+                    )
+                except Exception as err:
+                    raise QgsProcessingException(
+                        f"Terrain matrix not readable, cannot proceed.\n{err}"
+                    )
+            # if DEBUG:
+            #     results["sampling_layer"] = outputs["sampling_layer"]["OUTPUT"]  # DEBUG FIXME
+            sampling_layer = context.getMapLayer(
+                scheduler.results["sampling_layer"]["OUTPUT"]
+            )
+
+            if sampling_layer.featureCount() < 9:
+                raise QgsProcessingException(
+                    f"[QGIS bug] Too few features in sampling layer, cannot proceed.\n{sampling_layer.featureCount()}"
+                )
+            return get_sampled_matrix(
+                feedback=feedback,
+                sampling_layer=sampling_layer,
+                utm_origin=utm_origin,
+                landuse_layer=landuse_layer,
+                fire_layer=fire_layer,
+            )
+
+        scheduler.add(
+            "terrain_matrix",
+            get_terrain_matrix,
+            deps=not is_sampled and ("sampling_layer",) or (),
+        )
+
+        scheduler.add(
+            "terrain_geometry",
+            core_terrain.get_geometry,
+            deps=("terrain_matrix",),
+            kind=PROCESS,
+            kwargs=lambda: dict(
+                m=scheduler.results["terrain_matrix"], is_obst=export_obst
+            ),
+        )
+
+        def get_terrain(feedback):
+            if export_obst:
+                Terrain = OBSTTerrain
+            else:
+                Terrain = GEOMTerrain
+            return Terrain(
+                feedback=feedback,
+                sampling_layer=not is_sampled
+                and context.getMapLayer(scheduler.results["sampling_layer"]["OUTPUT"])
+                or None,
+                utm_origin=utm_origin,
+                landuse_layer=landuse_layer,
+                landuse_type=scheduler.results["landuse_type"],
+                fire_layer=fire_layer,
+                path=fds_path,
+                name=chid,
+                is_saved=manifest.is_current("terrain", terrain_fingerprint),
+                nfiles=obst_files,
+                m=scheduler.results["terrain_matrix"],
+                geometry=scheduler.results["terrain_geometry"],
             )
 
-        # Align utm_extent to the new interpolated dem
-        utm_extent = algos.get_pixel_aligned_extent(
-            context,
-            feedback,
-            raster_layer=utm_dem_layer,
-            extent=None,
-            extent_crs=None,
-            to_centers=False,
-            larger=0.0,
+        scheduler.add(
+            "terrain",
+            get_terrain,
+            deps=("landuse_type", "terrain_matrix", "terrain_geometry"),
         )
 
+        # Run the pipeline
+
+        scheduler.run()
+
         if feedback.isCanceled():
             return {}
 
-        # Prepare terrain, domain, and fds_case
-        if export_obst:
-            Terrain = OBSTTerrain
+        outputs.update(scheduler.results)
+        landuse_type = scheduler.results["landuse_type"]
+        wind = scheduler.results["wind"]
+        texture = scheduler.results["texture"]
+        terrain = scheduler.results["terrain"]
+
+        # Align utm_extent to the new interpolated dem, or as when sampled
+
+        if is_sampled:
+            utm_extent = QgsRectangle(*manifest.get_meta("matrix")["extent"])
         else:
-            Terrain = GEOMTerrain
-        terrain = Terrain(
-            feedback=feedback,
-            sampling_layer=sampling_layer,
-            utm_origin=utm_origin,
-            landuse_layer=landuse_layer,
-            landuse_type=landuse_type,
-            fire_layer=fire_layer,
-            path=fds_path,
-            name=chid,
-        )
+            utm_dem_layer = QgsRasterLayer(outputs["utm_dem_layer"]["OUTPUT"])
+            utm_extent = algos.get_pixel_aligned_extent(
+                context,
+                feedback,
+                raster_layer=utm_dem_layer,
+                extent=None,
+                extent_crs=None,
+                to_centers=False,
+                larger=0.0,
+            )
 
         if feedback.isCanceled():
             return {}
 
+        # Prepare domain, and fds_case
+
         domain = Domain(
             feedback=feedback,
             utm_crs=utm_crs,
@@ -666,8 +1679,40 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             max_z=terrain.max_z,
             cell_size=cell_size,
             nmesh=nmesh,
+            north_bearing=domain_bearing,
+            stretch=mesh_stretch,
+            terrain=terrain,
+            fine_extent=fine_extent,
+            fine_cell_size=fine_cell_size,
+        )
+
+        wind_field = WindField(
+            feedback=feedback,
+            project_path=project_path,
+            filepath=wind_field_filepath,
+            path=fds_path,
+            name=chid,
+            domain=domain,
+            utm_crs=utm_crs,
+            dem_filepath=not is_sampled and outputs["utm_dem_layer"]["OUTPUT"] or None,
+        )
+
+        if feedback.isCanceled():
+            return {}
+
+        # Place the devices over the terrain, shared by the sweep variants
+
+        devcs = Devcs(
+            feedback=feedback,
+            devc_layer=devc_layer,
+            utm_crs=utm_crs,
+            utm_origin=utm_origin,
+            terrain=terrain,
         )
 
+        if feedback.isCanceled():
+            return {}
+
         fds_case = FDSCase(
             feedback=feedback,
             path=fds_path,
@@ -680,11 +1725,137 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             terrain=terrain,
             texture=texture,
             wind=wind,
+            wind_field=wind_field,
+            devcs=devcs,
         )
         fds_case.save()
 
+        # Record the terrain matrix, terrain and texture files, for the next export
+
+        if not is_sampled:
+            terrain.save_matrix(os.path.join(fds_path, matrix_filename))
+            e = utm_extent
+            manifest.set(
+                "matrix",
+                matrix_fingerprint,
+                [matrix_filename],
+                extent=[e.xMinimum(), e.yMinimum(), e.xMaximum(), e.yMaximum()],
+            )
+        manifest.set("terrain", terrain_fingerprint, terrain.filenames)
+        if texture.is_saved:
+            manifest.set(
+                "texture",
+                tex_fingerprint,
+                texture.filenames,
+                filename=texture.filename,
+                filenames=texture.filenames,
+            )
+        else:  # eg. timed out, render it next time
+            manifest.remove("texture")
+        manifest.save()
+
+        # Sweep variants, sharing the terrain geometry, bingeom and texture
+
+        if not (sweep_wind_filepaths or sweep_fire_layers or sweep_level_set_modes):
+            return results
+
+        feedback.setProgressText("\nSweep variants...")
+
+        winds = [wind] + [
+            Wind(
+                feedback=feedback,
+                project_path=project_path,
+                filepath=f,
+                **wind_reduction,
+            )
+            for f in sweep_wind_filepaths
+        ]
+        level_set_modes = [fds_case.level_set_mode] + sweep_level_set_modes
+
+        # One zero-padded case index for the case and terrain names,
+        # a fire variant terrain is named after its first case
+        ncases_per_terrain = len(winds) * len(level_set_modes)
+        nterrains = 1 + (landuse_layer and len(sweep_fire_layers) or 0)
+        width = max(3, len(str(nterrains * ncases_per_terrain - 1)))
+
+        terrains = [terrain]  # base terrain first
+        terrain_entries = list()  # of the variants, (name, fingerprint)
+        for sweep_fire_layer in sweep_fire_layers:
+            if not landuse_layer:
+                feedback.reportError(
+                    f"No landuse layer provided, sweep fire layer <{sweep_fire_layer.name()}> skipped."
+                )
+                continue
+            sweep_utm_fire_layer, sweep_utm_b_fire_layer = algos.get_utm_fire_layers(
+                context,
+                feedback,
+                fire_layer=sweep_fire_layer,
+                destination_crs=utm_crs,
+                pixel_size=pixel_size,
+            )
+            algos.reload_fire_layer_bc(
+                context,
+                feedback,
+                sampling_layer=outputs["sampling_layer"]["OUTPUT"],
+                landuse_type=landuse_type,
+                utm_fire_layer=sweep_utm_fire_layer,
+                utm_b_fire_layer=sweep_utm_b_fire_layer,
+            )
+            name = f"{chid}_{len(terrains) * ncases_per_terrain:0{width}d}"
+            fingerprint = manifest.get_fingerprint(
+                terrain_fingerprint, get_signature(sweep_fire_layer)
+            )
+            terrains.append(
+                terrain.get_variant(
+                    fire_layer=sweep_fire_layer,
+                    name=name,
+                    is_saved=manifest.is_current(name, fingerprint),
+                )
+            )
+            terrain_entries.append((name, fingerprint))
+
+            if feedback.isCanceled():
+                return {}
+
+        variants = itertools.product(terrains, winds, level_set_modes)
+        next(variants)  # skip the base case, already saved
+        for i, (variant_terrain, variant_wind, level_set_mode) in enumerate(variants):
+            variant_case = FDSCase(
+                feedback=feedback,
+                path=fds_path,
+                name=f"{chid}_{i + 1:0{width}d}",
+                utm_crs=utm_crs,
+                wgs84_origin=wgs84_origin,
+                pixel_size=pixel_size,
+                dem_layer=dem_layer,
+                domain=domain,
+                terrain=variant_terrain,
+                texture=texture,
+                wind=variant_wind,
+                wind_field=wind_field,
+                devcs=devcs,
+                level_set_mode=level_set_mode,
+            )
+            variant_case.save()
+
+            if feedback.isCanceled():
+                return {}
+
+        # Record the variant terrain files, for the next export
+
+        for (name, fingerprint), variant_terrain in zip(terrain_entries, terrains[1:]):
+            manifest.set(name, fingerprint, variant_terrain.filenames)
+        manifest.save()
+
         return results
 
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        Post process algorithm, in the main thread.
+        """
+        self._entries.apply(QgsProject.instance())
+        return {}
+
     def name(self):
         """!
         Returns the algorithm name.
@@ -7,8 +7,47 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-from qgis.core import QgsProcessingProvider
-from .qgis2fds_algorithm import qgis2fdsAlgorithm
+from qgis.core import (
+    QgsProcessingProvider,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+)
+
+
+class qgis2fdsAlgorithmLoader(QgsProcessingAlgorithm):
+    """
+    Lightweight algorithm registered in the toolbox at QGIS startup.
+    The algorithm module is imported by createInstance, at first use,
+    as QGIS runs and shows copies created by it.
+    """
+
+    def initAlgorithm(self, config=None):
+        pass  # the parameters are defined by the created instance
+
+    def flags(self):
+        return (
+            super().flags() & ~QgsProcessingAlgorithm.FlagNoThreading
+        ) | QgsProcessingAlgorithm.FlagCanCancel
+
+    def name(self):
+        return "Export terrain"
+
+    def displayName(self):
+        return self.name()
+
+    def group(self):
+        return self.groupId()
+
+    def groupId(self):
+        return ""
+
+    def createInstance(self):
+        from .qgis2fds_algorithm import qgis2fdsAlgorithm
+
+        return qgis2fdsAlgorithm()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        raise QgsProcessingException("Run an instance created by createInstance")
 
 
 class qgis2fdsProvider(QgsProcessingProvider):
@@ -28,7 +67,7 @@ class qgis2fdsProvider(QgsProcessingProvider):
         """
         Loads all algorithms belonging to this provider.
         """
-        self.addAlgorithm(qgis2fdsAlgorithm())
+        self.addAlgorithm(qgis2fdsAlgorithmLoader())
 
     def id(self):
         """
@@ -7,9 +7,11 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
+from .devc import Devcs
 from .domain import Domain
 from .fds import FDSCase
 from .landuse import LanduseType
-from .terrain import GEOMTerrain, OBSTTerrain
-from .texture import Texture
+from .terrain import GEOMTerrain, OBSTTerrain, get_sampled_matrix
+from .texture import Texture, SavedTexture, HillshadeTexture
 from .wind import Wind
+from .windfield import WindField
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import time
+import numpy as np
+from qgis.core import QgsProcessingException, QgsFeatureRequest, NULL
+from ..algos.utils import transform_coords
+
+
+class Devcs:
+    """
+    FDS devices from a point layer, at a height above the terrain.
+    Layer attributes: quantity, and optional id and height (in meters, above ground).
+    """
+
+    default_height = 2.0  # m above ground
+
+    def __init__(self, feedback, devc_layer, utm_crs, utm_origin, terrain) -> None:
+        self.feedback = feedback
+        self.devc_layer = devc_layer
+        self._devcs = list()
+
+        # Check
+        if not devc_layer:
+            self.feedback.pushInfo(f"No DEVCs layer.")
+            return
+        self.feedback.pushInfo(f"Import DEVCs layer: <{devc_layer.name()}>")
+        t0 = time.time()
+
+        # Read the points and attributes
+        fields = devc_layer.fields()
+        quantity_idx = fields.lookupField("quantity")
+        if quantity_idx == -1:
+            raise QgsProcessingException(
+                f"DEVCs layer <{devc_layer.name()}> has no <quantity> attribute, cannot proceed."
+            )
+        id_idx = fields.lookupField("id")
+        height_idx = fields.lookupField("height")
+        nfeatures = devc_layer.featureCount()
+        xs, ys, hs = np.empty(nfeatures), np.empty(nfeatures), np.empty(nfeatures)
+        ids, quantities = list(), list()
+        no_geometry, no_quantity = list(), list()  # skipped ids
+        request = QgsFeatureRequest().setSubsetOfAttributes(
+            [i for i in (quantity_idx, id_idx, height_idx) if i != -1]
+        )
+        for i, f in enumerate(devc_layer.getFeatures(request)):
+            a = f.attributes()
+            devc_id = id_idx != -1 and a[id_idx] or f"Devc{i + 1:05d}"
+            q = a[quantity_idx]
+            if f.geometry().isEmpty():
+                no_geometry.append(devc_id)
+                continue
+            if q == NULL or not str(q).strip():
+                no_quantity.append(devc_id)
+                continue
+            j = len(ids)
+            p = f.geometry().vertexAt(0)  # QgsPoint
+            xs[j], ys[j] = p.x(), p.y()
+            h = a[height_idx] if height_idx != -1 else NULL
+            hs[j] = self.default_height if h == NULL else h
+            ids.append(devc_id)
+            quantities.append(str(q).strip())
+            if i % 1000 == 0 and self.feedback.isCanceled():
+                return
+        xs, ys, hs = xs[: len(ids)], ys[: len(ids)], hs[: len(ids)]
+        if no_geometry:
+            self.feedback.reportError(
+                f"{len(no_geometry)} DEVCs without geometry skipped, as <{no_geometry[0]}>."
+            )
+        if no_quantity:
+            self.feedback.reportError(
+                f"{len(no_quantity)} DEVCs without quantity skipped, as <{no_quantity[0]}>."
+            )
+
+        # Transform to utm and look up the terrain elevation, all at once
+        xs, ys = transform_coords(xs, ys, devc_layer.crs(), utm_crs)
+        xs, ys = xs - utm_origin.x(), ys - utm_origin.y()
+        zs, inside = terrain.get_z(xs, ys)
+        outside = np.flatnonzero(~inside)
+        if outside.size:
+            self.feedback.reportError(
+                f"{outside.size} DEVCs outside the terrain skipped, as <{ids[outside[0]]}>."
+            )
+
+        # Format
+        xyzs = np.column_stack((xs, ys, zs + hs))
+        self._devcs = [
+            f"&DEVC ID='{i}' XYZ={x:.2f},{y:.2f},{z:.2f} QUANTITY='{q}' /"
+            for i, (x, y, z), q, ok in zip(ids, xyzs.tolist(), quantities, inside)
+            if ok
+        ]
+        self.feedback.pushInfo(
+            f"{len(self._devcs)} DEVCs ready in {time.time() - t0:.2f} s"
+        )
+
+    def get_comment(self) -> str:
+        return f"FDS DEVCs layer: {self.devc_layer and self.devc_layer.name() or 'none'}"
+
+    def get_fds(self) -> str:
+        if not self._devcs:
+            return str()
+        res = "\n".join(self._devcs)
+        return f"""
+Devices ({len(self._devcs)} DEVCs)
+{res}"""
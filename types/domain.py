@@ -7,8 +7,9 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-from math import sqrt
+from math import sqrt, isnan
 from . import utils
+from ..core import mesh
 
 
 class Domain:
@@ -23,12 +24,18 @@ class Domain:
         max_z,
         cell_size,
         nmesh,
+        north_bearing=0.0,
+        stretch=1.0,
+        terrain=None,
+        fine_extent=None,
+        fine_cell_size=None,
     ) -> None:
         feedback.pushInfo("Init MESH...")
 
         self.feedback = feedback
         self.utm_extent = utm_extent
         self.utm_origin = utm_origin
+        self.north_bearing = north_bearing  # azimuth of the domain y axis
 
         # Calc domain XB, relative to origin,
         # and a little smaller than the terrain
@@ -66,32 +73,146 @@ class Domain:
         # Calc MESH MULT DX DY
         mult_dx, mult_dy = m_xb[1] - m_xb[0], m_xb[3] - m_xb[2]
 
+        # Keep the MESH geometry, eg. for per mesh data
+        self.nmesh_x, self.nmesh_y = nmesh_x, nmesh_y
+        self.m_xb, self.m_ijk = m_xb, m_ijk
+        self.mult_dx, self.mult_dy = mult_dx, mult_dy
+
+        # Calc the nested fine MESHes over the fine extent, up to 10 coarse cells
+        # over the local terrain max, aligned to the coarse cells
+        self._fine_meshes = list()
+        ratio = fine_cell_size and round(cell_size / fine_cell_size) or 1
+        if fine_extent and ratio < 2:
+            feedback.reportError(
+                "Fine cell size is not less than half the cell size, no fine meshes."
+            )
+        elif fine_extent:
+            ox, oy = utm_origin.x(), utm_origin.y()
+            fine_xb = (
+                fine_extent.xMinimum() - ox,
+                fine_extent.xMaximum() - ox,
+                fine_extent.yMinimum() - oy,
+                fine_extent.yMaximum() - oy,
+            )
+            zmax = terrain.get_z_range(fine_xb)[1] if terrain else max_z
+            if isnan(zmax):  # no terrain
+                zmax = max_z
+            self._fine_meshes = mesh.get_fine_meshes(
+                xb=fine_xb,
+                dom_xb=(
+                    m_xb[0],
+                    m_xb[0] + mult_dx * nmesh_x,
+                    m_xb[2],
+                    m_xb[2] + mult_dy * nmesh_y,
+                    m_xb[4],
+                    m_xb[5],
+                ),
+                dxyz=(
+                    mult_dx / m_ijk[0],
+                    mult_dy / m_ijk[1],
+                    (m_xb[5] - m_xb[4]) / m_ijk[2],
+                ),
+                ratio=ratio,
+                top=zmax + cell_size * 10,
+                ncell=m_ijk[0] * m_ijk[1] * m_ijk[2],
+            )
+
+        # Calc MESH vertical stretching, fine in the terrain band of each mesh
+        # and coarser below and above, sharing KBAR for the MULT
+        self._trnzs = [list() for _ in self.get_meshes()]
+        uniform_kbar = m_ijk[2]
+        if stretch > 1.0 and self._fine_meshes:
+            feedback.reportError(
+                "Vertical stretching is not applied with fine meshes, "
+                "aligned to the uniform coarse cells."
+            )
+        elif stretch > 1.0 and terrain:
+            z0, z1 = m_xb[4], m_xb[5]
+            bands = list()
+            for xb, _ in self.get_meshes():
+                zmin, zmax = terrain.get_z_range(xb)
+                if isnan(zmin):  # no terrain, keep it fine
+                    zmin, zmax = z0, z1
+                bands.append(
+                    (
+                        max(z0, zmin - cell_size),
+                        min(z1, zmax + cell_size * mesh.FINE_CELLS_AGL),
+                    )
+                )
+            kbar = mesh.get_stretched_kbar(z0, z1, cell_size, bands, ratio=stretch)
+            m_ijk = self.m_ijk = (m_ijk[0], m_ijk[1], kbar)
+            self._trnzs = [
+                mesh.get_trnz(z0, z1, kbar, band, dz=cell_size) for band in bands
+            ]
+
         # Calc MESH size and cell number
         mesh_sizes = [m_xb[1] - m_xb[0], m_xb[3] - m_xb[2], m_xb[5] - m_xb[4]]
         ncell = m_ijk[0] * m_ijk[1] * m_ijk[2]
 
+        # Prepare the vertical stretching string
+        stretch_str = "\n".join(
+            f"&TRNZ IDERIV=0 CC={cc:.2f} PC={pc:.2f} MESH_NUMBER={nm + 1:d} /"
+            for nm, nodes in enumerate(self._trnzs)
+            for cc, pc in nodes
+        )
+        if stretch_str:
+            uniform_ncell = m_ijk[0] * m_ijk[1] * uniform_kbar
+            saving = 1.0 - ncell / uniform_ncell
+            feedback.pushInfo(
+                f"Stretched MESH: {ncell:d} cells each, "
+                f"instead of {uniform_ncell:d} uniform ({saving * 100.0:.0f}% less)."
+            )
+            stretch_str = f"""
+Vertical stretching, fine in the terrain band of each mesh
+{m_ijk[2]:d} cells instead of {uniform_kbar:d} uniform along z ({saving * 100.0:.0f}% less)
+{stretch_str}"""
+
+        # Prepare the fine meshes string
+        fine_str = "\n".join(
+            f"&MESH ID='Fine{nm + 1:03d}' IJK={ijk[0]:d},{ijk[1]:d},{ijk[2]:d}\n"
+            f"      XB={xb[0]:.2f},{xb[1]:.2f},{xb[2]:.2f},{xb[3]:.2f},{xb[4]:.2f},{xb[5]:.2f} /"
+            for nm, (xb, ijk) in enumerate(self._fine_meshes)
+        )
+        if fine_str:
+            nfine = sum(ijk[0] * ijk[1] * ijk[2] for _, ijk in self._fine_meshes)
+            ncoarse = ncell * nmesh_x * nmesh_y
+            factor = ncoarse * ratio**3 / (ncoarse + nfine)
+            feedback.pushInfo(
+                f"Fine MESHes: {len(self._fine_meshes):d} with {nfine:d} cells, "
+                f"{factor:.1f} times less cells than refining the whole domain."
+            )
+            fine_str = f"""
+Fine meshes, {ratio:d} times finer, listed first to take precedence
+{len(self._fine_meshes):d} meshes and {nfine:d} cells, {factor:.1f} times less cells than refining the whole domain
+{fine_str}
+"""
+
         # Prepare comment string
-        utm_crs_desc = utm_crs.description()
+        utm_crs_desc = utm_crs.description() or utm_crs.toProj()
         utm_origin_desc = f"{utm_origin.x():.1f}E {utm_origin.y():.1f}N"
         e = utm_extent
         domain_extent_desc = f"{e.xMinimum():.1f}-{e.xMaximum():.1f}E {e.yMinimum():.1f}-{e.yMaximum():.1f}N"
+        crs_label = "Selected UTM CRS"
+        if north_bearing:  # the local oblique Mercator frame
+            crs_label = "Rotated domain CRS, oblique Mercator at the origin"
 
         self._comment = f"""
-Selected UTM CRS: {utm_crs_desc}
+{crs_label}: {utm_crs_desc}
 Domain origin: {utm_origin_desc}
   <{utils.get_lonlat_url(wgs84_origin)}>
 Domain extent: {domain_extent_desc}
+Domain bearing: {north_bearing:.1f}° from north
 """
 
         # Prepare fds string
-        self._fds = f"""
+        self._fds = f"""{fine_str}
 Domain and its boundary conditions
 {nmesh_x:d} · {nmesh_y:d} meshes of {mesh_sizes[0]:.1f}m · {mesh_sizes[1]:.1f}m · {mesh_sizes[2]:.1f}m size and {ncell:d} cells each
 &MULT ID='Meshes'
       DX={mult_dx:.2f} I_LOWER=0 I_UPPER={nmesh_x-1:d}
       DY={mult_dy:.2f} J_LOWER=0 J_UPPER={nmesh_y-1:d} /
 &MESH IJK={m_ijk[0]:d},{m_ijk[1]:d},{m_ijk[2]:d} MULT_ID='Meshes'
-      XB={m_xb[0]:.2f},{m_xb[1]:.2f},{m_xb[2]:.2f},{m_xb[3]:.2f},{m_xb[4]:.2f},{m_xb[5]:.2f} /
+      XB={m_xb[0]:.2f},{m_xb[1]:.2f},{m_xb[2]:.2f},{m_xb[3]:.2f},{m_xb[4]:.2f},{m_xb[5]:.2f} /{stretch_str}
 &VENT ID='Domain BC XMIN' DB='XMIN' SURF_ID='OPEN' /
 &VENT ID='Domain BC XMAX' DB='XMAX' SURF_ID='OPEN' /
 &VENT ID='Domain BC YMIN' DB='YMIN' SURF_ID='OPEN' /
@@ -103,6 +224,33 @@ Wind rose at domain origin
 &DEVC ID='Origin_VV' XYZ=0.,0.,{(m_xb[5]-.1):.2f} QUANTITY='V-VELOCITY' /
 &DEVC ID='Origin_WV' XYZ=0.,0.,{(m_xb[5]-.1):.2f} QUANTITY='W-VELOCITY' /"""
 
+    def get_meshes(self):
+        """!
+        Get the MESH geometry in the FDS order, the fine meshes first,
+        then the coarse meshes in the MULT order (i first).
+        @return list of (xb, ijk), xb relative to origin.
+        """
+        x0, x1, y0, y1, z0, z1 = self.m_xb
+        return self._fine_meshes + [
+            (
+                (
+                    x0 + i * self.mult_dx,
+                    x1 + i * self.mult_dx,
+                    y0 + j * self.mult_dy,
+                    y1 + j * self.mult_dy,
+                    z0,
+                    z1,
+                ),
+                self.m_ijk,
+            )
+            for j in range(self.nmesh_y)
+            for i in range(self.nmesh_x)
+        ]
+
+    def get_stretched_z(self, nm, zs):
+        """Get the physical z of the computational zs of mesh nm, stretched or not."""
+        return mesh.get_stretched_z(zs, self.m_xb[4], self.m_xb[5], self._trnzs[nm])
+
     def get_comment(self) -> str:
         return self._comment
 
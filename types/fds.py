@@ -27,6 +27,9 @@ class FDSCase:
         terrain,
         texture,
         wind,
+        wind_field=None,
+        devcs=None,
+        level_set_mode=1,
     ) -> None:
         self.feedback = feedback
         self.name = name  # chid
@@ -38,6 +41,9 @@ class FDSCase:
         self.terrain = terrain
         self.texture = texture
         self.wind = wind
+        self.wind_field = wind_field
+        self.devcs = devcs
+        self.level_set_mode = level_set_mode
 
         self.filename = f"{name}.fds"
         self.filepath = os.path.join(path, self.filename)
@@ -69,8 +75,9 @@ DEM layer: {self.dem_layer.name()}
 Landuse layer: {landuse_layer_desc}
 Landuse type file: {landuse_type_filepath}
 Fire layer: {fire_layer_desc}
-FDS DEVCs layer: FIXME
+{self.devcs and self.devcs.get_comment() or 'FDS DEVCs layer: none'}
 Wind file: {wind_filepath}
+{self.wind_field and self.wind_field.get_comment() or 'Wind field file: none'}
 
 &HEAD CHID='{self.name}' TITLE='Description of {self.name}' /
 
@@ -82,9 +89,9 @@ MISC LEVEL_SET_MODE parameter
 
 &MISC ORIGIN_LAT={self.wgs84_origin.y():.7f}
       ORIGIN_LON={self.wgs84_origin.x():.7f}
-      NORTH_BEARING=0.
+      NORTH_BEARING={self.domain.north_bearing:.2f}
       {self.texture.get_fds()}
-      LEVEL_SET_MODE=1 
+      LEVEL_SET_MODE={self.level_set_mode:d}
       THICKEN_OBSTRUCTIONS=T /
 
 &TIME T_END=0. /
@@ -101,6 +108,8 @@ Output quantities
 &SLCF PBX={0.:.2f} QUANTITY='TEMPERATURE' VECTOR=T /
 &SLCF PBY={0.:.2f} QUANTITY='TEMPERATURE' VECTOR=T /
 {self.wind.get_fds()}
+{self.wind_field and self.wind_field.get_fds() or ''}
+{self.devcs and self.devcs.get_fds() or ''}
 {self.terrain.get_fds()}
 
 &TAIL /
@@ -7,10 +7,89 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-import os
+import os, copy, time
 import numpy as np
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
 from qgis.core import QgsProcessingException
 from . import utils
+from ..core import terrain
+from ..core.terrainindex import TerrainIndex
+from ..core.scheduler import get_process_pool
+
+# The layer is a flat list of quad faces center points (x, y, z, landuse)
+# ordered by column, that core.terrain turns into the terrain matrix.
+
+
+def get_sampled_matrix(feedback, sampling_layer, utm_origin, landuse_layer, fire_layer):
+    """!
+    Get the terrain matrix from the sampling layer.
+    @return the terrain matrix, None if canceled.
+    """
+    feedback.pushInfo("Init the matrix of sampling points...")
+    feedback.setProgress(0)
+
+    # Init
+    nfeatures = sampling_layer.featureCount()
+    partial_progress = nfeatures // 100 or 1
+    points = np.empty((nfeatures, 4))  # allocate the np array
+    ox, oy = utm_origin.x(), utm_origin.y()  # get origin
+
+    # Fill the array with point coordinates, points are listed by column
+    for i, f in enumerate(sampling_layer.getFeatures()):
+        g = f.geometry().get()  # QgsPoint
+        points[i] = (
+            g.x() - ox,  # x, relative to origin
+            g.y() - oy,  # y, relative to origin
+            g.z(),  # z absolute
+            0,  # for landuse
+        )
+        if i % partial_progress == 0:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(int(i / nfeatures * 100))
+
+    # Fill the array with the landuse and the fire layer bcs
+    points[:, 3] = get_sampled_landuses(
+        feedback, sampling_layer, landuse_layer, fire_layer
+    )
+
+    try:
+        return terrain.get_matrix(points)
+    except ValueError as err:
+        raise QgsProcessingException(f"[QGIS bug] {err}")
+
+
+def get_sampled_landuses(feedback, sampling_layer, landuse_layer, fire_layer):
+    """Get the landuses of the sampling layer points, fire layer bcs included."""
+    nfeatures = sampling_layer.featureCount()
+    partial_progress = nfeatures // 100 or 1
+    landuses = np.zeros(nfeatures)
+
+    # Fill the array with the landuse
+    if landuse_layer:
+        landuse_idx = sampling_layer.fields().indexOf("landuse1")
+        for i, f in enumerate(sampling_layer.getFeatures()):
+            a = f.attributes()
+            landuses[i] = a[landuse_idx] or 0
+            if i % partial_progress == 0:
+                if feedback.isCanceled():
+                    return landuses
+                feedback.setProgress(int(i / nfeatures * 100))
+
+    # Fill the array with the fire layer bcs
+    if fire_layer:
+        bc_idx = sampling_layer.fields().indexOf("bc")
+        for i, f in enumerate(sampling_layer.getFeatures()):
+            a = f.attributes()
+            if a[bc_idx]:
+                landuses[i] = a[bc_idx]
+            if i % partial_progress == 0:
+                if feedback.isCanceled():
+                    return landuses
+                feedback.setProgress(int(i / nfeatures * 100))
+
+    return landuses
 
 
 class GEOMTerrain:
@@ -24,6 +103,10 @@ class GEOMTerrain:
         fire_layer,
         path,
         name,
+        is_saved=False,
+        nfiles=0,  # unused
+        m=None,
+        geometry=None,
     ) -> None:
         self.feedback = feedback
         self.sampling_layer = sampling_layer
@@ -34,241 +117,118 @@ class GEOMTerrain:
 
         self._filename = f"{name}_terrain.bingeom"
         self._filepath = os.path.join(path, self._filename)
+        self._is_saved = is_saved  # eg. unchanged from a previous export
 
-        self._m = None
+        self._m = m  # eg. saved by a previous export, instead of the sampling layer
+        self._index = None
         self.min_z = 0.0
         self.max_z = 0.0
         self._init_matrix()
 
         if self.feedback.isCanceled():
-            return {}
+            return
 
-        self._faces = list()
-        self._landuses = list()
-        self._init_faces_and_landuses()
+        self._init_geometry(geometry)
 
-        if self.feedback.isCanceled():
-            return {}
-
-        self._verts = list()
-        self._init_verts()
-
-    # The layer is a flat list of quad faces center points (z, x, y, landuse)
-    # ordered by column. The original flat list is cut in columns, when three consecutive points
-    # form an angle < 180°.
-    # The returned matrix is a topological 2D representation of them by row (when transposed).
-
-    # Same column:  following column:
-    #      first ·            first · · current
-    #            |                  | ^
-    #            |                  | |
-    #       prev ·                  | |
-    #            |                  |/
-    #    current ·             prev ·
-
-    # matrix:    j
-    #      o   o   o   o   o
-    #        ·   ·   ·   ·
-    #      o   *---*   o   o
-    # row    · | · | ·   ·   i
-    #      o   *---*   o   o
-    #        ·   ·   ·   ·
-    #      o   o   o   o   o
-    #
-    # · center points of quad faces
-    # o verts
+    # self._m is the terrain matrix, self._gm the one with ghost centers.
 
     def _init_matrix(self) -> None:
-        """Init the matrix from the sampling layer."""
-        self.feedback.pushInfo("Init the matrix of sampling points...")
-        self.feedback.setProgress(0)
-
-        # Init
-        sampling_layer = self.sampling_layer
-        nfeatures = sampling_layer.featureCount()
-        partial_progress = nfeatures // 100 or 1
-        m = np.empty((nfeatures, 4))  # allocate the np array
-        ox, oy = self.utm_origin.x(), self.utm_origin.y()  # get origin
-
-        # Fill the array with point coordinates, points are listed by column
-        # calc min and max z
-        min_z, max_z = 1e6, -1e6
-        for i, f in enumerate(self.sampling_layer.getFeatures()):
-            g = f.geometry().get()  # QgsPoint
-            z = g.z()
-            if z > max_z:
-                max_z = z
-            if z < min_z:
-                min_z = z
-            m[i] = (
-                g.x() - ox,  # x, relative to origin
-                g.y() - oy,  # y, relative to origin
-                g.z(),  # z absolute
-                0,  # for landuse
-            )
-            if i % partial_progress == 0:
-                self.feedback.setProgress(int(i / nfeatures * 100))
-        self.max_z, self.min_z = max_z, min_z
-
-        # Fill the array with the landuse
-        if self.landuse_layer:
-            landuse_idx = self.sampling_layer.fields().indexOf("landuse1")
-            for i, f in enumerate(self.sampling_layer.getFeatures()):
-                a = f.attributes()
-                m[i][3] = a[landuse_idx] or 0
-                if i % partial_progress == 0:
-                    self.feedback.setProgress(int(i / nfeatures * 100))
-
-        # Fill the array with the fire layer bcs
-        if self.fire_layer:
-            bc_idx = self.sampling_layer.fields().indexOf("bc")
-            for i, f in enumerate(self.sampling_layer.getFeatures()):
-                a = f.attributes()
-                if a[bc_idx]:
-                    m[i][3] = a[bc_idx]
-                if i % partial_progress == 0:
-                    self.feedback.setProgress(int(i / nfeatures * 100))
-
-        # Get point column length
-        column_len = 2
-        p0, p1 = m[0, :2], m[1, :2]
-        v0 = p1 - p0
-        for p2 in m[2:, :2]:
-            v1 = p2 - p1
-            if abs(np.dot(v0, v1) / np.linalg.norm(v0) / np.linalg.norm(v1)) < 0.9:
-                break  # end of point column
-            column_len += 1
-
-        # Split matrix into columns list, get np array, and transpose
-        # Now points are by row
-        m = np.array(np.split(m, nfeatures // column_len)).transpose(1, 0, 2)
-        # Check
-        if m.shape[0] < 3 or m.shape[1] < 3:
-            raise QgsProcessingException(
-                f"[QGIS bug] Sampling matrix is too small: {m.shape[0]}x{m.shape[1]}"
+        """Init the matrix from the sampling layer, if not given."""
+        if self._m is None:
+            self._m = get_sampled_matrix(
+                feedback=self.feedback,
+                sampling_layer=self.sampling_layer,
+                utm_origin=self.utm_origin,
+                landuse_layer=self.landuse_layer,
+                fire_layer=self.fire_layer,
             )
-        self._m = m
-
-    def _inject_ghost_centers(self):
-        """Inject ghost centers into the matrix."""
-        feedback = self.feedback
-        feedback.pushInfo("Inject ghost centers in matrix...")
-        feedback.setProgress(0)
-
-        # Init displacements
-        dx, dy = self._m[0, 1] - self._m[0, 0], self._m[1, 0] - self._m[0, 0]
-        dx[2], dy[2] = 0.0, 0.0  # no z displacement
-        dx[3], dy[3] = 0.0, 0.0  # no landuse change
-
-        # Inject first row
-        row = tuple(c - dy for c in self._m[0, :])
-        self._m = np.insert(self._m, 0, row, axis=0)
-
-        # Append last row
-        row = tuple((tuple(c + dy for c in self._m[-1, :]),))
-        self._m = np.append(self._m, row, axis=0)
-
-        # Inject first col
-        col = tuple(c - dx for c in self._m[:, 0])
-        self._m = np.insert(self._m, 0, col, axis=1)
-
-        # Append last col
-        col = tuple(
-            tuple((c + dx,) for c in self._m[:, -1]),
+        if self._m is not None:  # not canceled
+            self.min_z, self.max_z = self._m[:, :, 2].min(), self._m[:, :, 2].max()
+
+    def _get_landuses(self):
+        """Get the landuses of the sampling layer points, fire layer bcs included."""
+        return get_sampled_landuses(
+            feedback=self.feedback,
+            sampling_layer=self.sampling_layer,
+            landuse_layer=self.landuse_layer,
+            fire_layer=self.fire_layer,
         )
-        self._m = np.append(self._m, col, axis=1)
-
-    def _init_faces_and_landuses(self):
-        """Init GEOM faces and landuses."""
-        self.feedback.pushInfo("Init GEOM faces and their landuses...")
-        self.feedback.setProgress(0)
-        m = self._m
-        len_vrow = m.shape[0]
-        len_vcol = m.shape[1] + 1  # vert matrix is larger
-        for i, row in enumerate(m):
-            for j, p in enumerate(row):
-                self._faces.extend(
-                    (
-                        (
-                            self._get_vert_index(i, j, len_vcol),  # 1st face
-                            self._get_vert_index(i + 1, j, len_vcol),
-                            self._get_vert_index(i, j + 1, len_vcol),
-                        ),
-                        (
-                            self._get_vert_index(i + 1, j + 1, len_vcol),  # 2nd face
-                            self._get_vert_index(i, j + 1, len_vcol),
-                            self._get_vert_index(i + 1, j, len_vcol),
-                        ),
-                    )
-                )
-                lu = int(p[3])
-                self._landuses.extend((lu, lu))
-            self.feedback.setProgress(int(i / len_vrow * 100))
-
-    # First inject ghost centers all around the vertices
-    # then extract the vertices by averaging the neighbour centers coordinates
-
-    # · centers of quad faces  + ghost centers
-    # o verts  * cs  x vert
-    #
-    #           dx       j
-    #          + > +   +   +   +   +  first ghost row
-    #       dy v o---o---o---o---o
-    #          + | · | · | · | · | +  i center
-    #            o---o---x---o---o    i vert
-    #          + | · | · | · | · | +  i+1 center
-    #            o---o---o---o---o
-    #          +   +   +   +   +   +  last ghost row (skipped)
-
-    def _init_verts(self):
-        """Init verts as average of surrounding centers."""
-        self.feedback.pushInfo("Init GEOM verts...")
-        self.feedback.setProgress(0)
-
-        self._inject_ghost_centers()
-        m = self._m
-        ncenters = m.shape[0] * m.shape[1]
-        partial_progress = ncenters // 100 or 1
-        # Skip last row and last col
-        for ip, idxs in enumerate(np.ndindex(m.shape[0] - 1, m.shape[1] - 1)):
-            i, j = idxs
-            self._verts.append(
-                (m[i, j, :3] + m[i + 1, j, :3] + m[i, j + 1, :3] + m[i + 1, j + 1, :3])
-                / 4.0
-            )
-            if ip % partial_progress == 0:
-                self.feedback.setProgress(int(ip / ncenters * 100))
 
-    #        j   j  j+1
-    #        *<------* i
-    #        | f1 // |
-    # faces  |  /·/  | i
-    #        | // f2 |
-    #        *------>* i+1
+    def _get_landuse_matrix(self):
+        """Get the landuses of the sampling layer points by row."""
+        landuses = self._get_landuses()
+        return terrain.get_landuse_matrix(landuses, nrows=self._m.shape[0])
+
+    def get_z(self, xs, ys):
+        """Get the terrain elevation at points relative to the origin, and if inside."""
+        return terrain.get_terrain_z(self._m, xs, ys)
+
+    @property
+    def index(self):
+        """The range query index of the terrain elevation, built on first use."""
+        if self._index is None:
+            self._index = TerrainIndex(self._m)
+        return self._index
+
+    def get_z_range(self, xb):
+        """Get the terrain elevation range inside the xb rectangle, relative to the origin."""
+        return self.index.get_z_range(xb)
+
+    def get_stats(self, xb, z0=None):
+        """Get the terrain count, min, max, mean z and solid volume inside the xb rectangle."""
+        return self.index.get_stats(xb, z0=z0)
+
+    def save_matrix(self, filepath):
+        """Save the terrain matrix, to skip the sampling on the next export."""
+        try:
+            terrain.save_matrix(filepath, self._m)
+        except Exception as err:
+            raise QgsProcessingException(
+                f"Terrain matrix not writable to <{filepath}>, cannot proceed.\n{err}"
+            )
 
-    def _get_vert_index(self, i, j, len_vcol):
-        """Get vert index in FDS notation."""
-        return i * len_vcol + j + 1  # F90 indexes start from 1
+    def get_variant(self, fire_layer, name, is_saved=False):
+        """Get a terrain variant with the current sampling layer bcs, sharing the geometry."""
+        self.feedback.pushInfo(f"Init terrain variant <{name}>...")
+        variant = copy.copy(self)
+        variant.fire_layer = fire_layer
+        variant._filename = f"{name}_terrain.bingeom"
+        variant._filepath = os.path.join(
+            os.path.dirname(self._filepath), variant._filename
+        )
+        variant._is_saved = is_saved
+        variant._landuses = terrain.get_face_landuses(variant._get_landuse_matrix())
+        return variant
+
+    @property
+    def filenames(self):
+        """The written files."""
+        return [self._filename]
+
+    def _init_geometry(self, geometry=None):
+        """Init GEOM verts, faces and landuses, if not given, eg. from a worker process."""
+        geometry = geometry or terrain.get_geometry(self.feedback, self._m)
+        self._gm, self._verts = geometry["gm"], geometry["verts"]
+        self._faces, self._landuses = geometry["faces"], geometry["landuses"]
+
+    def _get_surf_indexes(self, landuses):
+        """Translate landuses into indexes of the landuse type SURF list."""
+        surf_idxs, unknowns = terrain.get_surf_indexes(
+            landuses, list(self.landuse_type.surf_id_dict)
+        )
+        for lu in unknowns:
+            self.feedback.reportError(f"Unknown landuse index <{lu}>, setting <0>.")
+        return surf_idxs
 
     def _save_bingeom(self) -> None:
-        """Save the bingeom file."""
-
-        # Format in fds notation
-        fds_verts = tuple(v for vs in self._verts for v in vs)
-        fds_faces = tuple(f for fs in self._faces for f in fs)
-        fds_surfs = list()
+        """Save the bingeom file, once."""
+        if self._is_saved:
+            self.feedback.pushInfo(f"Bingeom file already saved: <{self._filepath}>")
+            return
 
         # Translate landuse_layer landuses into FDS SURF index
-        surf_id_list = list(self.landuse_type.surf_id_dict)
-        n_surf_id = len(surf_id_list)
-        for i, _ in enumerate(self._faces):
-            lu = self._landuses[i]
-            try:
-                fds_surfs.append(surf_id_list.index(lu) + 1)  # +1 for F90
-            except ValueError:
-                self.feedback.reportError(f"Unknown landuse index <{lu}>, setting <0>.")
-                fds_surfs.append(1)  # 0 + 1 for F90
-        fds_surfs = tuple(fds_surfs)
+        n_surf_id = len(self.landuse_type.surf_id_dict)
+        fds_surfs = self._get_surf_indexes(self._landuses) + 1  # +1 for F90
 
         # Write bingeom
         utils.write_bingeom(
@@ -276,13 +236,12 @@ class GEOMTerrain:
             filepath=self._filepath,
             geom_type=2,
             n_surf_id=n_surf_id,
-            fds_verts=fds_verts,
-            fds_faces=fds_faces,
+            fds_verts=self._verts,
+            fds_faces=self._faces,
             fds_surfs=fds_surfs,
             fds_volus=list(),
         )
-
-
+        self._is_saved = True
 
     def get_fds(self) -> str:
         """Get the FDS text and save."""
@@ -308,8 +267,12 @@ class OBSTTerrain(GEOMTerrain):
         landuse_layer,
         landuse_type,
         fire_layer,
-        path=None,  # unused
-        name=None,  # unused
+        path=None,
+        name=None,
+        is_saved=False,
+        nfiles=0,
+        m=None,
+        geometry=None,
     ) -> None:
         self.feedback = feedback
         self.sampling_layer = sampling_layer
@@ -317,57 +280,135 @@ class OBSTTerrain(GEOMTerrain):
         self.landuse_layer = landuse_layer
         self.landuse_type = landuse_type
         self.fire_layer = fire_layer
+        self.path = path
+        self.name = name
+        self.nfiles = nfiles  # OBST include files, 0 to write OBSTs in the case
+        self._is_saved = is_saved  # eg. unchanged from a previous export
 
         # Init
+        self._m = m  # eg. saved by a previous export, instead of the sampling layer
+        self._index = None
         self.min_z = 0.0
         self.max_z = 0.0
+        self._filenames = list()
 
         # Calc
         self._init_matrix()
 
         if self.feedback.isCanceled():
-            return {}
-
-        self._inject_ghost_centers()
-        self._init_obsts()
-
-    def _init_obsts(self):
-        """Get the formatted OBSTs from sampling layer."""
-        feedback = self.feedback
-        feedback.pushInfo("Prepare OBSTs...")
-        feedback.setProgress(0)
-        m = self._m
-        _obsts = list()
-
-        # Init
-        ncenters = m.shape[0] * m.shape[1]
-        partial_progress = ncenters // 100 or 1
-        surf_id_dict = self.landuse_type.surf_id_dict
-
-        # Skip last two rows and last two cols
-        min_z = self.min_z
-        for ip, idxs in enumerate(np.ndindex(m.shape[0] - 2, m.shape[1] - 2)):
-            i, j = idxs
-            p0 = (m[i + 2, j, :2] + m[i + 1, j + 1, :2]) / 2.0
-            p1 = (m[i + 1, j + 1, :2] + m[i, j + 2, :2]) / 2.0
-            z = m[i + 1, j + 1, 2]
-            lu = m[i + 1, j + 1, 3]
-            xb = tuple((p0[0], p1[0], p0[1], p1[1], min_z, z))
-            try:
-                surf_id = surf_id_dict[lu]
-            except ValueError:
-                self.feedback.reportError(f"Unknown landuse index <{lu}>, setting <0>.")
-                surf_id = surf_id_dict[0]
-            _obsts.append(
-                f"&OBST XB={xb[0]:.2f},{xb[1]:.2f},{xb[2]:.2f},{xb[3]:.2f},{xb[4]:.2f},{xb[5]:.2f} SURF_ID='{surf_id}' /"
+            return
+
+        geometry = geometry or terrain.get_geometry(self.feedback, self._m, True)
+        self._gm = geometry["gm"]
+        self._init_obsts(geometry["xbs"], geometry["landuses"])
+
+    def _init_obsts(self, xbs, landuses):
+        """Init the OBSTs, formatted if in the case."""
+        surf_id_list = list(self.landuse_type.surf_id_dict.values())
+        surf_ids = [surf_id_list[i] for i in self._get_surf_indexes(landuses)]
+        self._nobsts = len(surf_ids)
+        if self.nfiles:
+            self._xbs, self._surf_ids = xbs, surf_ids
+            self._filenames = self._is_saved and self._get_filenames() or list()
+        else:
+            self._obsts = terrain.format_obsts(xbs, surf_ids)
+
+    def _get_filenames(self):
+        """Get the OBST include filenames."""
+        nfiles = min(self.nfiles, self._nobsts)
+        return [f"{self.name}_obst_{i + 1:03d}.fds" for i in range(nfiles)]
+
+    def _save_obsts(self):
+        """Format and write the OBST include files in parallel, once."""
+        if self._filenames:
+            self.feedback.pushInfo(f"OBST files already saved to <{self.path}>")
+            return
+        filenames = self._get_filenames()
+        nfiles = len(filenames)
+        self.feedback.pushInfo(f"Save OBSTs to {nfiles} include files...")
+        t0 = time.time()
+
+        # OBSTs are listed by row, so each file is a band of rows
+        bounds = np.linspace(0, self._nobsts, nfiles + 1).astype(int)
+        jobs = [
+            dict(
+                filepath=os.path.join(self.path, filename),
+                xbs=self._xbs[i0:i1],
+                surf_ids=self._surf_ids[i0:i1],
+                comment=f"! OBST terrain of <{self.name}>, part {i + 1}/{nfiles}",
             )
-            if ip % partial_progress == 0:
-                self.feedback.setProgress(int(ip / ncenters * 100))
-
-        self._obsts = _obsts
+            for i, (filename, i0, i1) in enumerate(
+                zip(filenames, bounds[:-1], bounds[1:])
+            )
+        ]
+        try:
+            pool = get_process_pool()
+            if pool:
+                try:
+                    is_written = self._write_obsts(pool, jobs)
+                except (BrokenProcessPool, OSError) as err:
+                    # eg. the worker processes cannot start or import the plugin
+                    self.feedback.pushInfo(
+                        f"Worker processes unavailable, write OBST files in threads.\n{err}"
+                    )
+                    is_written = self._write_obsts(futures.ThreadPoolExecutor(), jobs)
+            else:
+                is_written = self._write_obsts(futures.ThreadPoolExecutor(), jobs)
+        except Exception as err:
+            raise QgsProcessingException(
+                f"OBST files not writable to <{self.path}>, cannot proceed.\n{err}"
+            )
+        if not is_written:  # never leave a case without its terrain
+            raise QgsProcessingException("OBST files not saved, canceled.")
+        self._filenames = filenames
+        self.feedback.pushInfo(f"OBST files saved in {time.time() - t0:.2f} s")
+
+    def _write_obsts(self, pool, jobs):
+        """Write the OBST include files with the pool, and shut it down. Return False if canceled."""
+        try:
+            fs = [pool.submit(terrain.write_obsts, **job) for job in jobs]
+            for f in futures.as_completed(fs):
+                f.result()
+                if self.feedback.isCanceled():
+                    for pending in fs:
+                        pending.cancel()
+                    return False
+        finally:
+            pool.shutdown(wait=True)
+        return True
+
+    @property
+    def filenames(self):
+        """The written files."""
+        return self._filenames
+
+    def get_z(self, xs, ys):
+        """Get the top of the OBST containing the points relative to the origin, and if inside."""
+        return terrain.get_terrain_z(self._m, xs, ys, nearest=True)
+
+    def get_variant(self, fire_layer, name=None, is_saved=False):
+        """Get a terrain variant with the current sampling layer bcs, sharing the geometry."""
+        self.feedback.pushInfo(f"Init terrain variant <{name}>...")
+        variant = copy.copy(self)
+        variant.fire_layer = fire_layer
+        variant.name = name
+        variant._is_saved = is_saved
+        variant._m = self._m.copy()
+        variant._m[:, :, 3] = self._get_landuse_matrix()
+        variant._gm = terrain.inject_ghost_centers(variant._m)
+        variant._init_obsts(*terrain.get_obsts(variant._gm, min_z=self.min_z))
+        return variant
 
     def get_fds(self) -> str:
         """Get the FDS text."""
+        if self.nfiles:
+            self._save_obsts()
+            self.feedback.pushInfo(f"OBST terrain ready.")
+            catfs_str = "\n".join(f"&CATF OTHER_FILES='{f}' /" for f in self._filenames)
+            return f"""
+Terrain ({self._nobsts} OBSTs in {len(self._filenames)} files)
+{catfs_str}
+"""
         self.feedback.pushInfo(f"OBST terrain ready.")
         obsts_str = "\n".join(self._obsts)
         return f"""
@@ -7,15 +7,38 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-import os, time
-from qgis.core import QgsProcessingException, QgsMapSettings, QgsMapRendererParallelJob
+import os, time, tempfile, threading
+import numpy as np
+from osgeo import gdal
+from qgis.core import (
+    QgsApplication,
+    QgsProcessingException,
+    QgsMapSettings,
+    QgsMapRendererCustomPainterJob,
+    QgsRectangle,
+)
 from qgis.utils import iface
-from qgis.PyQt.QtCore import QSize, QCoreApplication
+from qgis.PyQt.QtCore import QSize
+from qgis.PyQt.QtGui import QImage, QPainter
+from qgis.PyQt.QtXml import QDomDocument
+from ..core.tilecache import TileCache
+from ..core.manifest import write_atomic
+from ..core import texture
 
 
 class Texture:
 
-    timeout = 30.0
+    tile_size = 2048  # px, max tile side
+    timeout = 30.0  # s, min timeout per tile
+    timeout_per_mpix = 10.0  # s, timeout per tile megapixel
+    poll_interval = 100  # ms, cancellation check interval
+    cache_size = 1024 * 2**20  # bytes, tile cache size limit, 0 disables it
+    zlevel = 6  # PNG compression level, 1 to 9
+    quality = 75  # JPEG and WebP quality, 1 to 100
+    max_filesize = 0  # bytes, texture file size budget, 0 is unlimited
+    min_pixels = 256  # px, min side of the downscaled variants
+
+    _drivers = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
 
     def __init__(
         self,
@@ -24,23 +47,155 @@ class Texture:
         name,
         image_type,
         pixel_size,
-        tex_layer,
+        layers,
         utm_extent,
         utm_crs,
+        tile_size=None,
+        timeout_per_mpix=None,
+        cache_size=None,
+        zlevel=None,
+        quality=None,
+        max_filesize=None,
     ) -> None:
         self.feedback = feedback
-        self.image_type = image_type
         self.pixel_size = pixel_size
-        self.tex_layer = tex_layer
+        self.layers = layers
         self.utm_crs = utm_crs  # destination_crs
+        self.tile_size = tile_size or self.tile_size
+        self.timeout_per_mpix = timeout_per_mpix or self.timeout_per_mpix
+        if cache_size is not None:
+            self.cache_size = cache_size
+        self._init_encoding(path, name, image_type, zlevel, quality, max_filesize)
+        self.tex_extent = utm_extent
+
+        self.is_saved = self._save()
 
+    def _init_encoding(self, path, name, image_type, zlevel, quality, max_filesize):
+        self.path = path
+        self.name = name
+        self.image_type = image_type.lower()
+        if self.image_type not in self._drivers:
+            raise QgsProcessingException(
+                f"Texture image type <{image_type}> not supported, cannot proceed."
+            )
+        self.zlevel = zlevel or self.zlevel
+        self.quality = quality or self.quality
+        self.max_filesize = max_filesize or self.max_filesize
         self.filename = f"{name}_tex.{self.image_type}"
         self.filepath = os.path.join(path, self.filename)
-        self.tex_extent = utm_extent
+        self.filenames = [self.filename]
+
+    @staticmethod
+    def get_layers(tex_layer):
+        """Get the exporting layers, from the main thread."""
+        if tex_layer:  # use user tex layer
+            return [tex_layer]
+        elif iface:  # no user tex layer, use map canvas
+            return iface.mapCanvas().layers()
+        return list()
+
+    def _get_tile_timeout(self, xpix, ypix):
+        """Get the render timeout of a tile, scaled with its size."""
+        return max(self.timeout, self.timeout_per_mpix * xpix * ypix / 1e6)
+
+    def _get_cache(self):
+        """Get the persistent tile cache."""
+        return TileCache(
+            path=os.path.join(
+                QgsApplication.qgisSettingsDirPath(), "cache", "qgis2fds", "texture"
+            ),
+            max_size=self.cache_size,
+        )
 
-        self._save()
+    def _get_layers_key(self):
+        """Get the part of the tile cache key depending on layers and crs."""
+        items = [self.utm_crs.toWkt()]
+        for layer in self.layers:
+            source = layer.source()
+            filepath = source.split("|")[0]
+            mtime = os.path.isfile(filepath) and os.path.getmtime(filepath) or None
+            doc = QDomDocument()
+            layer.exportNamedStyle(doc)
+            items.extend((source, mtime, doc.toString()))
+        return items
+
+    def _render_tile(self, extent, xpix, ypix):
+        """
+        Render a tile and return its QImage, or None.
+        The tile is rendered synchronously in the calling thread,
+        with no event loop, as QgsMapRendererTask does.
+        The layers are the clones owned by this run, used by this thread only.
+        """
+        settings = QgsMapSettings()  # build settings
+        settings.setDestinationCrs(self.utm_crs)  # set output crs
+        settings.setExtent(extent)  # in utm_crs
+        settings.setOutputSize(QSize(xpix, ypix))
+        settings.setLayers(self.layers)
+
+        image = QImage(xpix, ypix, QImage.Format_ARGB32_Premultiplied)
+        image.fill(0)  # transparent
+        painter = QPainter(image)
+        render = QgsMapRendererCustomPainterJob(settings, painter)
+
+        # Cancel the render job at the timeout or at the user cancellation,
+        # from a watchdog thread, as QgsMapRendererTask.cancel does
+        is_done, is_timed_out = threading.Event(), threading.Event()
+        timeout = self._get_tile_timeout(xpix, ypix)
+
+        def watch():
+            t_end = time.time() + timeout
+            while not is_done.wait(self.poll_interval / 1000):
+                if self.feedback.isCanceled() or time.time() > t_end:
+                    is_timed_out.set()
+                    render.cancelWithoutBlocking()
+                    return
+
+        watchdog = threading.Thread(target=watch, daemon=True)
+        watchdog.start()
+        try:
+            render.renderSynchronously()
+        finally:
+            is_done.set()
+            watchdog.join()
+            painter.end()
+        if is_timed_out.is_set():
+            if not self.feedback.isCanceled():
+                self.feedback.reportError("Texture render timed out, no texture saved.")
+            return None
+        return image
+
+    def _get_tile(self, cache, layers_key, extent, xpix, ypix):
+        """Get a tile from the cache, or render it, as np.array((ypix, xpix, 4)) RGBA."""
+        key = cache.get_key(
+            layers_key,
+            round(extent.xMinimum(), 6),
+            round(extent.yMaximum(), 6),
+            self.pixel_size,
+            xpix,
+            ypix,
+        )
+        filepath = cache.get(key)
+        image = filepath and QImage(filepath)
+        if image and not image.isNull():
+            self._cache_hits += 1
+        else:
+            image = self._render_tile(extent=extent, xpix=xpix, ypix=ypix)
+            if image is None:
+                return None
+            cache.put(key, write=lambda f: image.save(f, "PNG") or None)
+        # Get RGBA pixels
+        image = image.convertToFormat(QImage.Format_RGBA8888)
+        ptr = image.constBits()
+        ptr.setsize(image.bytesPerLine() * image.height())
+        return (
+            np.frombuffer(ptr, dtype=np.uint8)
+            .reshape(image.height(), image.bytesPerLine())[:, : xpix * 4]
+            .reshape(ypix, xpix, 4)
+            .copy()
+        )
 
     def _save(self):
+        """Render and save the texture file, return True if written."""
         self.feedback.pushInfo(f"Save terrain texture file: <{self.filepath}>")
         # Calc tex_extent size in meters (it is in utm)
         tex_extent_xm = self.tex_extent.xMaximum() - self.tex_extent.xMinimum()
@@ -48,45 +203,272 @@ class Texture:
         # Calc tex_extent size in pixels
         tex_extent_xpix = int(tex_extent_xm / self.pixel_size)
         tex_extent_ypix = int(tex_extent_ym / self.pixel_size)
-        # Choose exporting layers
-        if self.tex_layer:  # use user tex layer
-            layers = (self.tex_layer,)
-        elif iface:  # no user tex layer, use map canvas
-            canvas = iface.mapCanvas()
-            layers = canvas.layers()
-        else:
+        # Check exporting layers
+        if not self.layers:
             self.feedback.pushInfo(f"No texture requested.")
-            return
-        # Image settings and texture layer choice
-        settings = QgsMapSettings()  # build settings
-        settings.setDestinationCrs(self.utm_crs)  # set output crs
-        settings.setExtent(self.tex_extent)  # in utm_crs
-        settings.setOutputSize(QSize(tex_extent_xpix, tex_extent_ypix))
-        settings.setLayers(layers)
-        # Render and save image
-        render = QgsMapRendererParallelJob(settings)
-        render.start()
+            return False
+        # Render by tiles, streamed into a temporary GeoTIFF,
+        # so that peak memory is bounded by the tile size.
+        # Tiles lay on a fixed grid anchored to the pixel phase of the extent,
+        # so that overlapping exports share and reuse the cached tiles.
         t0 = time.time()
-        dt = 0.
-        while render.isActive():
-            dt = time.time() - t0
-            QCoreApplication.processEvents()
-            if self.feedback.isCanceled():
-                render.cancelWithoutBlocking()
-                return
-            if dt >= self.timeout:
-                render.cancelWithoutBlocking()
-                self.feedback.reportError("Texture render timed out, no texture saved.")
-                return
-        image = render.renderedImage()
+        ps, ts = self.pixel_size, self.tile_size
+        x_phase = self.tex_extent.xMinimum() % ps
+        y_phase = self.tex_extent.yMaximum() % ps
+        col0 = round((self.tex_extent.xMinimum() - x_phase) / ps)  # grid pixel idx
+        row0 = round((y_phase - self.tex_extent.yMaximum()) / ps)  # north to south
+        col1, row1 = col0 + tex_extent_xpix, row0 + tex_extent_ypix
+        tile_cols = range(col0 // ts, (col1 - 1) // ts + 1)
+        tile_rows = range(row0 // ts, (row1 - 1) // ts + 1)
+        ntiles = len(tile_cols) * len(tile_rows)
+        self.feedback.pushInfo(
+            f"Render {tex_extent_xpix}x{tex_extent_ypix} px texture in {ntiles} tiles..."
+        )
+        cache = self._get_cache()
+        layers_key = self._get_layers_key()
+        self._cache_hits = 0
         try:
             os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
-            image.save(self.filepath, self.image_type)
+            fd, tmp_filepath = tempfile.mkstemp(
+                suffix=".tif", dir=os.path.dirname(self.filepath)
+            )
+            os.close(fd)
+            tmp = gdal.GetDriverByName("GTiff").Create(
+                tmp_filepath,
+                tex_extent_xpix,
+                tex_extent_ypix,
+                4,
+                gdal.GDT_Byte,
+                options=["TILED=YES", "BIGTIFF=IF_SAFER"],
+            )
         except Exception as err:
             raise QgsProcessingException(
                 f"Texture file not writable to <{self.filepath}>.\n{err}"
             )
-        self.feedback.pushInfo(f"Texture saved in {dt:.2f} s")
+        try:
+            itile = 0
+            for tile_row in tile_rows:
+                for tile_col in tile_cols:
+                    # Clip the grid tile to the texture, as the border tiles overhang
+                    c0, c1 = max(col0, tile_col * ts), min(col1, (tile_col + 1) * ts)
+                    r0, r1 = max(row0, tile_row * ts), min(row1, (tile_row + 1) * ts)
+                    extent = QgsRectangle(
+                        x_phase + c0 * ps,
+                        y_phase - r1 * ps,
+                        x_phase + c1 * ps,
+                        y_phase - r0 * ps,
+                    )
+                    rgba = self._get_tile(
+                        cache=cache,
+                        layers_key=layers_key,
+                        extent=extent,
+                        xpix=c1 - c0,
+                        ypix=r1 - r0,
+                    )
+                    if rgba is None:
+                        return False  # timed out or canceled
+                    for band in range(4):
+                        tmp.GetRasterBand(band + 1).WriteArray(
+                            rgba[:, :, band], c0 - col0, r0 - row0
+                        )
+                    itile += 1
+                    self.feedback.setProgress(int(itile / ntiles * 100))
+            tmp.FlushCache()
+            self._encode(tmp)
+        except Exception as err:
+            raise QgsProcessingException(
+                f"Texture file not writable to <{self.filepath}>.\n{err}"
+            )
+        finally:
+            tmp = None  # close
+            gdal.Unlink(tmp_filepath)
+            cache.evict()
+        self.feedback.pushInfo(
+            f"Texture saved in {time.time() - t0:.2f} s ({self._cache_hits}/{ntiles} cached tiles)"
+        )
+        return True
+
+    def _encode(self, ds):
+        """!
+        Encode the RGBA GDAL dataset to the texture file.
+        If its size is over budget, write a pyramid of downscaled variants,
+        and reference the first one that fits.
+        """
+        driver = self._drivers[self.image_type]
+        options = {
+            "PNG": [f"ZLEVEL={self.zlevel}"],
+            "JPEG": [f"QUALITY={self.quality}"],
+            "WEBP": [f"QUALITY={self.quality}"],
+        }[driver]
+        bands = driver == "JPEG" and [1, 2, 3] or [1, 2, 3, 4]  # JPEG has no alpha
+        xpix, ypix = ds.RasterXSize, ds.RasterYSize
+        self.filenames = list()  # all the written variants
+        level = 0
+        while True:
+            filename = level and f"{self.name}_tex_{level}.{self.image_type}"
+            filename = filename or f"{self.name}_tex.{self.image_type}"
+            filepath = os.path.join(self.path, filename)
+
+            def write(tmp_filepath):
+                # GDAL streams the encoding by blocks
+                out = gdal.Translate(
+                    tmp_filepath,
+                    ds,
+                    format=driver,
+                    bandList=bands,
+                    width=max(1, xpix >> level),
+                    height=max(1, ypix >> level),
+                    resampleAlg="average",
+                    creationOptions=options,
+                )
+                if not out:
+                    raise IOError(gdal.GetLastErrorMsg())
+                out = None  # close
+                aux_filepath = f"{tmp_filepath}.aux.xml"  # GDAL side car
+                if os.path.isfile(aux_filepath):
+                    os.remove(aux_filepath)
+
+            write_atomic(filepath, write)
+            self.filename, self.filepath = filename, filepath
+            self.filenames.append(filename)
+            filesize = os.path.getsize(filepath)
+            self.feedback.pushInfo(
+                f"Texture variant <{filename}>: {xpix >> level}x{ypix >> level} px, {filesize / 1e6:.1f} MB"
+            )
+            if not self.max_filesize or filesize <= self.max_filesize:
+                break
+            if min(xpix, ypix) >> (level + 1) < self.min_pixels:
+                self.feedback.reportError(
+                    f"Texture over the size budget, using the smallest variant <{filename}>."
+                )
+                break
+            level += 1
 
     def get_fds(self):
         return f"TERRAIN_IMAGE='{self.filename}'"
+
+
+class SavedTexture(Texture):
+    """
+    Texture saved by a previous export from the same inputs, not rendered again.
+    """
+
+    def __init__(self, feedback, filename, filenames) -> None:
+        self.feedback = feedback
+        self.filename = filename
+        self.filenames = filenames
+        self.is_saved = True
+        self.feedback.pushInfo(f"Texture unchanged, not rendered: <{filename}>")
+
+
+class HillshadeTexture(Texture):
+    """
+    Texture computed from the DEM hillshade and the landuse colors,
+    without the map renderer, eg. for headless runs.
+    """
+
+    azimuth = 315.0  # deg, light azimuth, clockwise from north
+    altitude = 45.0  # deg, light altitude
+    zfactor = 1.0  # vertical exaggeration
+    blend = 0.5  # hillshade strength over landuse colors
+
+    def __init__(
+        self,
+        feedback,
+        path,
+        name,
+        pixel_size,
+        utm_extent,
+        utm_crs,
+        dem_filepath,
+        landuse_filepath=None,
+        palette=None,
+        image_type="png",
+        zlevel=None,
+        quality=None,
+        max_filesize=None,
+    ) -> None:
+        self.feedback = feedback
+        self.pixel_size = pixel_size
+        self.utm_crs = utm_crs
+        self.dem_filepath = dem_filepath
+        self.landuse_filepath = landuse_filepath
+        self.palette = palette or dict()
+        self._init_encoding(path, name, image_type, zlevel, quality, max_filesize)
+        self.tex_extent = utm_extent
+
+        self.is_saved = self._save()
+
+    @staticmethod
+    def get_palette(landuse_layer, landuse_type):
+        """!
+        Get the landuse palette, from the main thread.
+        @return dict {landuse: (r, g, b)}, from the layer paletted style,
+        or from the RGB of the landuse type SURFs.
+        """
+        palette = dict()
+        if landuse_layer:
+            doc = QDomDocument()
+            landuse_layer.exportNamedStyle(doc)
+            palette = texture.get_palette_from_qml(doc.toString())
+        if not palette and landuse_type:
+            palette = texture.get_palette_from_surfs(landuse_type.surf_dict)
+        return palette
+
+    def _warp(self, filepath, xpix, ypix, resample_alg):
+        """Read a raster over the texture extent, in utm_crs, as np.array."""
+        ds = gdal.Warp(
+            "",
+            filepath,
+            format="MEM",
+            dstSRS=self.utm_crs.toWkt(),
+            outputBounds=(
+                self.tex_extent.xMinimum(),
+                self.tex_extent.yMinimum(),
+                self.tex_extent.xMaximum(),
+                self.tex_extent.yMaximum(),
+            ),
+            width=xpix,
+            height=ypix,
+            resampleAlg=resample_alg,
+        )
+        if not ds:
+            raise IOError(gdal.GetLastErrorMsg())
+        return ds.GetRasterBand(1).ReadAsArray()
+
+    def _save(self):
+        """Compute and save the texture file, return True if written."""
+        self.feedback.pushInfo(f"Save hillshade texture file: <{self.filepath}>")
+        t0 = time.time()
+        # Calc tex_extent size in meters (it is in utm)
+        tex_extent_xm = self.tex_extent.xMaximum() - self.tex_extent.xMinimum()
+        tex_extent_ym = self.tex_extent.yMaximum() - self.tex_extent.yMinimum()
+        # Calc tex_extent size in pixels
+        xpix = int(tex_extent_xm / self.pixel_size)
+        ypix = int(tex_extent_ym / self.pixel_size)
+        try:
+            elevation = self._warp(self.dem_filepath, xpix, ypix, "bilinear")
+            hillshade = texture.get_hillshade(
+                elevation,
+                pixel_size=(tex_extent_xm / xpix, tex_extent_ym / ypix),
+                azimuth=self.azimuth,
+                altitude=self.altitude,
+                zfactor=self.zfactor,
+            )
+            rgb = None
+            if self.landuse_filepath and self.palette:
+                landuse = self._warp(self.landuse_filepath, xpix, ypix, "near")
+                rgb = texture.get_landuse_rgb(landuse, self.palette)
+            image = texture.get_texture(hillshade, rgb, blend=self.blend)
+            ds = gdal.GetDriverByName("MEM").Create("", xpix, ypix, 4, gdal.GDT_Byte)
+            for band in range(3):
+                ds.GetRasterBand(band + 1).WriteArray(image[:, :, band])
+            ds.GetRasterBand(4).Fill(255)  # opaque
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            self._encode(ds)
+        except Exception as err:
+            raise QgsProcessingException(
+                f"Texture file not writable to <{self.filepath}>.\n{err}"
+            )
+        self.feedback.pushInfo(f"Texture saved in {time.time() - t0:.2f} s")
+        return True
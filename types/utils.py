@@ -10,6 +10,8 @@ __revision__ = "$Format:%H$"  # replaced with git SHA1
 import os
 from qgis.core import QgsProcessingException
 from qgis.utils import iface
+from ..core import terrain
+from ..core.manifest import write_atomic
 
 
 # Text util
@@ -27,43 +29,19 @@ def write_file(feedback, filepath, content):
     Write a text to filepath.
     """
     feedback.pushInfo(f"Save file: <{filepath}>")
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    try:
-        with open(filepath, "w") as f:
+
+    def write(tmp_filepath):
+        with open(tmp_filepath, "w") as f:
             f.write(content)
+
+    try:
+        write_atomic(filepath, write)
     except Exception as err:
         raise QgsProcessingException(
             f"File not writable to <{filepath}>, cannot proceed.\n{err}"
         )
 
 
-# The FDS bingeom file is written from Fortran90 like this:
-#      WRITE(731) INTEGER_ONE
-#      WRITE(731) N_VERTS,N_FACES,N_SURF_ID,N_VOLUS
-#      WRITE(731) VERTS(1:3*N_VERTS)
-#      WRITE(731) FACES(1:3*N_FACES)
-#      WRITE(731) SURFS(1:N_FACES)
-#      WRITE(731) VOLUS(1:4*N_VOLUS)
-
-import struct
-import numpy as np
-
-
-def _write_record(f, data):
-    """!
-    Write a record to a binary unformatted sequential Fortran90 file.
-    @param f: open Python file object in 'wb' mode.
-    @param data: np.array() of data.
-    """
-    # Calc start and end record tag
-    tag = len(data) * data.dtype.itemsize
-    # print(f"Write: record tag: {tag} dlen: {len(data)}\ndata: {data}")  # TODO log debug
-    # Write start tag, data, and end tag
-    f.write(struct.pack("i", tag))
-    data.tofile(f)
-    f.write(struct.pack("i", tag))
-
-
 def write_bingeom(
     feedback,
     filepath,
@@ -87,25 +65,18 @@ def write_bingeom(
     """
     feedback.pushInfo(f"Save bingeom file: <{filepath}>")
     try:
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, "wb") as f:
-            _write_record(f, np.array((geom_type,), dtype="int32"))  # was 1 only
-            _write_record(
-                f,
-                np.array(
-                    (
-                        len(fds_verts) // 3,
-                        len(fds_faces) // 3,
-                        n_surf_id,
-                        len(fds_volus) // 4,
-                    ),
-                    dtype="int32",
-                ),
-            )
-            _write_record(f, np.array(fds_verts, dtype="float64"))
-            _write_record(f, np.array(fds_faces, dtype="int32"))
-            _write_record(f, np.array(fds_surfs, dtype="int32"))
-            _write_record(f, np.array(fds_volus, dtype="int32"))
+        write_atomic(
+            filepath,
+            lambda tmp_filepath: terrain.write_bingeom(
+                filepath=tmp_filepath,
+                geom_type=geom_type,
+                n_surf_id=n_surf_id,
+                fds_verts=fds_verts,
+                fds_faces=fds_faces,
+                fds_surfs=fds_surfs,
+                fds_volus=fds_volus,
+            ),
+        )
     except Exception as err:
         raise QgsProcessingException(
             f"Bingeom file not writable to <{filepath}>, cannot proceed.\n{err}"
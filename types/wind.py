@@ -7,15 +7,26 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-import csv, os
+import os
+import numpy as np
 from qgis.core import QgsProcessingException
+from ..core import wind
 
 
 class Wind:
-    def __init__(self, feedback, project_path, filepath) -> None:
+    def __init__(
+        self,
+        feedback,
+        project_path,
+        filepath,
+        interval=0.0,
+        ws_tolerance=0.0,
+        wd_tolerance=0.0,
+    ) -> None:
         self.feedback = feedback
         self.filepath = filepath and os.path.join(project_path, filepath) or str()
         self._ws, self._wd = list(), list()
+        self._is_unwrapped = False
 
         # Check
         if not filepath:
@@ -25,28 +36,39 @@ class Wind:
 
         # Import
         try:
-            with open(self.filepath) as csv_file:
-                # wind csv file has an header line and three columns:
-                # time in seconds, wind speed in m/s, and direction in degrees
-                csv_reader = csv.reader(csv_file, delimiter=",")
-                next(csv_reader)  # skip header line
-                for r in csv_reader:
-                    self._ws.append(
-                        f"&RAMP ID='ws', T={float(r[0]):.1f}, F={float(r[1]):.1f} /"
-                    )
-                    self._wd.append(
-                        f"&RAMP ID='wd', T={float(r[0]):.1f}, F={float(r[2]):.1f} /"
-                    )
+            t, ws, wd = wind.read_csv(self.filepath)
         except Exception as err:
             raise QgsProcessingException(
                 f"Cannot import wind *.csv file: <{self.filepath}>:\n{err}"
             )
 
+        # Reduce
+        npoints = len(t)
+        if interval > 0.0:
+            t, ws, wd = wind.resample(t, ws, wd, interval=interval)
+        if ws_tolerance > 0.0 or wd_tolerance > 0.0:  # 0 keeps the channel exact
+            t, ws, wd = wind.simplify(
+                t, ws, wd, ws_tolerance=ws_tolerance, wd_tolerance=wd_tolerance
+            )
+        if len(t) < npoints:
+            self.feedback.pushInfo(
+                f"Wind points reduced from {npoints} to {len(t)} ({npoints - len(t)} removed)."
+            )
+
+        self._ws = [f"&RAMP ID='ws', T={ti:.1f}, F={f:.1f} /" for ti, f in zip(t, ws)]
+        self._wd = [f"&RAMP ID='wd', T={ti:.1f}, F={f:.1f} /" for ti, f in zip(t, wd)]
+        self._is_unwrapped = bool(np.any((wd < 0.0) | (wd > 360.0)))
+
     def get_fds(self) -> str:
         result = f"""
 Wind
 &WIND SPEED=1., RAMP_SPEED_T='ws', RAMP_DIRECTION_T='wd' /\n"""
         if self._ws:
+            if self._is_unwrapped:
+                result += (
+                    "Wind directions unwrapped out of 0-360°, eg. 370° is 10°,\n"
+                    "so that FDS interpolates them across north\n"
+                )
             result += "\n".join(("\n".join(self._ws), "\n".join(self._wd)))
         else:
             result += f"""! Example ramps for wind speed and direction
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import csv, os, time
+import numpy as np
+from osgeo import gdal
+from qgis.core import QgsProcessingException
+from . import utils
+from ..core import windfield
+
+
+class WindField:
+    """
+    Gridded wind field, from u and v rasters at several heights above ground,
+    written as per mesh initial velocity files.
+    """
+
+    def __init__(
+        self, feedback, project_path, filepath, path, name, domain, utm_crs, dem_filepath
+    ) -> None:
+        self.feedback = feedback
+        self.filepath = filepath and os.path.join(project_path, filepath) or str()
+        self.path = path
+        self.name = name
+        self.domain = domain
+        self.utm_crs = utm_crs
+        self.dem_filepath = dem_filepath
+        self.uvw_filenames = list()
+
+        # Check
+        if not filepath:
+            self.feedback.pushInfo(f"No wind field *.csv file.")
+            return
+        self.feedback.pushInfo(f"Import wind field *.csv file: <{self.filepath}>")
+
+        self._import()
+        self._save()
+
+    def _import(self) -> None:
+        self._heights, self._u_filepaths, self._v_filepaths = list(), list(), list()
+        try:
+            with open(self.filepath) as csv_file:
+                # wind field csv file has an header line and three columns:
+                # height above ground in meters, u and v raster filepaths
+                # (east and north wind components in m/s)
+                csv_reader = csv.reader(csv_file, delimiter=",")
+                next(csv_reader)  # skip header line
+                levels = sorted(
+                    (float(r[0]), r[1].strip(), r[2].strip()) for r in csv_reader if r
+                )
+        except Exception as err:
+            raise QgsProcessingException(
+                f"Cannot import wind field *.csv file: <{self.filepath}>:\n{err}"
+            )
+        if not levels or levels[0][0] <= 0.0:
+            raise QgsProcessingException(
+                f"Wind field heights should be positive, cannot proceed."
+            )
+        dirpath = os.path.dirname(self.filepath)
+        for height, u_filepath, v_filepath in levels:
+            self._heights.append(height)
+            self._u_filepaths.append(os.path.join(dirpath, u_filepath))
+            self._v_filepaths.append(os.path.join(dirpath, v_filepath))
+
+    def _warp(self, filepath, bounds, ncols, nrows):
+        """Read a raster on a mesh cell center grid, as np.array((nj, ni)), j to north."""
+        ds = gdal.Warp(
+            "",
+            filepath,
+            format="MEM",
+            dstSRS=self.utm_crs.toWkt(),
+            outputBounds=bounds,
+            width=ncols,
+            height=nrows,
+            resampleAlg="bilinear",
+            outputType=gdal.GDT_Float64,
+        )
+        if not ds:
+            raise IOError(gdal.GetLastErrorMsg())
+        return ds.GetRasterBand(1).ReadAsArray()[::-1]  # rows from south
+
+    def _save(self):
+        t0 = time.time()
+        ox, oy = self.domain.utm_origin.x(), self.domain.utm_origin.y()
+        heights = np.array(self._heights)
+        # Each mesh is a chunk, so that large grids do not fill the memory
+        for nm, (xb, ijk) in enumerate(self.domain.get_meshes()):
+            xc, yc, zc = windfield.get_mesh_grid(xb, ijk)
+            zc = self.domain.get_stretched_z(nm, zc)
+            dx, dy = xc[1] - xc[0], yc[1] - yc[0]
+            bounds = (  # cell center grid, ghost cells included
+                xc[0] - dx / 2 + ox,
+                yc[0] - dy / 2 + oy,
+                xc[-1] + dx / 2 + ox,
+                yc[-1] + dy / 2 + oy,
+            )
+            ncols, nrows = len(xc), len(yc)
+            try:
+                elevation = self._warp(self.dem_filepath, bounds, ncols, nrows)
+                uc = np.stack(
+                    [self._warp(f, bounds, ncols, nrows) for f in self._u_filepaths]
+                )
+                vc = np.stack(
+                    [self._warp(f, bounds, ncols, nrows) for f in self._v_filepaths]
+                )
+            except Exception as err:
+                raise QgsProcessingException(
+                    f"Cannot read wind field rasters:\n{err}"
+                )
+            if self.domain.north_bearing:  # east and north to domain x and y
+                uc, vc = windfield.rotate(uc, vc, self.domain.north_bearing)
+            u, v, w = windfield.get_face_velocities(
+                uc=uc, vc=vc, elevation=elevation, heights=heights, zc=zc
+            )
+            filename = f"{self.name}_uvw_m{nm + 1:03d}.csv"
+            filepath = os.path.join(self.path, filename)
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                windfield.write_uvw(filepath, u, v, w)
+            except Exception as err:
+                raise QgsProcessingException(
+                    f"File not writable to <{filepath}>, cannot proceed.\n{err}"
+                )
+            self.uvw_filenames.append(filename)
+            if self.feedback.isCanceled():
+                return
+        self.feedback.pushInfo(
+            f"Wind field saved for {len(self.uvw_filenames)} meshes in {time.time() - t0:.2f} s"
+        )
+
+    def get_comment(self) -> str:
+        return f"Wind field file: <{self.filepath and utils.shorten(self.filepath) or 'none'}>"
+
+    def get_fds(self) -> str:
+        if not self.uvw_filenames:
+            return str()
+        res = "\n".join(f"&CSVF UVWFILE='{f}' /" for f in self.uvw_filenames)
+        return f"""
+Wind field initial velocities, one per MESH in order
+{res}"""